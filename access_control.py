@@ -3,42 +3,133 @@
 '''
 access_control.py acts as the security gateway for the application, enforcing Confidentiality, Integrity, Availability and Access Control.
 
-1) When insert_patient is called, it allows only Group H and then secures the data by encrypting (Age, Gender) fields using AES-GCM.
+1) When insert_patient is called, it allows only Group H and then secures the data by encrypting (Age, Gender) fields using AES-GCM,
+packed together into a single envelope column (sensitive_enc); rows written in the older per-field format are still readable.
+insert_patients does the same for a whole batch: executemany in chunks, one transaction, one trusted-root refresh at the end.
 
 2) And sealing the row against tampering with an HMAC-SHA256 signature.
 
-3) To prevent history from being deleted, it tracks database state using Merkle Tree, saving a "trusted root" locally
+3) To prevent history from being deleted, it tracks database state using Merkle Tree, saving a "trusted root" locally.
+update_client_trust keeps the tree's right-edge frontier next to that root, so refreshing trust only appends the newly inserted leaves.
+With MERKLE_SHARD_SIZE set the saved state also lists the completed shard roots (merkle_forest.py), and a snapshot of the
+trusted tree's complete subtrees (merkle_diff.py) lets locate_tampering say which rows changed when the root no longer matches.
 
 4) when query_patients retrieves data, it validates the local Merkle root to detect deletions, 
 re-calculates HMACs to catch data tampering, decrypts the private fields, and automatically redacts names for Group R users to protect privacy.
+It is built on stream_patients, a generator that reads the table in fixed-size chunks so memory stays flat as the table grows.
+Rows that verified before (same id, HMAC and envelope, unchanged server root) come from row_cache.py instead of being decrypted again.
+
+5) get_patient is the point-lookup path: it fetches one row plus its Merkle proof from the server-side node table (merkle_store.py)
+and checks it against the trusted root, so a single-record lookup costs O(log n) regardless of table size.
+
+6) query_cohort filters on encrypted age/gender through keyed blind-index columns (gender_bidx, age_bidx), so the database
+returns only the matching rows instead of the whole table being decrypted in Python.
+
+7) find_patients is the query builder for pages: id ranges, keyset pagination (after_id), LIMIT and column projection are pushed
+into SQL, private fields are only decrypted when age/gender are requested, and the returned page is proven complete
+with a Merkle range proof (the page's leaves plus O(log n) boundary hashes) without reading the rest of the table.
+
+8) Read replicas: query, lookup, page and cohort reads go to a replica (config.db_conn("replica")) once its stored tree is
+shown to still start with the trusted tree (merkle_store.frontier_matches, O(log n) nodes). A replica that lags behind trust,
+or whose read then fails its Merkle check, is marked down and the read is served by the primary. Inserts and trust updates
+always use the primary.
+
+9) Key versions: rows carry key_version / hmac_version, and reads verify each row with that version's key from the keyring
+(config.load_keyring), so rows sealed before and after a key rotation read side by side (key_rotation.py re-seals them).
+Cohort queries search the blind-index tokens of every HMAC key version. A trusted root that a rotation batch replaced
+stays acceptable for ROTATE_ROOT_GRACE seconds (same rows, re-keyed), so reads in flight across a batch do not FAIL.
+trust_lock serializes every load-modify-save of the trusted state.
 '''
 
 import os
 import hmac
-from config import get_db_conn, load_keys
-from crypto_utils import encrypt_val, decrypt_val, compute_hmac, get_row_bytes
-from integrity import build_merkle_tree, sha256
+import json
+import time
+import threading
+from functools import lru_cache
+from contextlib import contextmanager
+from config import (db_conn, load_keys, load_keyring, replica_of, mark_replica_down, VERIFY_WORKERS, AGE_BUCKET_WIDTH,
+                    MERKLE_SHARD_SIZE, DB_REPLICAS, AES_KEY_VERSION, HMAC_KEY_VERSION, ROTATE_ROOT_GRACE)
+from crypto_utils import (decrypt_val, encrypt_envelope, decrypt_envelope, compute_hmac, get_row_bytes,
+                          derive_key, blind_index, INTEGRITY_FAIL)
+from integrity import (sha256, new_merkle_frontier, merkle_append, merkle_frontier_root, merkle_edge_nodes,
+                       verify_merkle_proof, verify_merkle_range)
+from merkle_store import (lock_frontier, append_leaves, fetch_proof, fetch_range_proof, fetch_count, fetch_root,
+                          frontier_matches)
+from merkle_forest import new_trust_state, build_trust_state, append_leaf, shard_bits, changed_shards
+from merkle_diff import write_snapshot, extend_snapshot, locate
+from auth import resolve_session
+from parallel_verify import get_verify_pool, submit_rows, collect_rows
+import row_cache
+from metrics import stage, count
+
+try:
+    import fcntl
+except ImportError:     # Windows: trust_lock is then per-process only
+    fcntl = None
 
 # File to store the trusted Merkle Root on the client side
 CLIENT_ROOT_FILE = "client_root.bin"
+# Incremental Merkle state (leaf count, last trusted row id, right-edge frontier) kept next to the root
+CLIENT_STATE_FILE = "client_merkle_state.json"
+# Roots replaced by key-rotation batches, accepted until they expire: [[root hex, leaf count, expiry time], ...]
+CLIENT_SUPERSEDED_FILE = "client_superseded_roots.json"
 
-def insert_patient(session, first, last, gender, age, weight, height, history):
-    """
-    Inserts a new patient. Only Group H allowed.
-    Encrypts sensitive fields and computes integrity data.
-    """
-    if session['user_group'] != 'H':
-        raise PermissionError("Access Denied: Group H only.")
+# Rows per executemany() call in insert_patients
+BULK_CHUNK_SIZE = 1000
+# Rows fetched and verified per round trip in stream_patients
+STREAM_CHUNK_SIZE = 500
+
+# New rows are always sealed with the current key versions (config ints, not user input)
+INSERT_SQL = f"""INSERT INTO patients 
+             (first_name, last_name, sensitive_enc, gender_bidx, age_bidx, weight, height, health_history, 
+              row_hmac, merkle_leaf, leaf_idx, key_version, hmac_version) 
+             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, {AES_KEY_VERSION:d}, {HMAC_KEY_VERSION:d})"""
+
+# Fields a find_patients projection may ask for ("id" and "integrity" are always returned)
+RESULT_FIELDS = ("first", "last", "age", "gender", "weight", "height", "history")
+PRIVATE_FIELDS = ("age", "gender")
+# Columns needed to check a row's HMAC and Merkle leaf without touching its ciphertext
+VERIFY_COLUMNS = "id, first_name, last_name, weight, height, health_history, row_hmac, hmac_version, leaf_idx"
+MAX_FIND_LIMIT = 10000
 
+NO_TRUST_STATUS = "No Local Trust Found (Please run Option 4 or 6 to Init)"
+REPLICA_FAIL_NOTE = " - read from a replica, now skipped; retry to read from the primary"
+GENDER_LABELS = {0: "Female", 1: "Male"}
+
+# Blind-index key label (derived from the HMAC key) and the oldest age a cohort query enumerates buckets up to
+BLIND_INDEX_LABEL = "blind-index-v1"
+MAX_AGE = 150
+
+def load_keys_or_fail(keyring=False):
+    """Current (aes, hmac) keys, or with keyring=True the Keyrings that also hold retired versions (for reads)."""
     try:
-        aes_k, hmac_k = load_keys()
+        return load_keyring() if keyring else load_keys()
     except Exception as e:
         # Friendly error: missing keys in .env
         raise RuntimeError("Crypto keys not found. Please set AES_KEY_B64 and HMAC_KEY_B64 in your .env (use Option 2 to generate).") from e
-    
-    # 1. Encrypt Sensitive Data (Age & Gender)
-    g_enc, g_n, g_t = encrypt_val(aes_k, int(gender))
-    a_enc, a_n, a_t = encrypt_val(aes_k, int(age))
+
+def key_for(keys, version):
+    """The key a row was sealed with: keys is one key (bytes) or a Keyring; rows from before versioning are version 1."""
+    if isinstance(keys, dict):
+        return keys.get(version or 1)
+    return keys
+
+@lru_cache(maxsize=4)
+def _blind_key(hmac_k):
+    return derive_key(hmac_k, BLIND_INDEX_LABEL)
+
+def blind_tokens(hmac_k, gender, age):
+    """(gender_bidx, age_bidx) search tokens for one patient; age is indexed by AGE_BUCKET_WIDTH-year bucket."""
+    key = _blind_key(hmac_k)
+    return (blind_index(key, "gender", int(gender)),
+            blind_index(key, f"age_bucket/{AGE_BUCKET_WIDTH}", int(age) // AGE_BUCKET_WIDTH))
+
+def seal_row(aes_k, hmac_k, first, last, gender, age, weight, height, history):
+    """Encrypts and MACs one patient, returning the parameter tuple for INSERT_SQL."""
+    # 1. Encrypt Sensitive Data (Age & Gender) in ONE AES-GCM envelope
+    envelope = encrypt_envelope(aes_k, {"gender": int(gender), "age": int(age)})
+    g_bidx, a_bidx = blind_tokens(hmac_k, gender, age)
     
     # 2. Integrity: Compute HMAC of the row data
     r_bytes = get_row_bytes(first, last, weight, height, history)
@@ -47,39 +138,263 @@ def insert_patient(session, first, last, gender, age, weight, height, history):
     # 3. Integrity: Compute Merkle Leaf (Hash of the HMAC)
     leaf = sha256(r_mac)
 
-    conn = get_db_conn()
-    cur = conn.cursor()
-    
-    sql = """INSERT INTO patients 
-             (first_name, last_name, gender_enc, gender_nonce, gender_tag, 
-              age_enc, age_nonce, age_tag, weight, height, health_history, 
-              row_hmac, merkle_leaf) 
-             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
-             
-    cur.execute(sql, (first, last, g_enc, g_n, g_t, a_enc, a_n, a_t, 
-                      weight, height, history, r_mac, leaf))
-    conn.commit()
-    conn.close()
+    return (first, last, envelope, g_bidx, a_bidx, weight, height, history, r_mac, leaf)
+
+def insert_patient(session, first, last, gender, age, weight, height, history):
+    """
+    Inserts a new patient. Only Group H allowed.
+    Encrypts sensitive fields and computes integrity data.
+    session: a login token or a user/session dict (see auth.resolve_session).
+    """
+    session = resolve_session(session)
+    if session['user_group'] != 'H':
+        raise PermissionError("Access Denied: Group H only.")
+
+    aes_k, hmac_k = load_keys_or_fail()
+    with stage("insert.seal"):
+        params = seal_row(aes_k, hmac_k, first, last, gender, age, weight, height, history)
+
+    with db_conn() as conn:
+        cur = conn.cursor(buffered=True)
+        try:
+            # Append the leaf to the server-side Merkle tree in the same transaction
+            with stage("insert.merkle"):
+                tree = lock_frontier(cur)
+                leaf_idx, = append_leaves(cur, tree, [params[-1]])
+            with stage("insert.db"):
+                cur.execute(INSERT_SQL, params + (leaf_idx,))
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
     print(" Record inserted successfully.")
 
 
-def update_client_trust():
+def insert_patients(session, rows, chunk_size=BULK_CHUNK_SIZE, update_trust=True):
     """
-    Downloads all merkle leaves from the server, computes the root, 
-    and saves it to a local file. This establishes 'Trust'.
+    Bulk insert. Only Group H allowed.
+    rows: iterable of (first, last, gender, age, weight, height, history) tuples.
+    Rows are sealed and written chunk_size at a time with executemany, all inside ONE transaction,
+    then the trusted Merkle root is refreshed once. Returns the number of rows inserted.
     """
-    conn = get_db_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT merkle_leaf FROM patients ORDER BY id")
-    leaves = [r[0] for r in cur.fetchall()]
-    conn.close()
-    
-    # Rebuild tree and save root
-    root, _ = build_merkle_tree(leaves)
+    session = resolve_session(session)
+    if session['user_group'] != 'H':
+        raise PermissionError("Access Denied: Group H only.")
+
+    aes_k, hmac_k = load_keys_or_fail()
+    total = 0
+
+    with db_conn() as conn:
+        cur = conn.cursor(buffered=True)
+        try:
+            with stage("insert.merkle"):
+                tree = lock_frontier(cur)
+
+            def flush(batch):
+                with stage("insert.merkle"):
+                    indexes = append_leaves(cur, tree, [params[-1] for params in batch])
+                with stage("insert.db"):
+                    cur.executemany(INSERT_SQL, [params + (i,) for params, i in zip(batch, indexes)])
+                return len(batch)
+
+            batch = []
+            for row in rows:
+                with stage("insert.seal"):
+                    batch.append(seal_row(aes_k, hmac_k, *row))
+                if len(batch) >= chunk_size:
+                    total += flush(batch)
+                    batch = []
+            if batch:
+                total += flush(batch)
+            with stage("insert.db"):
+                conn.commit()
+        except Exception:
+            # All-or-nothing: a failed chunk discards the whole batch
+            conn.rollback()
+            raise
+
+    count("insert.rows", total)
+    print(f" {total} records inserted successfully.")
+    if update_trust:
+        update_client_trust()
+    return total
+
+
+def load_client_state():
+    """
+    Loads the saved Merkle frontier. Returns None if missing or if it no longer matches
+    client_root.bin (e.g. the root was written by an older version), forcing a full rebuild.
+    """
+    if not os.path.exists(CLIENT_STATE_FILE):
+        return None
+    with open(CLIENT_STATE_FILE, "r") as f:
+        saved = json.load(f)
+    state = {
+        "count": saved["count"],
+        "frontier": [bytes.fromhex(h) if h else None for h in saved["frontier"]],
+    }
+    if merkle_frontier_root(state) != get_trusted_root():
+        return None
+    if MERKLE_SHARD_SIZE:
+        # Shard roots are only recorded as shards complete: a state saved without them (or for another size) is rebuilt
+        if saved.get("shard_bits") != shard_bits():
+            return None
+        state["shard_bits"] = saved["shard_bits"]
+        state["shard_roots"] = [bytes.fromhex(h) for h in saved["shard_roots"]]
+    return state, saved["last_id"]
+
+def save_client_state(state, last_id, root):
+    """Saves the frontier (with last_id and any shard roots) and the trusted root. Call it under trust_lock()."""
+    with open(CLIENT_STATE_FILE, "w") as f:
+        json.dump({
+            "count": state["count"],
+            "last_id": last_id,
+            "frontier": [h.hex() if h else None for h in state["frontier"]],
+            **({"shard_bits": state["shard_bits"], "shard_roots": [h.hex() for h in state["shard_roots"]]}
+               if "shard_roots" in state else {}),
+        }, f)
     with open(CLIENT_ROOT_FILE, "wb") as f:
         f.write(root)
+
+_trust_thread_lock = threading.RLock()
+_trust_lock_depth = threading.local()
+
+@contextmanager
+def trust_lock():
+    """
+    Serializes load-modify-save of the trusted state: between threads, and (via a lock file, where fcntl exists)
+    between processes such as the service, bulk_seed.py and key_rotation.py. Re-entrant within a thread.
+    """
+    with _trust_thread_lock:
+        depth = getattr(_trust_lock_depth, "n", 0)
+        if fcntl is None or depth:
+            _trust_lock_depth.n = depth + 1
+            try:
+                yield
+            finally:
+                _trust_lock_depth.n = depth
+            return
+        with open(CLIENT_STATE_FILE + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            _trust_lock_depth.n = 1
+            try:
+                yield
+            finally:
+                _trust_lock_depth.n = 0
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def supersede_root(root, leaf_count, grace=ROTATE_ROOT_GRACE):
+    """
+    Keeps a trusted root that a key-rotation batch just replaced acceptable for `grace` seconds, for trees of the same
+    leaf count only: the rows behind it are the same rows under the old keys, and reads that began before the batch
+    may still be proving against it. Expired entries are dropped here.
+    """
+    now = time.time()
+    kept = [e for e in _load_superseded() if e[2] > now]
+    if grace > 0:
+        kept.append([root.hex(), leaf_count, now + grace])
+    with open(CLIENT_SUPERSEDED_FILE + ".tmp", "w") as f:
+        json.dump(kept, f)
+    os.replace(CLIENT_SUPERSEDED_FILE + ".tmp", CLIENT_SUPERSEDED_FILE)
+
+def _load_superseded():
+    if not os.path.exists(CLIENT_SUPERSEDED_FILE):
+        return []
+    with open(CLIENT_SUPERSEDED_FILE, "r") as f:
+        return json.load(f)
+
+def superseded_roots(leaf_count):
+    """Roots replaced by key rotation that are still within their grace period, for a tree of leaf_count leaves."""
+    now = time.time()
+    return [bytes.fromhex(h) for h, n, expires in _load_superseded() if n == leaf_count and expires > now]
+
+def _accepted_roots(leaf_count):
+    """The trusted root first; the superseded ones are only read from disk if a proof against it fails."""
+    yield get_trusted_root()
+    yield from superseded_roots(leaf_count)
+
+def update_client_trust(full=False):
+    """
+    Extends the trusted Merkle root with rows added since the last update and saves it locally.
+    Only new leaves are downloaded and appended (O(log n) each), so the cost no longer depends on table size.
+    full=True (or no saved state) downloads every leaf and re-establishes 'Trust' from scratch;
+    with MERKLE_SHARD_SIZE set, that rebuild hashes the shards in parallel (merkle_forest.py).
+    """
+    with trust_lock():
+        _update_client_trust(full)
+
+def _update_client_trust(full):
+    loaded = None if full else load_client_state()
+    if loaded is None:
+        state, last_id = new_trust_state(), 0
+    else:
+        state, last_id = loaded
+
+    with stage("trust.fetch"), db_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, merkle_leaf FROM patients WHERE id > %s ORDER BY id", (last_id,))
+        rows = cur.fetchall()
+
+    with stage("trust.merkle"):
+        if loaded is None:
+            leaves = [bytes(leaf) for _, leaf in rows]
+            if MERKLE_SHARD_SIZE:
+                state = build_trust_state(leaves)
+            else:
+                for leaf in leaves:
+                    append_leaf(state, leaf)
+            write_snapshot(leaves)
+        else:
+            # Only the complete subtrees the new leaves close are added to the snapshot
+            old_count, formed = state["count"], []
+            for _, leaf in rows:
+                append_leaf(state, leaf, formed)
+            extend_snapshot(old_count, formed)
+        if rows:
+            last_id = rows[-1][0]
+    save_trusted_frontier(state, last_id)
+
+def load_trusted_frontier(expected_count):
+    """
+    The saved trust frontier, for a writer that appends leaves it generated itself (bulk_seed.py).
+    Returns a fresh frontier for an empty table, or None if the saved state does not end at exactly expected_count leaves.
+    """
+    loaded = load_client_state()
+    if loaded is None:
+        return new_trust_state() if expected_count == 0 else None
+    state, _ = loaded
+    return state if state["count"] == expected_count else None
+
+def save_trusted_frontier(state, last_id):
+    with stage("trust.merkle"):
+        root = merkle_frontier_root(state)
+    save_client_state(state, last_id, root)
     print(f" Trusted Root Updated: {root.hex()[:8]}...")
 
+def locate_tampering(session, deep=False):
+    """
+    Localizes a root mismatch (merkle_diff.py): the trusted snapshot is compared with the server's tree top-down,
+    and the leaf positions of the rows are scanned for rows deleted or added behind the tree's back.
+    deep=True also compares every row's leaf with the trusted one. RETURNS the report dict.
+    """
+    resolve_session(session)
+    loaded = load_client_state()
+    if loaded is None:
+        raise RuntimeError(NO_TRUST_STATUS)
+    with db_conn() as conn:
+        return locate(conn, loaded[0]["count"], deep)
+
+def find_changed_shards():
+    """
+    Completed shards whose server-side root no longer matches the trusted one (merkle_forest.changed_shards).
+    Returns a list of shard indexes, or None when sharding is off or no shard roots have been saved yet.
+    """
+    loaded = load_client_state() if MERKLE_SHARD_SIZE else None
+    if loaded is None:
+        return None
+    with db_conn() as conn:
+        return changed_shards(conn.cursor(buffered=True), loaded[0])
+
 def get_trusted_root():
     """Reads the locally saved trusted root."""
     if not os.path.exists(CLIENT_ROOT_FILE):
@@ -87,67 +402,464 @@ def get_trusted_root():
     with open(CLIENT_ROOT_FILE, "rb") as f:
         return f.read()
 
-def query_patients(session):
+def decrypt_private(aes_k, r):
     """
-    Fetches data, verifies Integrity/Completeness, and Redacts based on group.
-    RETURNS TWO VALUES: (results_list, status_message)
+    (gender, age) of a fetched row: from the envelope, or the legacy per-field columns if not migrated yet.
+    aes_k: a key or a Keyring; a row sealed under a version the keyring no longer holds fails like a bad tag.
     """
+    aes_k = key_for(aes_k, r.get('key_version'))
+    if aes_k is None:
+        return INTEGRITY_FAIL, INTEGRITY_FAIL
+    if r.get('sensitive_enc') is not None:
+        private = decrypt_envelope(aes_k, r['sensitive_enc'])
+        return private.get('gender', INTEGRITY_FAIL), private.get('age', INTEGRITY_FAIL)
+    return (decrypt_val(aes_k, r['gender_enc'], r['gender_nonce'], r['gender_tag'], int),
+            decrypt_val(aes_k, r['age_enc'], r['age_nonce'], r['age_tag'], int))
 
-    try:
-        aes_k, hmac_k = load_keys()
-    except Exception as e:
-        raise RuntimeError("Crypto keys not found. Please set AES_KEY_B64 and HMAC_KEY_B64 in  .env (use Option 2 to generate).")
+def hmac_ok(r, hmac_k):
+    """Re-computes the HMAC of the data received (with the row's hmac_version key) and compares it with the stored one."""
+    hmac_k = key_for(hmac_k, r.get('hmac_version'))
+    if hmac_k is None:
+        return False
+    raw = get_row_bytes(r['first_name'], r['last_name'], r['weight'], r['height'], r['health_history'])
+    return hmac.compare_digest(compute_hmac(hmac_k, raw), r['row_hmac'])
+
+def _verify_row(r, aes_k, hmac_k, decrypt=True):
+    """
+    Checks one fetched row's HMAC and decrypts its private fields. Returns the unredacted result dict.
+    decrypt=False skips AES-GCM entirely and leaves age/gender out of the result.
+    """
+    # 2. INTEGRITY CHECK (HMAC)
+    intact = hmac_ok(r, hmac_k)
 
-    conn = get_db_conn()
-    cur = conn.cursor(dictionary=True)
-    cur.execute("SELECT * FROM patients ORDER BY id")
-    rows = cur.fetchall()
-    conn.close()
+    result = {
+        "id": r['id'], 
+        "first": r['first_name'], 
+        "last": r['last_name'], 
+        "weight": r['weight'],
+        "height": r['height'],         
+        "history": r['health_history'],
+        "integrity": "Pass" if intact else "FAIL"
+    }
 
-    # 1. COMPLETENESS CHECK (Merkle Tree)
-    leaves = [r['merkle_leaf'] for r in rows]
-    server_root, _ = build_merkle_tree(leaves)
+    # 3. CONFIDENTIALITY (Decryption)
+    if decrypt:
+        gender, age = decrypt_private(aes_k, r)
+        result["age"] = age
+        result["gender"] = GENDER_LABELS.get(gender, INTEGRITY_FAIL)
+    return result
+
+def _cache_key(r):
+    """
+    (id, row_hmac, envelope): a changed ciphertext can never hit an entry decrypted from the old one.
+    Rows without an envelope (legacy format, or fetched without it) are not cached.
+    """
+    envelope = r.get('sensitive_enc')
+    return None if envelope is None else (r['id'], bytes(r['row_hmac']), bytes(envelope))
+
+def _cache_lookup(rows, hmac_k, cache_source):
+    """
+    Cached results for rows verified before, None for misses. The HMAC is re-checked on every hit (cheap next to AES-GCM),
+    so plaintext columns edited behind the stored HMAC are never answered from the cache.
+    """
+    if not cache_source:
+        return [None] * len(rows)
+    hits = []
+    for r in rows:
+        key = _cache_key(r)
+        hit = row_cache.get(key, cache_source) if key else None
+        hits.append(hit if hit is not None and hmac_ok(r, hmac_k) else None)
+    return hits
+
+def _merge_cached(rows, cached, checked, cache_source):
+    """Re-interleaves freshly verified rows with cache hits (row order preserved) and caches rows that passed."""
+    fresh = iter(checked)
+    merged = []
+    for r, hit in zip(rows, cached):
+        if hit is None:
+            hit = next(fresh)
+            # Only complete (decrypted) results are cached, so any later projection can be served from them
+            key = _cache_key(r) if cache_source else None
+            if key and hit['integrity'] == "Pass" and hit.get('age', INTEGRITY_FAIL) != INTEGRITY_FAIL:
+                row_cache.put(key, hit, cache_source)
+        merged.append(hit)
+    return merged
+
+def _sync_cache(conn):
+    """
+    Cached rows are only valid while the Merkle root of the server they were read from stays put, so the primary and
+    each replica have their own root and entries. Returns the cache source for this connection, or None when disabled.
+    """
+    if not row_cache.enabled():
+        return None
+    i = replica_of(conn)
+    source = "primary" if i is None else f"replica{i}"
+    cur = conn.cursor(buffered=True)
+    row_cache.sync_root(fetch_root(cur), source)
+    cur.close()
+    return source
+
+def _check_rows(rows, aes_k, hmac_k, cache_source, decrypt=True):
+    """Serially verifies rows; rows seen before with the same HMAC and envelope come from the cache and skip decryption."""
+    cached = _cache_lookup(rows, hmac_k, cache_source)
+    checked = [_verify_row(r, aes_k, hmac_k, decrypt) for r, hit in zip(rows, cached) if hit is None]
+    return _merge_cached(rows, cached, checked, cache_source)
+
+@contextmanager
+def _read_conn(loaded, role="replica"):
+    """
+    Connection for a verified read: a replica when one is up and its stored tree still starts with the trusted tree,
+    else the primary. A replica that lags behind or diverged from trust is marked down so the next reads skip it.
+    """
+    with db_conn(role) as conn:
+        i = replica_of(conn)
+        if i is None or loaded is None or frontier_matches(conn.cursor(buffered=True), loaded[0]):
+            yield conn
+            return
+    mark_replica_down(i, "stored Merkle tree does not contain the trusted tree (lagging or diverged)")
+    with db_conn() as conn:
+        yield conn
+
+def _replica_failed(i, failed, reason):
+    """True when a read served by replica i failed its check: the replica is marked down and the caller re-reads from the primary."""
+    if i is None or not failed:
+        return False
+    mark_replica_down(i, reason)
+    return True
+
+def _redact(result, session):
+    """4. ACCESS CONTROL (Redaction): If user is Group R (Reader), hide the names"""
+    if session['user_group'] == 'R':
+        result = dict(result, first="[REDACTED]", last="[REDACTED]")
+    return result
+
+def stream_patients(session, chunk_size=STREAM_CHUNK_SIZE, workers=VERIFY_WORKERS, role="replica"):
+    """
+    Streaming variant of query_patients with bounded memory.
+    Rows come off an unbuffered (server-side) cursor chunk_size at a time; each chunk is verified, decrypted and
+    redacted, and its leaves are folded into the Merkle root as they arrive.
+    With workers > 0 the HMAC checks and decryption run on a worker pool (parallel_verify.py) while the next chunk is fetched.
+    YIELDS ("row", result_dict) for every patient, then ONE final ("status", status_message) once all leaves are seen.
+    Closing the generator early (e.g. after the first N rows) skips the completeness check.
+    role="replica" reads from a replica that still holds the trusted tree (see _read_conn); a replica whose full read then
+    fails the root check is marked down, but its rows have already been yielded (query_patients re-reads from the primary).
+    """
+    session = resolve_session(session)
+    aes_k, hmac_k = load_keys_or_fail(keyring=True)
+    loaded = load_client_state()
     client_root = get_trusted_root()
-    
+    tree = new_merkle_frontier()
+    pool = get_verify_pool(_verify_row, aes_k, hmac_k, workers) if workers else None
+
+    with _read_conn(loaded, role) as conn:
+        source = replica_of(conn)
+        cache_source = _sync_cache(conn)
+        cur = conn.cursor(dictionary=True)
+        with stage("query.fetch"):
+            cur.execute("SELECT * FROM patients ORDER BY id")
+        exhausted = False
+        pending = []
+        try:
+            while not exhausted:
+                with stage("query.fetch"):
+                    rows = cur.fetchmany(chunk_size)
+                exhausted = not rows
+                count("query.rows", len(rows))
+                with stage("query.merkle"):
+                    for r in rows:
+                        merkle_append(tree, r['merkle_leaf'])
+
+                with stage("query.verify"):
+                    if pool is None:
+                        ready = _check_rows(rows, aes_k, hmac_k, cache_source)
+                    else:
+                        # Verified-row cache first; only misses go to the workers
+                        cached = _cache_lookup(rows, hmac_k, cache_source)
+                        misses = [r for r, hit in zip(rows, cached) if hit is None]
+                        # Hand this chunk to the workers, then emit the previous chunk while they run
+                        futures, pending = pending, (rows, cached, submit_rows(pool, misses))
+                        ready = _merge_cached(futures[0], futures[1], collect_rows(futures[2]), cache_source) if futures else []
+
+                with stage("query.redact"):
+                    ready = [_redact(result, session) for result in ready]
+                for result in ready:
+                    yield "row", result
+        finally:
+            if not exhausted:
+                # Stopped early: drain the rest of the result set so the connection can go back to the pool
+                while cur.fetchmany(chunk_size):
+                    pass
+            cur.close()
+
+    # 1. COMPLETENESS CHECK (Merkle Tree)
     root_status = "OK"
+    with stage("query.merkle"):
+        root = merkle_frontier_root(tree)
     if client_root is None:
-        root_status = "No Local Trust Found (Please run Option 4 or 6 to Init)"
-    elif server_root != client_root:
+        root_status = NO_TRUST_STATUS
+    elif root != client_root and root not in superseded_roots(tree["count"]):
         root_status = "FAIL (Data Deleted or Tampered!)"
+        if _replica_failed(source, True, "full read did not match the trusted root"):
+            root_status += REPLICA_FAIL_NOTE
+    yield "status", root_status
 
-    results = []
-    for r in rows:
-        # 2. INTEGRITY CHECK (HMAC)
-        # Re-compute hash of the data that received
-        raw = get_row_bytes(r['first_name'], r['last_name'], r['weight'], r['height'], r['health_history'])
-        calc_mac = compute_hmac(hmac_k, raw)
-        
-        # Compare with the HMAC stored in the database
-        hmac_ok = hmac.compare_digest(calc_mac, r['row_hmac'])
-
-        # 3. CONFIDENTIALITY (Decryption)
-        age = decrypt_val(aes_k, r['age_enc'], r['age_nonce'], r['age_tag'], int)
-        gender = decrypt_val(aes_k, r['gender_enc'], r['gender_nonce'], r['gender_tag'], int)
-        gender_str = "Male" if gender == 1 else "Female"
-
-        # 4. ACCESS CONTROL (Redaction)
-        f, l = r['first_name'], r['last_name']
-        
-        # If user is Group R (Reader), hide the names
-        if session['user_group'] == 'R':
-            f, l = "[REDACTED]", "[REDACTED]"
-            
-        results.append({
-            "id": r['id'], 
-            "first": f, 
-            "last": l, 
-            "age": age, 
-            "gender": gender_str, 
-            "weight": r['weight'],
-            "height": r['height'],         
-            "history": r['health_history'],
-            "integrity": "Pass" if hmac_ok else "FAIL"
-        })
+def query_patients(session):
+    """
+    Fetches data, verifies Integrity/Completeness, and Redacts based on group.
+    RETURNS TWO VALUES: (results_list, status_message)
+    """
+    for role in ("replica", "primary") if DB_REPLICAS else ("primary",):
+        results = []
+        root_status = None
+        for kind, item in stream_patients(session, role=role):
+            if kind == "row":
+                results.append(item)
+            else:
+                root_status = item
+        # A replica that failed the root check was marked down: confirm against the primary before reporting
+        if not root_status.endswith(REPLICA_FAIL_NOTE):
+            break
     
     # RETURN BOTH THE DATA AND THE STATUS
+    return results, root_status
+
+def get_patient(session, patient_id):
+    """
+    Verified point lookup: fetches ONE row plus its Merkle proof path (O(log n) sibling hashes),
+    checks the proof against the trusted root, checks the HMAC, and decrypts only that row.
+    RETURNS TWO VALUES: (result_dict or None, status_message)
+    """
+    session = resolve_session(session)
+    aes_k, hmac_k = load_keys_or_fail(keyring=True)
+    loaded = load_client_state()
+
+    for role in ("replica", "primary"):
+        with _read_conn(loaded, role) as conn:
+            source = replica_of(conn)
+            with stage("lookup.fetch"):
+                cur = conn.cursor(dictionary=True, buffered=True)
+                cur.execute("SELECT * FROM patients WHERE id = %s", (patient_id,))
+                r = cur.fetchone()
+
+            # 1. MEMBERSHIP CHECK (Merkle Proof against the trusted root)
+            if r is not None:
+                with stage("lookup.proof"):
+                    root_status = _proof_status(conn.cursor(buffered=True), loaded, r)
+        # A replica may not have the row yet (lag): ask the primary without marking it down. Only a failed proof does that
+        if r is None and source is not None:
+            continue
+        if not _replica_failed(source, r is not None and root_status.startswith("FAIL"),
+                               f"lookup of id {patient_id} failed its Merkle proof"):
+            break
+    if r is None:
+        return None, "Not Found"
+
+    with stage("lookup.verify"):
+        result = _verify_row(r, aes_k, hmac_k)
+    return _redact(result, session), root_status
+
+def _mismatch_status(cur, trusted_count):
+    """A proof that fails while the server tree has grown may just mean trust is stale; otherwise rows were removed or altered."""
+    if fetch_count(cur) != trusted_count:
+        return "FAIL (Proof mismatch; server changed since trust was saved - refresh trust or investigate)"
+    return "FAIL (Data Deleted or Tampered!)"
+
+def _proof_status(cur, loaded, r):
+    """Proves one row's leaf (sha256 of row_hmac) at its leaf_idx against the trusted root."""
+    if loaded is None:
+        return NO_TRUST_STATUS
+    if r['leaf_idx'] is None:
+        return "FAIL (Row missing from server Merkle index)"
+    trusted_count = loaded[0]["count"]
+    if r['leaf_idx'] >= trusted_count:
+        return "Not Covered by Local Trust (row added after last trust update)"
+    # The trusted tree's unfinished right edge comes from the saved frontier (the server overwrites it as rows are added)
+    proof = fetch_proof(cur, r['leaf_idx'], trusted_count, merkle_edge_nodes(loaded[0])) or []
+    leaf = sha256(r['row_hmac'])
+    if any(verify_merkle_proof(leaf, proof, root) for root in _accepted_roots(trusted_count)):
+        return "OK"
+    return _mismatch_status(cur, trusted_count)
+
+def _page_status(cur, loaded, rows, lower, upper):
+    """
+    Completeness of one find_patients page. Leaves are appended in id order, so the rows of an untouched id range sit on
+    consecutive leaf positions: a skipped or repeated position means a row was deleted (or duplicated).
+    The page is checked together with its neighbours, the row just before it (lower) and just after it (upper), so rows
+    deleted at the page's edges are caught too: with no lower neighbour the page must start at leaf 0, and with no upper
+    neighbour it must reach the end of the trusted tree. Neighbours and page are then proven as one range
+    (integrity.verify_merkle_range) with O(log n) boundary hashes.
+    """
+    if loaded is None:
+        return NO_TRUST_STATUS
+    trusted_count = loaded[0]["count"]
+    run = ([lower] if lower else []) + rows + ([upper] if upper else [])
+    if any(r['leaf_idx'] is None for r in run):
+        return "FAIL (Row missing from server Merkle index)"
+    if lower is None and run and run[0]['leaf_idx'] != 0:
+        return f"FAIL (Rows missing before id {run[0]['id']}: Data Deleted or Tampered!)"
+    for prev, nxt in zip(run, run[1:]):
+        if nxt['leaf_idx'] != prev['leaf_idx'] + 1:
+            return f"FAIL (Rows missing between id {prev['id']} and id {nxt['id']}: Data Deleted or Tampered!)"
+    if upper is None and (run[-1]['leaf_idx'] if run else -1) < trusted_count - 1:
+        return (f"FAIL (Rows missing after id {run[-1]['id']}: Data Deleted or Tampered!)" if run
+                else "FAIL (Table is empty but trust covers rows: Data Deleted or Tampered!)")
+
+    # Rows appended after the last trust update form a suffix of the run and cannot be proven yet
+    proven = [r for r in run if r['leaf_idx'] < trusted_count]
+    covered = [r for r in rows if r['leaf_idx'] < trusted_count]
+    uncovered = len(rows) - len(covered)
+    if rows and not covered:
+        return "Not Covered by Local Trust (rows added after last trust update)"
+    if proven:
+        lo = proven[0]['leaf_idx']
+        proof = fetch_range_proof(cur, lo, proven[-1]['leaf_idx'], trusted_count, merkle_edge_nodes(loaded[0]))
+        leaves = [sha256(r['row_hmac']) for r in proven]
+        if proof is None or not any(verify_merkle_range(leaves, lo, trusted_count, proof, root)
+                                    for root in _accepted_roots(trusted_count)):
+            return _mismatch_status(cur, trusted_count)
+    if not rows:
+        return "OK (empty page)"
+
+    status = f"OK (page of {len(covered)} rows proven complete: leaves {covered[0]['leaf_idx']}-{covered[-1]['leaf_idx']})"
+    if uncovered:
+        status += f" - {uncovered} newer rows not covered by local trust (refresh trust to include them)"
+    return status
+
+def _page_neighbours(cur, id_min, id_max, after_id, upper):
+    """
+    The rows just outside a page (None where the table ends): lower is the last row before the page's lower bound;
+    upper is the page's extra row, or else the first row past id_max. Only the columns _page_status needs are read.
+    """
+    starts = [v for v in (id_min, None if after_id is None else int(after_id) + 1) if v is not None]
+    lower = None
+    if starts:
+        cur.execute("SELECT id, row_hmac, leaf_idx FROM patients WHERE id < %s ORDER BY id DESC LIMIT 1",
+                    (max(int(v) for v in starts),))
+        lower = cur.fetchone()
+    if upper is None and id_max is not None:
+        cur.execute("SELECT id, row_hmac, leaf_idx FROM patients WHERE id > %s ORDER BY id LIMIT 1", (int(id_max),))
+        upper = cur.fetchone()
+    return lower, upper
+
+def find_patients(session, id_min=None, id_max=None, after_id=None, limit=None, columns=None):
+    """
+    Page query with pushdown, e.g. find_patients(s, after_id=500, limit=50, columns=["first", "last"]).
+    id_min/id_max (inclusive), after_id (keyset pagination) and LIMIT go into the SQL, so only the page is read.
+    columns: subset of RESULT_FIELDS; if neither age nor gender is asked for, the ciphertext is not even selected.
+    The HMAC is always checked, and the page's completeness is proven against the trusted root (see _page_status).
+    RETURNS THREE VALUES: (results_list, status_message, next_after_id or None when there are no more rows)
+    """
+    session = resolve_session(session)
+    aes_k, hmac_k = load_keys_or_fail(keyring=True)
+
+    columns = RESULT_FIELDS if columns is None else tuple(columns)
+    unknown = [c for c in columns if c not in RESULT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown column(s) {', '.join(unknown)}; choose from {', '.join(RESULT_FIELDS)}")
+    decrypt = any(c in PRIVATE_FIELDS for c in columns)
+
+    conds, params = [], []
+    if id_min is not None:
+        conds.append("id >= %s")
+        params.append(int(id_min))
+    if id_max is not None:
+        conds.append("id <= %s")
+        params.append(int(id_max))
+    if after_id is not None:
+        conds.append("id > %s")
+        params.append(int(after_id))
+    limit = min(int(limit), MAX_FIND_LIMIT) if limit is not None else MAX_FIND_LIMIT
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+
+    where = f" WHERE {' AND '.join(conds)}" if conds else ""
+    select = "*" if decrypt else VERIFY_COLUMNS
+    loaded = load_client_state()
+    for role in ("replica", "primary"):
+        with _read_conn(loaded, role) as conn:
+            source = replica_of(conn)
+            cache_source = _sync_cache(conn)
+            cur = conn.cursor(dictionary=True, buffered=True)
+            # One extra row tells whether another page follows
+            with stage("find.fetch"):
+                cur.execute(f"SELECT {select} FROM patients{where} ORDER BY id LIMIT %s", params + [limit + 1])
+                rows = cur.fetchall()
+            more = len(rows) > limit
+            upper = rows[limit] if more else None
+            rows = rows[:limit]
+            with stage("find.proof"):
+                lower, upper = _page_neighbours(cur, id_min, id_max, after_id, upper)
+                root_status = _page_status(conn.cursor(buffered=True), loaded, rows, lower, upper)
+        if not _replica_failed(source, root_status.startswith("FAIL"), "page failed its Merkle range proof"):
+            break
+    count("find.rows", len(rows))
+
+    with stage("find.verify"):
+        checked = _check_rows(rows, aes_k, hmac_k, cache_source, decrypt)
+    keep = ("id",) + columns + ("integrity",)
+    with stage("find.redact"):
+        results = [{k: v for k, v in _redact(result, session).items() if k in keep} for result in checked]
+    return results, root_status, (rows[-1]['id'] if more else None)
+
+def _parse_gender(gender):
+    """Accepts 0/1 or Female/Male (any case, or F/M)."""
+    text = str(gender).strip().lower()
+    if text in ("1", "m", "male"):
+        return 1
+    if text in ("0", "f", "female"):
+        return 0
+    raise ValueError("Gender must be 0/1 or Female/Male")
+
+def query_cohort(session, gender=None, age_min=None, age_max=None):
+    """
+    Cohort query over encrypted fields, e.g. query_cohort(s, gender="Male", age_min=40, age_max=60).
+    The predicates are pushed into SQL as blind-index tokens (gender, and every age bucket overlapping the range),
+    so only matching rows are transferred, verified and decrypted; exact age bounds are applied after decryption.
+    Rows whose age fails to decrypt are kept (flagged) rather than silently dropped.
+    RETURNS TWO VALUES: (results_list, status_message)
+    """
+    session = resolve_session(session)
+    aes_k, hmac_k = load_keys_or_fail(keyring=True)
+    # During a key rotation rows carry tokens of either HMAC key version, so every version's tokens are searched
+    keys = [_blind_key(k) for k in hmac_k.values()]
+
+    conds, params = [], []
+    if gender is not None:
+        g = _parse_gender(gender)
+        conds.append(f"gender_bidx IN ({', '.join(['%s'] * len(keys))})")
+        params.extend(blind_index(key, "gender", g) for key in keys)
+    if age_min is not None or age_max is not None:
+        lo = max(int(age_min or 0), 0)
+        hi = min(int(age_max if age_max is not None else MAX_AGE), MAX_AGE)
+        buckets = range(lo // AGE_BUCKET_WIDTH, hi // AGE_BUCKET_WIDTH + 1)
+        if not buckets:
+            return [], "OK (empty age range)"
+        conds.append(f"age_bidx IN ({', '.join(['%s'] * (len(buckets) * len(keys)))})")
+        params.extend(blind_index(key, f"age_bucket/{AGE_BUCKET_WIDTH}", b) for key in keys for b in buckets)
+
+    where = f" WHERE {' AND '.join(conds)}" if conds else ""
+    with _read_conn(load_client_state()) as conn:
+        cache_source = _sync_cache(conn)
+        with stage("cohort.fetch"):
+            cur = conn.cursor(dictionary=True, buffered=True)
+            cur.execute(f"SELECT * FROM patients{where} ORDER BY id", params)
+            rows = cur.fetchall()
+            cur.execute("SELECT 1 FROM patients WHERE gender_bidx IS NULL OR age_bidx IS NULL LIMIT 1")
+            unindexed = cur.fetchone() is not None
+        count("cohort.rows", len(rows))
+
+    with stage("cohort.verify"):
+        checked = _check_rows(rows, aes_k, hmac_k, cache_source)
+    results = []
+    for result in checked:
+        age = result['age']
+        if age_min is not None and age != INTEGRITY_FAIL and age < int(age_min):
+            continue
+        if age_max is not None and age != INTEGRITY_FAIL and age > int(age_max):
+            continue
+        results.append(_redact(result, session))
+
+    root_status = "Not Checked (cohort subset; completeness needs a full read)"
+    if unindexed:
+        root_status += " - WARNING: some rows have no blind index yet (run: python migrations.py blind-index)"
     return results, root_status
\ No newline at end of file
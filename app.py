@@ -3,28 +3,34 @@
 '''
 app.py serves as Central Controller and Command Line Interface (CLI). 
 It orchestrates the entire application by importing and executing logic from all the other modules based on user input.
+Modules are imported inside the menu branch that needs them, so the menu appears without loading Faker, MySQL or crypto code.
+For scripted / cron use see cli.py.
 '''
 
-import sys
 import base64
 from getpass import getpass
-from Crypto.Random import get_random_bytes
-from dotenv import load_dotenv
-
-# Import Logic
-from db_setup import run_schema_native
-from auth import create_user, login
-from populate import seed_data
-from access_control import insert_patient, query_patients, update_client_trust
 
 def gen_keys():
+    from Crypto.Random import get_random_bytes
     aes = base64.b64encode(get_random_bytes(32)).decode()
     hmac = base64.b64encode(get_random_bytes(32)).decode()
     print("\n Generated new keys:")
     print(f"\nAES_KEY_B64={aes}\nHMAC_KEY_B64={hmac}")
     print("\n PASTE THESE INTO .env FILE")
 
+def ensure_session(token, prompt="Username: ", group=None):
+    """Reuses the current login token while it is valid (no PBKDF2 re-check); otherwise asks for credentials."""
+    from auth import login_token, validate_token
+    sess = validate_token(token) if token else None
+    if sess and (group is None or sess['user_group'] == group):
+        return token, sess
+    u = input(prompt)
+    p = getpass("Password: ")
+    token = login_token(u, p)
+    return token, (validate_token(token) if token else None)
+
 def main():
+    token = None
     while True:
         print("\n=== SECURE DB PROJECT MENU ===")
         print("1. Setup Database (Schema)")
@@ -34,86 +40,129 @@ def main():
         print("5. Login & Query (Read Data)")
         print("6. Manual Insert (Group H Only)")
         print("7. Create New User")
+        print("8. Logout")
         print("0. Exit")
         
         choice = input("Choice: ")
         
         if choice == "1":
+            from db_setup import run_schema_native
             run_schema_native()
 
         elif choice == "2":
             gen_keys()
 
         elif choice == "3":
+            from auth import create_user
             create_user("doctor", "pwd_d", "H")
             create_user("researcher", "pwd_r", "R")
             print("Default users check complete.")
 
         elif choice == "4":
+            from populate import seed_data
             try:
                 seed_data(100)
             except RuntimeError as e:
                 print(f"ERROR: {e}")
 
         elif choice == "5":
-            u = input("Username: ")
-            p = getpass("Password: ")
-            sess = login(u, p)
+            token, sess = ensure_session(token)
             if sess:
+                from access_control import find_patients, get_patient, query_cohort
                 print(f"Logged in as Group: {sess['user_group']}")
                 
                 #SUB-MENU FOR QUERY
                 print("\n   [1] View Top N Rows")
                 print("   [2] Search by Specific ID")
+                print("   [3] Cohort Filter (Gender / Age Range)")
+                print("   [4] Locate Tampering (after a FAIL)")
                 q_type = input("   Select Query Type: ").strip()
                 
-                # Fetch ALL data first (Required for Completeness/Merkle Check)
-                
-                try:
-                    results, status = query_patients(sess)
-                except RuntimeError as e:
-                    print(f"ERROR: {e}")
-                    continue
-
-                print(f"\nCompleteness Check: {status}")
-                print(f"{'ID':<5} {'First':<15} {'Last':<15} {'Age':<5} {'Gender':<10} {'Integrity'}")
-                print("-" * 65)
-
-                if q_type == "2":
-                    # SEARCH BY ID LOGIC
+                if q_type == "4":
+                    # Which rows changed since trust: top-down tree diff + leaf-position scan
+                    from access_control import locate_tampering
+                    from merkle_diff import format_report
+                    try:
+                        report = locate_tampering(token)
+                    except (RuntimeError, ValueError) as e:
+                        print(f"ERROR: {e}")
+                        continue
+                    print("\n".join(format_report(report)))
+
+                elif q_type == "2":
+                    # SEARCH BY ID LOGIC (one row + Merkle proof, no full-table download)
                     try:
                         target_id = int(input("   Enter Patient ID to find: "))
-                        found = False
-                        for r in results:
-                            if r['id'] == target_id:
-                                print(f"{r['id']:<5} {r['first']:<15} {r['last']:<15} {r['age']:<5} {r['gender']:<10} {r['integrity']}")
-                                found = True
-                                break
-                        if not found:
-                            print(f"Patient ID {target_id} not found.")
                     except ValueError:
                         print("Invalid ID format.")
+                        continue
+                    try:
+                        r, status = get_patient(token, target_id)
+                    except (RuntimeError, PermissionError) as e:
+                        print(f"ERROR: {e}")
+                        continue
+
+                    print(f"\nMerkle Proof Check: {status}")
+                    print(f"{'ID':<5} {'First':<15} {'Last':<15} {'Age':<5} {'Gender':<10} {'Integrity'}")
+                    print("-" * 65)
+                    if r:
+                        print(f"{r['id']:<5} {r['first']:<15} {r['last']:<15} {r['age']:<5} {r['gender']:<10} {r['integrity']}")
+                    else:
+                        print(f"Patient ID {target_id} not found.")
                 
+                elif q_type == "3":
+                    # COHORT LOGIC (filters pushed into SQL via blind indexes)
+                    g_in = input("   Gender (0=Female, 1=Male, blank=any): ").strip()
+                    lo_in = input("   Min Age (blank=any): ").strip()
+                    hi_in = input("   Max Age (blank=any): ").strip()
+                    try:
+                        results, status = query_cohort(
+                            token,
+                            gender=g_in or None,
+                            age_min=int(lo_in) if lo_in else None,
+                            age_max=int(hi_in) if hi_in else None,
+                        )
+                    except (RuntimeError, PermissionError, ValueError) as e:
+                        print(f"ERROR: {e}")
+                        continue
+
+                    print(f"\nCompleteness Check: {status}")
+                    print(f"{'ID':<5} {'First':<15} {'Last':<15} {'Age':<5} {'Gender':<10} {'Integrity'}")
+                    print("-" * 65)
+                    for r in results:
+                        print(f"{r['id']:<5} {r['first']:<15} {r['last']:<15} {r['age']:<5} {r['gender']:<10} {r['integrity']}")
+                    print(f"({len(results)} matching rows)")
+
                 else:
                     #DEFAULT TOP N ROWS LOGIC
                     limit_input = input("   How many rows to display? [Default 15]: ").strip()
                     limit = int(limit_input) if limit_input.isdigit() else 15
-                    
-                    for r in results[:limit]: 
+
+                    print(f"{'ID':<5} {'First':<15} {'Last':<15} {'Age':<5} {'Gender':<10} {'Integrity'}")
+                    print("-" * 65)
+
+                    # Only the first N rows are read (LIMIT pushed into SQL). The page is proven complete together with
+                    # its next row and must start at leaf 0, so rows deleted before, inside or right after it are caught
+                    try:
+                        results, status, next_id = find_patients(token, limit=limit)
+                    except (RuntimeError, PermissionError) as e:
+                        print(f"ERROR: {e}")
+                        continue
+
+                    for r in results:
                         print(f"{r['id']:<5} {r['first']:<15} {r['last']:<15} {r['age']:<5} {r['gender']:<10} {r['integrity']}")
-                    
-                    if len(results) > limit:
-                        print(f"... ({len(results) - limit} more rows hidden) ...")
+                    if next_id is not None:
+                        print("... (more rows hidden) ...")
+                    print(f"\nCompleteness Check: {status}")
 
             else:
                 print("Login Failed")
 
         elif choice == "6":
-            u = input("Username (Group H): ")
-            p = getpass("Password: ")
-            sess = login(u, p)
+            token, sess = ensure_session(token, "Username (Group H): ", group='H')
             
             if sess and sess['user_group'] == 'H':
+                from access_control import insert_patient, update_client_trust
                 print("\n--- Enter Patient Details ---")
                 try:
                     f_name = input("First Name: ")
@@ -124,7 +173,7 @@ def main():
                     height = float(input("Height (cm): "))
                     hist = input("Health History (text): ")
                     
-                    insert_patient(sess, f_name, l_name, gender, age, weight, height, hist)
+                    insert_patient(token, f_name, l_name, gender, age, weight, height, hist)
                     update_client_trust()
                 except ValueError:
                     print("Error: Please enter valid numbers for Age/Weight/Height.")
@@ -134,6 +183,7 @@ def main():
                 print("Access Denied: Only Group H can insert data.")
 
         elif choice == "7":
+            from auth import create_user
             print("\n--- Create New User ---")
             new_u = input("New Username: ").strip()
             new_p = getpass("New Password: ")
@@ -145,6 +195,13 @@ def main():
                 create_user(new_u, new_p, new_g)
                 print(f"User '{new_u}' added to Group '{new_g}'.")
 
+        elif choice == "8":
+            if token:
+                from auth import revoke_token
+                revoke_token(token)
+                token = None
+            print("Logged out.")
+
         elif choice == "0":
             print("Exiting.")
             break
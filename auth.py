@@ -8,13 +8,40 @@ then protects credentials by Salted Hashing—generating (unique random "salt")
 
 2) When a user attempts to access the system via login, the script retrieves their stored credentials and verifies their identity
 by using verify_password to re-hash the input password with the stored salt, confirming access only if the result matches the database record perfectly.
+The 100k-iteration PBKDF2 check runs on a small worker thread pool, so concurrent logins hash in parallel instead of queueing on the caller.
+
+3) Session Tokens: login_token pays the PBKDF2 cost once and issues a signed (HMAC-SHA256), expiring token backed by an in-memory session store.
+resolve_session turns a token (or a plain session dict) into {"username", "user_group"} for access_control; revoke_token ends a session early.
+With SESSION_STATELESS=1 and a shared SESSION_KEY_B64, a token issued by one process (e.g. `cli.py login`) is accepted by others
+from its signed claims alone, so scripts can reuse it without re-running PBKDF2.
 '''
 
 
 
-from config import get_db_conn
+import os
+import json
+import time
+import base64
+import hmac
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import db_conn, load_session_key, SESSION_TTL, LOGIN_WORKERS, SESSION_STATELESS
 from crypto_utils import hash_password, verify_password
-import mysql.connector
+from metrics import stage, timed, count
+from storage import integrity_errors
+
+# PBKDF2 runs here (hashlib releases the GIL while hashing)
+_hash_pool = ThreadPoolExecutor(max_workers=LOGIN_WORKERS, thread_name_prefix="pbkdf2")
+
+# In-memory session store: session id -> {"username", "user_group", "expires"}
+_sessions = {}
+_sessions_lock = threading.Lock()
+_session_key = load_session_key() or os.urandom(32)
+# Stateless tokens need a key every process shares; a per-process random key would make them useless elsewhere
+_stateless = SESSION_STATELESS and load_session_key() is not None
+# Sessions logged out in this process: sid -> expiry (stateless mode has no store entry to delete)
+_revoked = {}
 
 def create_user(username, password, group):
     """Register a new user (Group H or R)"""
@@ -23,32 +50,112 @@ def create_user(username, password, group):
         return
 
     salt, p_hash = hash_password(password)
-    conn = get_db_conn()
-    cur = conn.cursor()
     try:
-        cur.execute(
-            "INSERT INTO users (username, password_salt, password_hash, user_group) VALUES (%s, %s, %s, %s)",
-            (username, salt, p_hash, group)
-        )
-        conn.commit()
+        with db_conn() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "INSERT INTO users (username, password_salt, password_hash, user_group) VALUES (%s, %s, %s, %s)",
+                (username, salt, p_hash, group)
+            )
+            conn.commit()
         print(f"Created user {username} ({group})")
-    except mysql.connector.IntegrityError as e:
+    except integrity_errors():
         #for UNIQUE constraint violations
         print(f"User creation failed: username '{username}' may already exist.")
     except Exception as e:
         print(f"User creation failed: {e}")
-    finally:
-        conn.close()
 
 
+@timed("auth.login")
 def login(username, password):
     """Returns user dict if valid, else None"""
-    conn = get_db_conn()
-    cur = conn.cursor(dictionary=True)
-    cur.execute("SELECT * FROM users WHERE username = %s", (username,))
-    user = cur.fetchone()
-    conn.close()
+    with stage("auth.db"), db_conn() as conn:
+        # buffered: fetchone() would otherwise leave the result unread and block returning the connection to the pool
+        cur = conn.cursor(dictionary=True, buffered=True)
+        cur.execute("SELECT * FROM users WHERE username = %s", (username,))
+        user = cur.fetchone()
     
-    if user and verify_password(user['password_salt'], user['password_hash'], password):
-        return user
-    return None
\ No newline at end of file
+    # auth.pbkdf2 includes any wait for a free hashing thread; crypto.pbkdf2_verify is the hash alone
+    with stage("auth.pbkdf2"):
+        ok = user is not None and _hash_pool.submit(verify_password, user['password_salt'], user['password_hash'], password).result()
+    count("auth.login_ok" if ok else "auth.login_failed")
+    return user if ok else None
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _sign(payload):
+    return hmac.new(_session_key, payload, hashlib.sha256).digest()
+
+def login_token(username, password, ttl=SESSION_TTL):
+    """Logs in once and returns a signed session token (or None). Later calls present the token instead of the password."""
+    user = login(username, password)
+    if user is None:
+        return None
+
+    sid = os.urandom(16).hex()
+    now = int(time.time())
+    expires = now + ttl
+    with _sessions_lock:
+        # Drop sessions that expired without ever being presented again
+        for old_sid in [k for k, v in _sessions.items() if v["expires"] < now]:
+            del _sessions[old_sid]
+        for old_sid in [k for k, exp in _revoked.items() if exp < now]:
+            del _revoked[old_sid]
+        _sessions[sid] = {"username": user['username'], "user_group": user['user_group'], "expires": expires}
+
+    payload = json.dumps({"sid": sid, "u": user['username'], "g": user['user_group'], "exp": expires}).encode()
+    return f"{_b64(payload)}.{_b64(_sign(payload))}"
+
+def validate_token(token):
+    """Returns the session dict for a valid, unexpired, unrevoked token, else None."""
+    try:
+        payload_b64, sig_b64 = token.split(".")
+        payload = _unb64(payload_b64)
+        if not hmac.compare_digest(_sign(payload), _unb64(sig_b64)):
+            return None
+        claims = json.loads(payload)
+        sid, expires = claims["sid"], claims["exp"]
+    except (ValueError, TypeError, KeyError):
+        return None
+
+    if expires < time.time():
+        revoke_token(token)
+        return None
+    with _sessions_lock:
+        sess = _sessions.get(sid)
+        revoked = sid in _revoked
+    if sess is None:
+        if _stateless and not revoked:
+            # Issued by another process: trust the signed claims
+            return {"username": claims["u"], "user_group": claims["g"]}
+        return None  # revoked, or issued by another process
+    return {"username": sess["username"], "user_group": sess["user_group"]}
+
+def revoke_token(token):
+    """Ends a session (logout). Unknown or malformed tokens are ignored."""
+    try:
+        claims = json.loads(_unb64(token.split(".")[0]))
+        sid, expires = claims["sid"], claims["exp"]
+    except (ValueError, TypeError, KeyError):
+        return
+    with _sessions_lock:
+        _sessions.pop(sid, None)
+        if _stateless:
+            _revoked[sid] = expires
+
+def resolve_session(session):
+    """
+    Accepts either a session token or a user/session dict and returns the dict.
+    Raises PermissionError for expired or revoked tokens.
+    """
+    if isinstance(session, str):
+        sess = validate_token(session)
+        if sess is None:
+            raise PermissionError("Session expired or revoked. Please log in again.")
+        return sess
+    return session
\ No newline at end of file
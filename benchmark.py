@@ -0,0 +1,231 @@
+# benchmark.py
+
+'''
+benchmark.py is the reproducible Benchmark Suite, so performance changes can be measured and compared between commits.
+
+1) Stand-in Database: by default every table size runs against a fresh file of the embedded SQLite backend (storage.py)
+in a temporary directory, so no MySQL server is needed. With --backend mysql the same run goes to the configured server
+instead; DB_NAME must end in "_bench" because the patient and Merkle tables are emptied first.
+
+2) Measurements per table size: insert throughput (insert_patients), full trust rebuild, full verified query (cold and
+warm row cache), one find_patients page, point lookups (get_patient, p50/p95), pure Merkle build/root/append costs,
+login (DB + PBKDF2) and the process memory high-water mark.
+
+3) Isolation: each size runs in its own child process, so the memory high-water mark belongs to that size alone.
+Rows and lookup ids come from a fixed seed, so two runs do the same work.
+
+4) Results are written as JSON (git commit, Python version, platform, backend, metrics per size);
+`compare` prints the relative change of every metric between two result files.
+
+Run: python benchmark.py run [--sizes 1k,10k,100k,1M] [--backend sqlite|mysql] [--out FILE]
+     python benchmark.py compare OLD.json NEW.json
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+
+DEFAULT_SIZES = "1k,10k,100k"
+DEFAULT_SEED = 1234
+LOOKUPS = 200           # get_patient calls per size
+PAGE_SIZE = 100         # rows per find_patients page
+LOGINS = 3
+BENCH_USER = ("bench_h", "bench_pwd")
+
+# ---------- Backends ----------
+
+def _reset_mysql():
+    from config import db_conn, DB_NAME
+    if not DB_NAME.endswith("_bench"):
+        raise SystemExit(f"Refusing to benchmark against '{DB_NAME}': set DB_NAME to a throwaway *_bench database.")
+    with db_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM patients")
+        cur.execute("DELETE FROM merkle_nodes")
+        cur.execute("DELETE FROM users WHERE username = %s", (BENCH_USER[0],))
+        conn.commit()
+
+# ---------- Workload ----------
+
+def parse_sizes(text):
+    """'1k,10k,1M' -> [1000, 10000, 1000000]"""
+    mult = {"k": 1000, "m": 1000000}
+    sizes = []
+    for part in text.split(","):
+        part = part.strip().lower()
+        sizes.append(int(part[:-1]) * mult[part[-1]] if part[-1] in mult else int(part))
+    return sizes
+
+def generate_rows(count, seed):
+    """Deterministic (first, last, gender, age, weight, height, history) tuples."""
+    from populate import HISTORY_HEALTHY, HISTORY_MILD, HISTORY_SERIOUS
+    histories = HISTORY_HEALTHY + HISTORY_MILD + HISTORY_SERIOUS
+    rng = random.Random(seed)
+    for i in range(count):
+        yield (f"First{i}", f"Last{rng.randrange(10000)}", rng.randint(0, 1), rng.randint(18, 90),
+               round(rng.uniform(50.0, 120.0), 2), round(rng.uniform(150.0, 200.0), 2), rng.choice(histories))
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def _max_rss_kb():
+    try:
+        import resource
+    except ImportError:     # not available on Windows
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_size(size, seed):
+    """Runs every measurement for one table size in the current process. Returns {metric: value}."""
+    from auth import create_user, login
+    from access_control import insert_patients, update_client_trust, query_patients, find_patients, get_patient
+    from integrity import sha256, build_merkle_tree, compute_merkle_root, new_merkle_frontier, merkle_append
+    import row_cache
+
+    create_user(BENCH_USER[0], BENCH_USER[1], "H")
+    session = {"username": BENCH_USER[0], "user_group": "H"}
+    m = {"rows": size}
+
+    # 1. Writes
+    secs, _ = _timed(insert_patients, session, generate_rows(size, seed), update_trust=False)
+    m["insert_seconds"] = secs
+    m["insert_rows_per_sec"] = size / secs
+    m["trust_full_seconds"], _ = _timed(update_client_trust, full=True)
+
+    # 2. Full verified read (cold cache, then warm)
+    row_cache.clear()
+    m["query_cold_seconds"], (rows, status) = _timed(query_patients, session)
+    m["query_warm_seconds"], _ = _timed(query_patients, session)
+    m["query_status"] = status
+    ids = [r["id"] for r in rows]
+    del rows
+
+    # 3. One page from the middle of the table, and random point lookups
+    rng = random.Random(seed)
+    middle = ids[len(ids) // 2]
+    m["page_seconds"], (_, page_status, _) = _timed(find_patients, session, after_id=middle, limit=PAGE_SIZE)
+    m["page_status"] = page_status
+    row_cache.clear()
+    lookups = []
+    for pid in (rng.choice(ids) for _ in range(LOOKUPS)):
+        secs, _ = _timed(get_patient, session, pid)
+        lookups.append(secs * 1000)
+    m["lookup_p50_ms"] = _percentile(lookups, 50)
+    m["lookup_p95_ms"] = _percentile(lookups, 95)
+
+    # 4. Merkle primitives without the database
+    leaves = [sha256(i.to_bytes(8, "big")) for i in range(size)]
+    m["merkle_build_seconds"], _ = _timed(build_merkle_tree, leaves)
+    m["merkle_root_seconds"], _ = _timed(compute_merkle_root, leaves)
+    state = new_merkle_frontier()
+    secs, _ = _timed(lambda: [merkle_append(state, leaf) for leaf in leaves])
+    m["merkle_append_us"] = secs / size * 1e6
+
+    # 5. Login (DB lookup + PBKDF2)
+    logins = [_timed(login, *BENCH_USER)[0] * 1000 for _ in range(LOGINS)]
+    m["login_ms"] = sum(logins) / len(logins)
+
+    m["max_rss_kb"] = _max_rss_kb()
+    return m
+
+# ---------- Driver ----------
+
+def _child(args):
+    """Entry point of the per-size child process."""
+    os.environ.setdefault("AES_KEY_B64", "YmVuY2gtYWVzLWtleS0wMDAwMDAwMDAwMDAwMDAwMDA=")
+    os.environ.setdefault("HMAC_KEY_B64", "YmVuY2gtaG1hYy1rZXktMDAwMDAwMDAwMDAwMDAwMDA=")
+    # Must be set before config is first imported
+    os.environ["DB_BACKEND"] = args.backend
+    if args.backend == "sqlite":
+        os.environ["SQLITE_PATH"] = os.path.join(os.getcwd(), "bench.db")
+    else:
+        _reset_mysql()
+    result = run_size(args.size, args.seed)
+    with open(args.result, "w") as f:
+        json.dump(result, f)
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def run(sizes, backend="sqlite", seed=DEFAULT_SEED, out=None):
+    report = {
+        "meta": {"commit": _git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+                 "cpus": os.cpu_count(), "backend": backend, "seed": seed, "timestamp": int(time.time())},
+        "results": [],
+    }
+    for size in sizes:
+        print(f"\n=== {size} rows ({backend}) ===")
+        # Fresh working directory per size: SQLite file and client trust files never leak between runs
+        with tempfile.TemporaryDirectory(prefix="secure_db_bench_") as workdir:
+            result_file = os.path.join(workdir, "result.json")
+            subprocess.run([sys.executable, os.path.abspath(__file__), "_one", "--size", str(size),
+                            "--backend", backend, "--seed", str(seed), "--result", result_file],
+                           cwd=workdir, check=True, stdout=subprocess.DEVNULL)
+            with open(result_file) as f:
+                result = json.load(f)
+        report["results"].append(result)
+        for key, value in result.items():
+            print(f"   {key:<22} {value:.4f}" if isinstance(value, float) else f"   {key:<22} {value}")
+
+    out = out or f"bench_{report['meta']['commit'] or 'local'}_{backend}.json"
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n Results written to {out}")
+    return report
+
+def compare(old_path, new_path):
+    """Prints the relative change of each numeric metric for sizes present in both files."""
+    with open(old_path) as f:
+        old = {r["rows"]: r for r in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = {r["rows"]: r for r in json.load(f)["results"]}
+    for size in sorted(set(old) & set(new)):
+        print(f"\n=== {size} rows ===")
+        for key, value in new[size].items():
+            before = old[size].get(key)
+            if isinstance(value, (int, float)) and isinstance(before, (int, float)) and before and key != "rows":
+                print(f"   {key:<22} {before:>12.4f} -> {value:>12.4f}  ({(value - before) / before * 100:+.1f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Secure DB benchmark suite")
+    sub = parser.add_subparsers(dest="command", required=True)
+    r = sub.add_parser("run", help="benchmark each table size and write a JSON report")
+    r.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated, e.g. 1k,10k,100k,1M")
+    r.add_argument("--backend", choices=("sqlite", "mysql"), default="sqlite")
+    r.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    r.add_argument("--out", help="result file (default bench_<commit>_<backend>.json)")
+    c = sub.add_parser("compare", help="show the change between two result files")
+    c.add_argument("old")
+    c.add_argument("new")
+    one = sub.add_parser("_one")   # internal: one size in a child process
+    one.add_argument("--size", type=int, required=True)
+    one.add_argument("--backend", required=True)
+    one.add_argument("--seed", type=int, required=True)
+    one.add_argument("--result", required=True)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(parse_sizes(args.sizes), args.backend, args.seed, args.out)
+    elif args.command == "compare":
+        compare(args.old, args.new)
+    else:
+        _child(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+# bulk_seed.py
+
+'''
+bulk_seed.py is the Parallel Seeding Pipeline for large synthetic datasets (populate.seed_data is the simple, single-process one).
+
+1) Generation: a process pool splits the work into chunks of SEED_CHUNK_ROWS rows. Each worker seeds Faker and `random`
+from (seed, chunk number), so the same seed and chunk size always produce the same patients, however many workers run.
+The worker seals every row exactly like insert_patients does (AES-GCM envelope, blind indexes, HMAC, Merkle leaf) and writes
+the chunk to a TSV file. Binary columns are hex-encoded. AES-GCM nonces stay random: only the patient data is reproducible.
+
+2) Loading: the parent takes the Merkle frontier lock (lock_frontier), gives the rows explicit ids and leaf_idx values
+after the current end of the table, and loads the chunk files in order inside ONE transaction.
+With DB_LOCAL_INFILE=1 on MySQL each file goes in with LOAD DATA LOCAL INFILE. Otherwise it is read back and inserted
+with executemany, in BULK_CHUNK_SIZE batches. This fallback is used on SQLite, and also if the server refuses LOCAL INFILE.
+Only a few chunks are in flight at a time, so memory and temp-disk use stay bounded.
+
+3) Merkle: the workers return the leaves of each chunk. The parent appends them to the server node table (append_leaves)
+and to the local trusted frontier. The trusted root is therefore extended from the generated leaves, without re-reading
+the table, and the trusted-tree snapshot (merkle_diff.py) is extended alongside, both only once the transaction has
+committed and under trust_lock, so a failed seed leaves the saved trust and snapshot untouched.
+This only works if the saved trust ended exactly where the table did. Otherwise update_client_trust runs afterwards.
+
+Run: python bulk_seed.py COUNT [--workers N] [--seed S] [--chunk ROWS]
+'''
+
+import os
+import re
+import time
+import random
+import argparse
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from faker import Faker
+from config import db_conn, DB_BACKEND, DB_LOCAL_INFILE, AES_KEY_VERSION, HMAC_KEY_VERSION
+from access_control import (seal_row, update_client_trust, load_trusted_frontier, save_trusted_frontier,
+                            get_trusted_root, trust_lock, load_keys_or_fail, BULK_CHUNK_SIZE)
+from merkle_store import lock_frontier, append_leaves
+from merkle_forest import append_leaf
+from merkle_diff import extend_snapshot
+from populate import generate_patients
+from auth import resolve_session
+from metrics import stage, count
+
+# Rows per worker task / TSV file
+SEED_CHUNK_ROWS = 20000
+DEFAULT_SEED = 42
+LEAF_LEN = 32
+# Distinct first/last names drawn from Faker per chunk (Faker's weighted lookup costs more than sealing the row)
+NAME_POOL_SIZE = 2000
+
+# TSV column order (hex = binary column written as hex)
+SEED_COLUMNS = ("id", "first_name", "last_name", "sensitive_enc", "gender_bidx", "age_bidx", "weight", "height",
+                "health_history", "row_hmac", "merkle_leaf", "leaf_idx")
+HEX_COLUMNS = ("sensitive_enc", "gender_bidx", "age_bidx", "row_hmac", "merkle_leaf")
+
+# Rows are sealed with the current key versions, which are the same for every row and so not part of the TSV
+SEED_INSERT_SQL = (f"INSERT INTO patients ({', '.join(SEED_COLUMNS)}, key_version, hmac_version) "
+                   f"VALUES ({', '.join(['%s'] * len(SEED_COLUMNS))}, {AES_KEY_VERSION:d}, {HMAC_KEY_VERSION:d})")
+LOAD_DATA_SQL = (
+    "LOAD DATA LOCAL INFILE %s INTO TABLE patients FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' ("
+    + ", ".join(f"@{c}" if c in HEX_COLUMNS else c for c in SEED_COLUMNS) + ") SET "
+    + ", ".join(f"{c} = UNHEX(@{c})" for c in HEX_COLUMNS)
+    + f", key_version = {AES_KEY_VERSION:d}, hmac_version = {HMAC_KEY_VERSION:d}"
+)
+
+# Same escapes LOAD DATA understands by default (FIELDS ESCAPED BY '\\')
+_ESCAPES = {"\\": "\\\\", "\t": "\\t", "\n": "\\n"}
+_UNESCAPES = {v: k for k, v in _ESCAPES.items()}
+_UNESCAPE_RE = re.compile(r"\\[\\tn]")
+
+# Per-worker state, set once by _init_worker
+_keys = None
+_fake = None
+
+class _NamePool:
+    """Stands in for Faker inside generate_patients: names come from a pool drawn from Faker up front."""
+    def __init__(self, fake, size):
+        self._first = [fake.first_name() for _ in range(size)]
+        self._last = [fake.last_name() for _ in range(size)]
+
+    def first_name(self):
+        return random.choice(self._first)
+
+    def last_name(self):
+        return random.choice(self._last)
+
+def _escape(text):
+    return "".join(_ESCAPES.get(ch, ch) for ch in text)
+
+def _unescape(text):
+    return _UNESCAPE_RE.sub(lambda m: _UNESCAPES[m.group()], text)
+
+def _init_worker(aes_k, hmac_k):
+    global _keys, _fake
+    _keys = (aes_k, hmac_k)
+    _fake = Faker()
+
+def _generate_chunk(work_dir, chunk_no, rows, seed, first_id, first_leaf):
+    """Worker: seals `rows` deterministic patients into chunk-NNNNN.tsv. Returns (path, rows, concatenated leaves)."""
+    aes_k, hmac_k = _keys
+    chunk_seed = f"{seed}/{chunk_no}"
+    random.seed(chunk_seed)
+    _fake.seed_instance(chunk_seed)
+    names = _NamePool(_fake, min(rows, NAME_POOL_SIZE))
+
+    path = os.path.join(work_dir, f"chunk-{chunk_no:05d}.tsv")
+    leaves = []
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        for n, patient in enumerate(generate_patients(rows, names)):
+            first, last, env, g_bidx, a_bidx, weight, height, history, r_mac, leaf = seal_row(aes_k, hmac_k, *patient)
+            leaves.append(leaf)
+            f.write("\t".join((str(first_id + n), _escape(first), _escape(last), env.hex(), g_bidx.hex(),
+                               a_bidx.hex(), repr(weight), repr(height), _escape(history), r_mac.hex(), leaf.hex(),
+                               str(first_leaf + n))) + "\n")
+    return path, rows, b"".join(leaves)
+
+def _read_chunk(path):
+    """TSV chunk -> parameter tuples for SEED_INSERT_SQL."""
+    with open(path, encoding="utf-8", newline="\n") as f:
+        for line in f:
+            v = line.rstrip("\n").split("\t")
+            yield (int(v[0]), _unescape(v[1]), _unescape(v[2]), bytes.fromhex(v[3]), bytes.fromhex(v[4]),
+                   bytes.fromhex(v[5]), float(v[6]), float(v[7]), _unescape(v[8]), bytes.fromhex(v[9]),
+                   bytes.fromhex(v[10]), int(v[11]))
+
+def _insert_chunk(cur, path):
+    batch = []
+    for params in _read_chunk(path):
+        batch.append(params)
+        if len(batch) >= BULK_CHUNK_SIZE:
+            cur.executemany(SEED_INSERT_SQL, batch)
+            batch = []
+    if batch:
+        cur.executemany(SEED_INSERT_SQL, batch)
+
+def _load_chunk(cur, path, use_infile):
+    """Loads one chunk file. Returns whether LOAD DATA is still usable for the next one."""
+    if use_infile:
+        import mysql.connector
+        try:
+            cur.execute(LOAD_DATA_SQL, (path,))
+            return True
+        except mysql.connector.Error as e:
+            # Server has local_infile=OFF (or the client was not allowed): a failed LOAD DATA loads nothing
+            print(f" LOAD DATA LOCAL INFILE unavailable ({e.msg}); falling back to batched inserts.")
+    _insert_chunk(cur, path)
+    return False
+
+def seed_patients(session, total, workers=None, seed=DEFAULT_SEED, chunk_rows=SEED_CHUNK_ROWS):
+    """
+    Generates and loads `total` deterministic synthetic patients in parallel. Only Group H allowed.
+    RETURNS the number of rows inserted.
+    """
+    session = resolve_session(session)
+    if session['user_group'] != 'H':
+        raise PermissionError("Access Denied: Group H only.")
+    aes_k, hmac_k = load_keys_or_fail()
+    workers = workers or os.cpu_count()
+    use_infile = DB_BACKEND == "mysql" and DB_LOCAL_INFILE
+    started = time.time()
+    loaded = 0
+
+    with db_conn() as conn, tempfile.TemporaryDirectory(prefix="secure_db_seed_") as work_dir:
+        cur = conn.cursor(buffered=True)
+        try:
+            # 1. Lock the tree's right edge: the new rows go after the current last id and leaf
+            tree = lock_frontier(cur)
+            cur.execute("SELECT MAX(id) FROM patients")
+            first_id = (cur.fetchone()[0] or 0) + 1
+            first_leaf = tree["count"]
+            trust = load_trusted_frontier(first_leaf)
+            base_root = get_trusted_root()
+            # Snapshot nodes the new leaves complete; written only after commit, under trust_lock
+            formed = []
+
+            # 2. Generate chunks on the pool (a few ahead of the loader) and load them in order
+            def load(result):
+                nonlocal use_infile, loaded
+                path, rows, leaves = result
+                with stage("insert.db"):
+                    use_infile = _load_chunk(cur, path, use_infile)
+                os.remove(path)
+                leaves = [leaves[i:i + LEAF_LEN] for i in range(0, len(leaves), LEAF_LEN)]
+                with stage("insert.merkle"):
+                    append_leaves(cur, tree, leaves)
+                    if trust is not None:
+                        for leaf in leaves:
+                            append_leaf(trust, leaf, formed)
+                loaded += rows
+
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(aes_k, hmac_k)) as pool:
+                pending = deque()
+                for chunk_no, start in enumerate(range(0, total, chunk_rows)):
+                    pending.append(pool.submit(_generate_chunk, work_dir, chunk_no, min(chunk_rows, total - start),
+                                               seed, first_id + start, first_leaf + start))
+                    if len(pending) >= workers * 2:
+                        load(pending.popleft().result())
+                while pending:
+                    load(pending.popleft().result())
+            with stage("insert.db"):
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    count("insert.rows", loaded)
+    secs = time.time() - started
+    print(f" {loaded} records seeded in {secs:.1f}s ({loaded / secs if secs else 0:.0f} rows/s, {workers} workers).")
+
+    # 3. Trusted root straight from the generated leaves when the saved trust matched the table
+    # (and was not replaced meanwhile, e.g. by a key-rotation batch waiting for this transaction)
+    with trust_lock():
+        if trust is not None and get_trusted_root() == base_root:
+            extend_snapshot(first_leaf, formed)
+            save_trusted_frontier(trust, first_id + loaded - 1)
+        else:
+            print(" Saved trust did not end at the current table; refreshing it from the database.")
+            update_client_trust()
+    return loaded
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel deterministic seeding of synthetic patients")
+    parser.add_argument("count", type=int)
+    parser.add_argument("--workers", type=int, default=None, help="generator processes (default: CPU count)")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--chunk", type=int, default=SEED_CHUNK_ROWS, help="rows per worker task")
+    args = parser.parse_args()
+    # Like populate.seed_data: act as a Group H session
+    seed_patients({"user_group": "H"}, args.count, args.workers, args.seed, args.chunk)
+
+if __name__ == "__main__":
+    main()
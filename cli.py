@@ -0,0 +1,289 @@
+# cli.py
+
+'''
+cli.py is the non-interactive command line, for scripts, pipelines and cron (app.py stays the interactive menu).
+
+1) Subcommands: login, query, get, insert --from-file, seed, refresh-trust, check-shards, locate, scrub, rotate-keys,
+export.
+Each one imports only the modules it needs inside its handler, so `--help` or a single lookup doesn't pay for Faker,
+numpy or the MySQL driver.
+
+2) Credentials, in order: --token or SECURE_DB_TOKEN (a token from `cli.py login`; reusable across processes when
+SESSION_STATELESS=1 and SESSION_KEY_B64 are set), then SECURE_DB_USER + SECURE_DB_PASSWORD, then an interactive prompt.
+Every command needs a session; refresh-trust and rotate-keys (like insert and seed) are Group H only.
+
+3) Output is JSON (one object per line for row listings) unless --format table is given. --token, --user and --format
+may go before or after the subcommand (`cli.py --format table query --all` or `cli.py query --all --format table`).
+Exit codes: 0 = OK, 1 = error (login, permission, bad input), 2 = usage error (argparse),
+3 = data returned but an integrity/completeness check failed.
+
+Examples:
+    export SECURE_DB_TOKEN=$(python cli.py login --user doctor)
+    python cli.py query --after-id 0 --limit 100 --columns first,last,age
+    python cli.py get 42
+    python cli.py insert --from-file patients.csv
+    python cli.py export out/ --columns age,gender,weight,height
+'''
+
+import os
+import sys
+import json
+import argparse
+
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_VERIFY_FAILED = 3  # 2 is argparse's usage error
+
+PATIENT_FIELDS = ("first", "last", "gender", "age", "weight", "height", "history")
+
+def _credentials(args):
+    """Returns a session token, logging in (PBKDF2) only when no token was supplied."""
+    from auth import login_token, validate_token
+    token = args.token or os.getenv("SECURE_DB_TOKEN")
+    if token:
+        if validate_token(token) is None:
+            raise PermissionError("Token invalid or expired (tokens only cross processes with SESSION_STATELESS=1).")
+        return token
+    user = args.user or os.getenv("SECURE_DB_USER")
+    password = os.getenv("SECURE_DB_PASSWORD")
+    if user is None or password is None:
+        from getpass import getpass
+        user = user or input("Username: ")
+        password = password if password is not None else getpass("Password: ")
+    token = login_token(user, password)
+    if token is None:
+        raise PermissionError("Login Failed")
+    return token
+
+def _require_session(args, group=None):
+    """Resolves a session through _credentials; with group given, other groups are refused (as service.py does)."""
+    from auth import validate_token
+    session = validate_token(_credentials(args))
+    if session is None:
+        raise PermissionError("Login Failed")
+    if group is not None and session['user_group'] != group:
+        raise PermissionError(f"Access Denied: Group {group} only.")
+    return session
+
+def _status_code(status, rows=()):
+    """EXIT_VERIFY_FAILED if the completeness check failed or any returned row failed its HMAC check."""
+    if (status and status.startswith("FAIL")) or any(r["integrity"] != "Pass" for r in rows):
+        return EXIT_VERIFY_FAILED
+    return EXIT_OK
+
+def _print_rows(rows, fmt):
+    if fmt == "table":
+        print(f"{'ID':<7} {'First':<15} {'Last':<15} {'Age':<5} {'Gender':<10} {'Integrity'}")
+        print("-" * 67)
+        for r in rows:
+            print(f"{r['id']:<7} {r.get('first', ''):<15} {r.get('last', ''):<15} {r.get('age', ''):<5} "
+                  f"{r.get('gender', ''):<10} {r['integrity']}")
+    else:
+        for r in rows:
+            print(json.dumps(r, default=str))
+
+def _report(status, fmt, **extra):
+    """Status goes to stderr in JSON mode so stdout stays a clean row stream."""
+    if fmt == "table":
+        print(f"\nCompleteness Check: {status}")
+    else:
+        print(json.dumps(dict(status=status, **extra)), file=sys.stderr)
+
+# ---------- Commands ----------
+
+def cmd_login(args):
+    print(_credentials(args))
+    return EXIT_OK
+
+def cmd_query(args):
+    token = _credentials(args)
+    if args.all:
+        from access_control import stream_patients
+        status, batch, failed = None, [], 0
+        for kind, item in stream_patients(token):
+            if kind == "status":
+                status = item
+                continue
+            batch.append(item)
+            failed += item["integrity"] != "Pass"
+            if len(batch) >= 1000:
+                _print_rows(batch, args.format)
+                batch = []
+        _print_rows(batch, args.format)
+        _report(status, args.format, hmac_failures=failed)
+        return EXIT_VERIFY_FAILED if failed else _status_code(status)
+
+    from access_control import find_patients
+    rows, status, next_after_id = find_patients(
+        token, id_min=args.id_min, id_max=args.id_max, after_id=args.after_id, limit=args.limit,
+        columns=args.columns.split(",") if args.columns else None)
+    _print_rows(rows, args.format)
+    _report(status, args.format, next_after_id=next_after_id)
+    return _status_code(status, rows)
+
+def cmd_get(args):
+    from access_control import get_patient
+    row, status = get_patient(_credentials(args), args.id)
+    if row is None:
+        print(f"Patient ID {args.id} not found.", file=sys.stderr)
+        return EXIT_ERROR
+    _print_rows([row], args.format)
+    _report(status, args.format)
+    return _status_code(status, [row])
+
+def _read_patients(path):
+    """Yields patient tuples from a CSV (header row with PATIENT_FIELDS), JSON Lines (.jsonl) or JSON array (.json)."""
+    with open(path, newline="") as f:
+        if path.endswith(".jsonl"):
+            records = (json.loads(line) for line in f if line.strip())
+        elif path.endswith(".json"):
+            records = json.load(f)
+            if not isinstance(records, list):
+                raise ValueError(f"{path}: expected a JSON array of patient objects")
+        else:
+            import csv
+            records = csv.DictReader(f)
+        for n, rec in enumerate(records, 1):
+            try:
+                yield (rec["first"], rec["last"], int(rec["gender"]), int(rec["age"]),
+                       float(rec["weight"]), float(rec["height"]), rec["history"])
+            except (KeyError, ValueError) as e:
+                raise ValueError(f"{path} record {n}: needs {', '.join(PATIENT_FIELDS)} ({e})") from e
+
+def cmd_insert(args):
+    from access_control import insert_patients
+    insert_patients(_credentials(args), _read_patients(args.from_file), update_trust=not args.no_trust)
+    return EXIT_OK
+
+def cmd_seed(args):
+    from bulk_seed import seed_patients
+    seed_patients(_credentials(args), args.count, args.workers, args.seed)
+    return EXIT_OK
+
+def cmd_refresh_trust(args):
+    from access_control import update_client_trust
+    _require_session(args, 'H')
+    update_client_trust(full=args.full)
+    return EXIT_OK
+
+def cmd_check_shards(args):
+    from access_control import find_changed_shards
+    _require_session(args)
+    changed = find_changed_shards()
+    if changed is None:
+        print("No shard roots saved (set MERKLE_SHARD_SIZE and run refresh-trust --full).", file=sys.stderr)
+        return EXIT_ERROR
+    print(json.dumps({"changed_shards": changed}))
+    return EXIT_VERIFY_FAILED if changed else EXIT_OK
+
+def cmd_locate(args):
+    from access_control import locate_tampering
+    from merkle_diff import format_report
+    report = locate_tampering(_credentials(args), deep=args.deep)
+    if args.format == "table":
+        print("\n".join(format_report(report)))
+    else:
+        print(json.dumps(report, default=str))
+    return EXIT_OK if report["clean"] else EXIT_VERIFY_FAILED
+
+def cmd_scrub(args):
+    from scrubber import scrub
+    _require_session(args)
+    failing = scrub(once=not args.forever, max_rows=args.max_rows, reset=args.reset)
+    return EXIT_VERIFY_FAILED if failing else EXIT_OK
+
+def cmd_rotate_keys(args):
+    from key_rotation import rotate_keys
+    from config import ROTATE_BATCH_ROWS
+    _require_session(args, 'H')
+    _, failed, remaining = rotate_keys(batch_rows=args.batch or ROTATE_BATCH_ROWS, reset=args.reset)
+    return EXIT_VERIFY_FAILED if failed or remaining else EXIT_OK
+
+def cmd_export(args):
+    from export import export_patients
+    manifest = export_patients(_credentials(args), args.out_dir, args.chunk,
+                               args.columns.split(",") if args.columns else None, args.compress)
+    return EXIT_OK if manifest["verified"] else EXIT_VERIFY_FAILED
+
+def _add_common(parser, default):
+    """Global options; subcommands add them with default=SUPPRESS so a value given before the subcommand survives."""
+    parser.add_argument("--token", default=default, help="session token (default: $SECURE_DB_TOKEN)")
+    parser.add_argument("--user", default=default,
+                        help="username (default: $SECURE_DB_USER; password from $SECURE_DB_PASSWORD or prompt)")
+    parser.add_argument("--format", choices=("json", "table"), default="json" if default is None else default)
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Secure DB batch command line")
+    _add_common(parser, None)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("login", help="log in once and print a session token").set_defaults(fn=cmd_login)
+
+    q = sub.add_parser("query", help="verified page of rows (find_patients) or the whole table with --all")
+    q.add_argument("--after-id", type=int, default=None)
+    q.add_argument("--id-min", type=int, default=None)
+    q.add_argument("--id-max", type=int, default=None)
+    q.add_argument("--limit", type=int, default=100)
+    q.add_argument("--columns", help="comma-separated subset of first,last,age,gender,weight,height,history")
+    q.add_argument("--all", action="store_true", help="stream every row and check the full Merkle root")
+    q.set_defaults(fn=cmd_query)
+
+    g = sub.add_parser("get", help="one patient with its Merkle proof")
+    g.add_argument("id", type=int)
+    g.set_defaults(fn=cmd_get)
+
+    i = sub.add_parser("insert", help="bulk insert from CSV, JSON Lines (.jsonl) or a JSON array (.json) (Group H)")
+    i.add_argument("--from-file", required=True)
+    i.add_argument("--no-trust", action="store_true", help="skip the trusted-root refresh afterwards")
+    i.set_defaults(fn=cmd_insert)
+
+    s = sub.add_parser("seed", help="insert deterministic synthetic patients in parallel (Group H, see bulk_seed.py)")
+    s.add_argument("count", type=int, nargs="?", default=100)
+    s.add_argument("--workers", type=int, default=None)
+    s.add_argument("--seed", type=int, default=42)
+    s.set_defaults(fn=cmd_seed)
+
+    t = sub.add_parser("refresh-trust", help="extend (or with --full rebuild) the local trusted root (Group H)")
+    t.add_argument("--full", action="store_true")
+    t.set_defaults(fn=cmd_refresh_trust)
+
+    sub.add_parser("check-shards", help="list Merkle shards whose server root differs from the trusted one").set_defaults(
+        fn=cmd_check_shards)
+
+    lt = sub.add_parser("locate", help="report which leaf ranges were deleted, inserted or modified since trust")
+    lt.add_argument("--deep", action="store_true", help="also compare every row's leaf with the trusted snapshot")
+    lt.set_defaults(fn=cmd_locate)
+
+    sc = sub.add_parser("scrub", help="re-verify rows from the saved checkpoint, throttled (see scrubber.py)")
+    sc.add_argument("--max-rows", type=int, default=None, help="stop after this many rows (default: end of the pass)")
+    sc.add_argument("--forever", action="store_true", help="keep scrubbing pass after pass")
+    sc.add_argument("--reset", action="store_true", help="ignore the checkpoint and start a new pass")
+    sc.set_defaults(fn=cmd_scrub)
+
+    rk = sub.add_parser("rotate-keys",
+                        help="re-seal rows under the current key versions, resumable (Group H, see key_rotation.py)")
+    rk.add_argument("--batch", type=int, default=None, help="rows per transaction (default: $ROTATE_BATCH_ROWS)")
+    rk.add_argument("--reset", action="store_true", help="ignore the checkpoint and start from the first row")
+    rk.set_defaults(fn=cmd_rotate_keys)
+
+    e = sub.add_parser("export", help="columnar .npz export (see export.py)")
+    e.add_argument("out_dir")
+    e.add_argument("--chunk", type=int, default=100000)
+    e.add_argument("--columns")
+    e.add_argument("--compress", action="store_true")
+    e.set_defaults(fn=cmd_export)
+
+    for command in sub.choices.values():
+        _add_common(command, argparse.SUPPRESS)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.fn(args)
+    except (RuntimeError, PermissionError, ValueError, OSError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return EXIT_ERROR
+
+if __name__ == "__main__":
+    sys.exit(main())
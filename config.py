@@ -6,16 +6,40 @@ config.py handles configuration and secrets.
 1) It uses dotenv to load credentials from the environment (avoiding hardcoding)
 
 2) mysql.connector to establish database connections via get_db_conn, and base64 to decode stored encryption keys via load_keys
+
+3) Connection Pooling: get_db_conn hands out connections from a shared MySQLConnectionPool (created lazily on first use),
+so each insert/query/login reuses an open connection instead of paying a fresh TCP + auth handshake.
+Closing a pooled connection returns it to the pool. db_conn() wraps this as a context manager.
+
+4) Storage Backend: DB_BACKEND selects MySQL (default) or the embedded SQLite file at SQLITE_PATH (see storage.py);
+callers of db_conn() don't change either way.
+
+5) Read Replicas: db_conn("replica") hands out a connection to one of DB_REPLICAS (MySQL "host[:port]" entries sharing the
+primary's user/password/database, or SQLite file paths), picked round-robin or least-loaded (fewest connections checked
+out through db_conn). Writes, logins and trust updates keep the default role, the primary. A replica that refuses connections,
+or that access_control finds out of step with the trusted Merkle tree (mark_replica_down), is skipped for DB_REPLICA_RETRY
+seconds. With no replica available the primary serves the read; replica_of(conn) tells which one a connection came from.
+
+6) Keyring: AES_KEY_B64 / HMAC_KEY_B64 are the CURRENT keys, numbered AES_KEY_VERSION / HMAC_KEY_VERSION (default 1).
+Retired keys stay readable through AES_OLD_KEYS_B64 / HMAC_OLD_KEYS_B64 ("1:<base64>,2:<base64>"). load_keyring returns
+both as Keyring dicts {version: key} so rows written under any listed version verify (see key_rotation.py).
 '''
 
 
 import os
-import mysql.connector
+import time
+import threading
+from contextlib import contextmanager
 import base64
 from dotenv import load_dotenv
+from storage import sqlite_pool
 
 load_dotenv()
 
+# Storage backend (storage.py): "mysql" = server via the pool below, "sqlite" = embedded file, no server needed
+DB_BACKEND = os.getenv("DB_BACKEND", "mysql").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "secure_health.db")
+
 # Database Config
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = int(os.getenv("DB_PORT", 3306))
@@ -23,17 +47,247 @@ DB_USER = os.getenv("DB_USER", "root")
 DB_PASS = os.getenv("DB_PASSWORD", "")
 DB_NAME = os.getenv("DB_NAME", "secure_health_db")
 
+# Pool Config
+DB_POOL_NAME = os.getenv("DB_POOL_NAME", "secure_health_pool")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))              # max 32 (mysql.connector limit)
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))     # seconds to wait when all connections are busy
+DB_RECONNECT_ATTEMPTS = int(os.getenv("DB_RECONNECT_ATTEMPTS", 3))
+
+# LOAD DATA LOCAL INFILE for bulk_seed.py (the server must also run with local_infile=ON)
+DB_LOCAL_INFILE = os.getenv("DB_LOCAL_INFILE", "0") == "1"
+
+# Read replicas (db_conn("replica")): comma-separated, empty = every read goes to the primary
+DB_REPLICAS = [r.strip() for r in os.getenv("DB_REPLICAS", "").split(",") if r.strip()]
+DB_REPLICA_POLICY = os.getenv("DB_REPLICA_POLICY", "round_robin").lower()   # round_robin | least_loaded
+DB_REPLICA_RETRY = float(os.getenv("DB_REPLICA_RETRY", 30))                  # seconds a failing replica is skipped
+
+# Parallel row verification (parallel_verify.py): 0 = verify serially in the caller
+VERIFY_WORKERS = int(os.getenv("VERIFY_WORKERS", 0))
+
+# Sharded Merkle forest (merkle_forest.py): leaves per shard, a power of two (0 = off); processes for shard builds (0 = all cores)
+MERKLE_SHARD_SIZE = int(os.getenv("MERKLE_SHARD_SIZE", 0))
+MERKLE_WORKERS = int(os.getenv("MERKLE_WORKERS", 0))
+# Trusted-tree snapshot for tamper localization (merkle_diff.py): lowest level kept (0 = leaves, exact ranges;
+# k = 2^k-leaf blocks, 2^k times smaller on disk); -1 = no snapshot
+TRUST_SNAPSHOT_LEVEL = int(os.getenv("TRUST_SNAPSHOT_LEVEL", 0))
+
+# Group-commit insert queue (write_queue.py): how long the writer waits for more inserts, and the most rows per transaction
+WRITE_QUEUE_WINDOW_MS = float(os.getenv("WRITE_QUEUE_WINDOW_MS", 5))
+WRITE_QUEUE_MAX_BATCH = int(os.getenv("WRITE_QUEUE_MAX_BATCH", 500))
+
+# Background integrity scrubber (scrubber.py)
+SCRUB_CHUNK_ROWS = int(os.getenv("SCRUB_CHUNK_ROWS", 500))             # rows per keyset read
+SCRUB_ROWS_PER_SEC = float(os.getenv("SCRUB_ROWS_PER_SEC", 2000))      # throughput cap (0 = unthrottled)
+SCRUB_DB_BUDGET = float(os.getenv("SCRUB_DB_BUDGET", 0.2))             # max share of wall time spent in DB reads (0 = no cap)
+SCRUB_PASS_INTERVAL = float(os.getenv("SCRUB_PASS_INTERVAL", 3600))    # seconds to rest between full passes
+SCRUB_CHECKPOINT_FILE = os.getenv("SCRUB_CHECKPOINT_FILE", "scrub_checkpoint.json")
+SCRUB_ALERT_FILE = os.getenv("SCRUB_ALERT_FILE", "scrub_alerts.jsonl")  # one JSON alert per line ("" = off)
+SCRUB_ALERT_CMD = os.getenv("SCRUB_ALERT_CMD", "")                      # shell command fed each alert as JSON on stdin
+
+# Key versions (load_keyring): rows record the version they were sealed with in key_version / hmac_version
+AES_KEY_VERSION = int(os.getenv("AES_KEY_VERSION", 1))
+HMAC_KEY_VERSION = int(os.getenv("HMAC_KEY_VERSION", 1))
+
+# Online key rotation (key_rotation.py)
+ROTATE_BATCH_ROWS = int(os.getenv("ROTATE_BATCH_ROWS", 500))           # rows re-sealed per transaction
+ROTATE_ROWS_PER_SEC = float(os.getenv("ROTATE_ROWS_PER_SEC", 1000))    # throughput cap (0 = unthrottled)
+ROTATE_DB_BUDGET = float(os.getenv("ROTATE_DB_BUDGET", 0.2))           # max share of wall time holding the write lock
+ROTATE_CHECKPOINT_FILE = os.getenv("ROTATE_CHECKPOINT_FILE", "rotation_checkpoint.json")
+ROTATE_ROOT_GRACE = float(os.getenv("ROTATE_ROOT_GRACE", 300))         # seconds a root replaced by a batch still verifies
+
+# Blind indexes (access_control.query_cohort): width in years of each searchable age bucket.
+# Changing it requires `python migrations.py blind-index --rebuild`.
+AGE_BUCKET_WIDTH = int(os.getenv("AGE_BUCKET_WIDTH", 10))
+
+# Verified-row cache (row_cache.py): 0 disables
+ROW_CACHE_MAX_ENTRIES = int(os.getenv("ROW_CACHE_MAX_ENTRIES", 100000))
+ROW_CACHE_MAX_BYTES = int(os.getenv("ROW_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# Session tokens (auth.py)
+SESSION_TTL = int(os.getenv("SESSION_TTL", 900))          # seconds a login token stays valid
+LOGIN_WORKERS = int(os.getenv("LOGIN_WORKERS", 4))        # threads running PBKDF2 verification
+# Stateless tokens: any process holding SESSION_KEY_B64 accepts a token by signature + expiry alone (cli.py, cron jobs).
+# Logout is then only enforced in the process that saw it, so keep SESSION_TTL short.
+SESSION_STATELESS = os.getenv("SESSION_STATELESS", "0") == "1"
+
+# HTTP/JSON service (service.py)
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", 8080))
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", DB_POOL_SIZE))          # threads running blocking DB/crypto calls
+SERVICE_MAX_IN_FLIGHT = int(os.getenv("SERVICE_MAX_IN_FLIGHT", 64))       # requests admitted at once; the rest wait
+SERVICE_QUEUE_TIMEOUT = float(os.getenv("SERVICE_QUEUE_TIMEOUT", 5))      # seconds to wait for a slot before 503
+
+# Per-stage latency metrics (metrics.py): off by default
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+METRICS_TRACE = os.getenv("METRICS_TRACE", "0") == "1"              # also keep individual timed calls
+METRICS_TRACE_MAX = int(os.getenv("METRICS_TRACE_MAX", 10000))      # most recent calls kept when tracing
+METRICS_FILE = os.getenv("METRICS_FILE", "")                         # written at exit: *.json, else Prometheus text
+
+_pool = None
+_pool_lock = threading.Lock()
+
+_replica_pools = {}
+_replica_in_use = [0] * len(DB_REPLICAS)
+_replica_down_until = [0.0] * len(DB_REPLICAS)
+_replica_next = 0
+_replica_lock = threading.Lock()
+
+def _get_pool():
+    """Creates the shared pool on first use (so importing config never opens a socket)."""
+    global _pool
+    if _pool is None:
+        # Imported here so SQLite deployments and tools that never touch MySQL start without loading the driver
+        from mysql.connector import pooling
+        with _pool_lock:
+            if _pool is None:
+                _pool = pooling.MySQLConnectionPool(
+                    pool_name=DB_POOL_NAME, pool_size=DB_POOL_SIZE, pool_reset_session=True,
+                    host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASS, database=DB_NAME,
+                    allow_local_infile=DB_LOCAL_INFILE
+                )
+    return _pool
+
+def _get_replica_pool(i):
+    """Pool for DB_REPLICAS[i], created on first use like the primary's."""
+    with _pool_lock:
+        pool = _replica_pools.get(i)
+        if pool is None:
+            from mysql.connector import pooling
+            host, _, port = DB_REPLICAS[i].partition(":")
+            pool = _replica_pools[i] = pooling.MySQLConnectionPool(
+                pool_name=f"{DB_POOL_NAME}_replica{i}", pool_size=DB_POOL_SIZE, pool_reset_session=True,
+                host=host, port=int(port or DB_PORT), user=DB_USER, password=DB_PASS, database=DB_NAME
+            )
+        return pool
+
+def pick_replica():
+    """Index of the replica to read from (DB_REPLICA_POLICY), or None if none is configured or all are marked down."""
+    global _replica_next
+    now = time.monotonic()
+    with _replica_lock:
+        up = [i for i in range(len(DB_REPLICAS)) if _replica_down_until[i] <= now]
+        if not up:
+            return None
+        if DB_REPLICA_POLICY == "least_loaded":
+            # Ties go round-robin so idle replicas share the work
+            low = min(_replica_in_use[i] for i in up)
+            up = [i for i in up if _replica_in_use[i] == low]
+        i = up[_replica_next % len(up)]
+        _replica_next += 1
+        return i
+
+def mark_replica_down(i, reason):
+    """Skips replica i for DB_REPLICA_RETRY seconds; reads go to the other replicas or the primary meanwhile."""
+    with _replica_lock:
+        _replica_down_until[i] = time.monotonic() + DB_REPLICA_RETRY
+    print(f" Replica {DB_REPLICAS[i]} skipped for {DB_REPLICA_RETRY:.0f}s: {reason}")
+
+def replica_of(conn):
+    """Index in DB_REPLICAS of the replica a db_conn() connection came from, None for the primary."""
+    return getattr(conn, "replica_index", None)
+
+def _replica_conn(i):
+    if DB_BACKEND == "sqlite":
+        return sqlite_pool(DB_REPLICAS[i], DB_POOL_SIZE, DB_POOL_TIMEOUT).get_connection()
+    return _get_replica_pool(i).get_connection()
+
 def get_db_conn():
-    return mysql.connector.connect(
-        host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASS, database=DB_NAME
-    )
+    """
+    Returns a pooled connection to the primary. Call .close() to hand it back to the pool.
+    Waits up to DB_POOL_TIMEOUT seconds if every connection is checked out.
+    """
+    if DB_BACKEND == "sqlite":
+        return sqlite_pool(SQLITE_PATH, DB_POOL_SIZE, DB_POOL_TIMEOUT).get_connection()
+    pool = _get_pool()
+    import mysql.connector
+    from mysql.connector import pooling
+    deadline = time.monotonic() + DB_POOL_TIMEOUT
+    failures = 0
+    while True:
+        try:
+            # Health check: the pool pings the connection on checkout and reconnects it if it went stale
+            return pool.get_connection()
+        except pooling.PoolError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.01)
+        except mysql.connector.InterfaceError:
+            # Reconnect failed (server restart / wait_timeout); retry a few times before giving up
+            failures += 1
+            if failures >= DB_RECONNECT_ATTEMPTS:
+                raise
+            time.sleep(0.2 * failures)
+
+def _open_replica():
+    """(index, connection) of an available replica, or (None, None)."""
+    while True:
+        i = pick_replica()
+        if i is None:
+            return None, None
+        try:
+            conn = _replica_conn(i)
+        except Exception as e:
+            mark_replica_down(i, f"connection failed ({e})")
+            continue
+        conn.replica_index = i
+        return i, conn
+
+@contextmanager
+def db_conn(role="primary"):
+    """
+    Context manager: `with db_conn() as conn:` always returns the connection to the pool.
+    role="replica" reads from a replica when one is configured and up, else from the primary.
+    """
+    i, conn = _open_replica() if role == "replica" and DB_REPLICAS else (None, None)
+    if conn is None:
+        conn = get_db_conn()
+    else:
+        with _replica_lock:
+            _replica_in_use[i] += 1
+    try:
+        yield conn
+    finally:
+        conn.close()
+        if i is not None:
+            with _replica_lock:
+                _replica_in_use[i] -= 1
 
 def load_keys():
-    """Loads AES and HMAC keys from .env"""
+    """Loads the current AES and HMAC keys from .env"""
     aes_b64 = os.getenv("AES_KEY_B64")
     hmac_b64 = os.getenv("HMAC_KEY_B64")
     
     if not aes_b64 or not hmac_b64:
         raise ValueError("Keys not found in .env")
         
-    return base64.b64decode(aes_b64), base64.b64decode(hmac_b64)
\ No newline at end of file
+    return base64.b64decode(aes_b64), base64.b64decode(hmac_b64)
+
+class Keyring(dict):
+    """{version: key} for one purpose (AES or HMAC); .current is the version new data is sealed with, .key its key."""
+    def __init__(self, keys, current):
+        super().__init__(keys)
+        self.current = current
+
+    @property
+    def key(self):
+        return self[self.current]
+
+def _old_keys(name):
+    """Parses "<version>:<base64>,..." from .env into {version: key}."""
+    keys = {}
+    for entry in os.getenv(name, "").split(","):
+        if entry.strip():
+            version, _, key_b64 = entry.partition(":")
+            keys[int(version)] = base64.b64decode(key_b64.strip())
+    return keys
+
+def load_keyring():
+    """(aes Keyring, hmac Keyring): the current keys plus every retired version still listed in .env"""
+    aes_k, hmac_k = load_keys()
+    return (Keyring({**_old_keys("AES_OLD_KEYS_B64"), AES_KEY_VERSION: aes_k}, AES_KEY_VERSION),
+            Keyring({**_old_keys("HMAC_OLD_KEYS_B64"), HMAC_KEY_VERSION: hmac_k}, HMAC_KEY_VERSION))
+
+def load_session_key():
+    """Loads the token-signing key from .env (SESSION_KEY_B64), or None to use a per-process random key."""
+    key_b64 = os.getenv("SESSION_KEY_B64")
+    return base64.b64decode(key_b64) if key_b64 else None
\ No newline at end of file
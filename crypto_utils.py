@@ -12,28 +12,57 @@ This mode provides both encryption and an Authentication Tag to instantly detect
 3) compute_hmac (Integrity): Uses HMAC-SHA256 to generate cryptographic signature for database rows,ensuring data hasn't been altered by unauthorized users.
 
 4) get_row_bytes (Formatting): Performs Canonicalization by joining values with |, ensuring data is formatted identically every time before hashing.
+
+5) encrypt_envelope/decrypt_envelope (Compact Confidentiality): Packs ALL sensitive fields into one AES-GCM payload
+[version byte | 12-byte nonce | 16-byte tag | ciphertext]. The version byte is authenticated as associated data.
+Fields are packed as (field id, length, value) records, so new fields only need an entry in ENVELOPE_FIELDS, not new columns.
+
+6) blind_index (Searchable Encryption): a keyed HMAC token over a field value (e.g. gender, or an age bucket), stored next to the
+ciphertext so SQL can match equal values without decrypting. The key is derived from the HMAC key with derive_key, so the
+row-MAC key itself is never used for tokens. Tokens reveal which rows share a value, nothing more.
 '''
 
 
 
 import hashlib
 import hmac
+import struct
 from Crypto.Cipher import AES
 from Crypto.Random import get_random_bytes
+from metrics import timed
+
+# Returned by decrypt_val when the AES-GCM tag does not verify
+INTEGRITY_FAIL = "[INTEGRITY FAIL]"
+
+# Envelope format: version byte + nonce + tag + packed fields
+ENVELOPE_VERSION = 1
+ENVELOPE_NONCE_LEN = 12
+ENVELOPE_TAG_LEN = 16
+# name -> (field id, type). Append new fields with a new id; never renumber existing ones.
+ENVELOPE_FIELDS = {
+    "gender": (1, int),
+    "age": (2, int),
+}
+_FIELD_HEADER = struct.Struct(">BH")   # field id, value length
+
+BLIND_INDEX_LEN = 16                    # truncated HMAC-SHA256 token
 
 # Password Hashing (PBKDF2)
+@timed("crypto.pbkdf2_hash")
 def hash_password(password):
     salt = get_random_bytes(16)
     pwd_hash = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, 100000)
     return salt, pwd_hash
 
 # Verify PBKDF2 hash using constant-time comparison to mitigate timing attacks.
+@timed("crypto.pbkdf2_verify")
 def verify_password(stored_salt, stored_hash, input_password):
     check_hash = hashlib.pbkdf2_hmac('sha256', input_password.encode(), stored_salt, 100000)
     # Use constant-time comparison to avoid timing attacks
     return hmac.compare_digest(check_hash, stored_hash)
 
 # AES-GCM Encryption (Confidentiality)
+@timed("crypto.encrypt")
 def encrypt_val(key, value):
     """Encrypts a value (int or str) -> returns (ciphertext, nonce, tag)"""
     cipher = AES.new(key, AES.MODE_GCM)
@@ -41,6 +70,7 @@ def encrypt_val(key, value):
     ciphertext, tag = cipher.encrypt_and_digest(data)
     return ciphertext, cipher.nonce, tag
 
+@timed("crypto.decrypt")
 def decrypt_val(key, ciphertext, nonce, tag, value_type=str):
     """Decrypts -> returns value cast to type (int/str)"""
     try:
@@ -48,7 +78,7 @@ def decrypt_val(key, ciphertext, nonce, tag, value_type=str):
         data = cipher.decrypt_and_verify(ciphertext, tag)
         return value_type(data.decode('utf-8'))
     except ValueError:
-        return "[INTEGRITY FAIL]"
+        return INTEGRITY_FAIL
 
 # HMAC & Canonicalization (Row Integrity)
 def get_row_bytes(first, last, weight, height, history):
@@ -56,5 +86,66 @@ def get_row_bytes(first, last, weight, height, history):
     s = f"{first}|{last}|{weight}|{height}|{history}"
     return s.encode('utf-8')
 
+@timed("crypto.hmac")
 def compute_hmac(key, data_bytes):
-    return hmac.new(key, data_bytes, hashlib.sha256).digest()
\ No newline at end of file
+    return hmac.new(key, data_bytes, hashlib.sha256).digest()
+
+# Single-Envelope Encryption (all sensitive fields, one AES-GCM call)
+def pack_fields(fields):
+    """{name: value} -> bytes of (id, length, utf-8 value) records"""
+    out = bytearray()
+    for name, value in fields.items():
+        field_id, _ = ENVELOPE_FIELDS[name]
+        data = str(value).encode('utf-8')
+        out += _FIELD_HEADER.pack(field_id, len(data)) + data
+    return bytes(out)
+
+def unpack_fields(data):
+    """Inverse of pack_fields. Unknown field ids (written by a newer version) are skipped."""
+    by_id = {field_id: (name, value_type) for name, (field_id, value_type) in ENVELOPE_FIELDS.items()}
+    fields = {}
+    pos = 0
+    while pos < len(data):
+        field_id, length = _FIELD_HEADER.unpack_from(data, pos)
+        pos += _FIELD_HEADER.size
+        value = data[pos:pos + length]
+        pos += length
+        if field_id in by_id:
+            name, value_type = by_id[field_id]
+            fields[name] = value_type(value.decode('utf-8'))
+    return fields
+
+@timed("crypto.encrypt")
+def encrypt_envelope(key, fields):
+    """Encrypts a dict of sensitive fields -> one self-describing blob"""
+    header = bytes([ENVELOPE_VERSION])
+    cipher = AES.new(key, AES.MODE_GCM, nonce=get_random_bytes(ENVELOPE_NONCE_LEN))
+    cipher.update(header)
+    ciphertext, tag = cipher.encrypt_and_digest(pack_fields(fields))
+    return header + cipher.nonce + tag + ciphertext
+
+@timed("crypto.decrypt")
+def decrypt_envelope(key, blob):
+    """Decrypts an envelope -> {name: value}. On tamper/unknown version every field is "[INTEGRITY FAIL]"."""
+    try:
+        blob = bytes(blob)
+        if blob[0] != ENVELOPE_VERSION:
+            raise ValueError("Unknown envelope version")
+        nonce_end = 1 + ENVELOPE_NONCE_LEN
+        tag_end = nonce_end + ENVELOPE_TAG_LEN
+        cipher = AES.new(key, AES.MODE_GCM, nonce=blob[1:nonce_end])
+        cipher.update(blob[:1])
+        data = cipher.decrypt_and_verify(blob[tag_end:], blob[nonce_end:tag_end])
+        return unpack_fields(data)
+    except (ValueError, IndexError, struct.error):
+        return {name: INTEGRITY_FAIL for name in ENVELOPE_FIELDS}
+
+# Blind Indexes (equality search over encrypted fields)
+def derive_key(master_key, label):
+    """Derives an independent sub-key for one purpose (HMAC-SHA256 as a PRF)."""
+    return hmac.new(master_key, label.encode('utf-8'), hashlib.sha256).digest()
+
+@timed("crypto.blind_index")
+def blind_index(key, field, value):
+    """Deterministic token for `field = value`: equal inputs give equal tokens, nothing else is revealed."""
+    return hmac.new(key, f"{field}|{value}".encode('utf-8'), hashlib.sha256).digest()[:BLIND_INDEX_LEN]
\ No newline at end of file
@@ -6,22 +6,75 @@ db_setup.py is the Schema Initializer, responsible for building the database str
 run_schema_native fn establishes a raw connection to the MySQL server using mysql.connector.
 It reads the external schema.sql file, uses String Parsing (split(';')) to isolate individual SQL commands,
 and executes them sequentially via a Database Cursor to create tables and define constraints, ensuring all changes are saved with a final Commit.
+
+apply_migrations fn then brings the schema up to date with the additions made after schema.sql (MIGRATIONS list).
+Each statement is idempotent: "duplicate column/key" errors from an earlier run are skipped, so it is safe to re-run.
+
+With DB_BACKEND=sqlite there is no server to set up: the embedded file is created with the complete schema (storage.py).
 '''
 
 
 import os
 import mysql.connector
 from getpass import getpass
-from config import DB_HOST, DB_PORT, DB_USER, DB_PASS
+from config import DB_HOST, DB_PORT, DB_USER, DB_PASS, DB_NAME, DB_BACKEND, SQLITE_PATH, MERKLE_SHARD_SIZE, db_conn
+from merkle_store import rebuild_server_tree
+from merkle_forest import rebuild_server_shards
+
+# Schema additions on top of schema.sql, applied in order by apply_migrations
+MIGRATIONS = [
+    # Server-side Merkle tree for O(log n) proofs (see merkle_store.py)
+    """CREATE TABLE IF NOT EXISTS merkle_nodes (
+        lvl TINYINT UNSIGNED NOT NULL,
+        idx BIGINT UNSIGNED NOT NULL,
+        hash BINARY(32) NOT NULL,
+        PRIMARY KEY (lvl, idx)
+    )""",
+    "ALTER TABLE patients ADD COLUMN leaf_idx BIGINT UNSIGNED NULL",
+    "ALTER TABLE patients ADD UNIQUE INDEX idx_patients_leaf (leaf_idx)",
+    # Single AES-GCM envelope for all sensitive fields (crypto_utils.encrypt_envelope); legacy columns become optional
+    "ALTER TABLE patients ADD COLUMN sensitive_enc VARBINARY(255) NULL",
+    """ALTER TABLE patients
+        MODIFY gender_enc VARBINARY(64) NULL, MODIFY gender_nonce VARBINARY(16) NULL, MODIFY gender_tag VARBINARY(16) NULL,
+        MODIFY age_enc VARBINARY(64) NULL, MODIFY age_nonce VARBINARY(16) NULL, MODIFY age_tag VARBINARY(16) NULL""",
+    # Blind indexes for cohort filters (access_control.query_cohort); backfilled by migrations.py blind-index
+    "ALTER TABLE patients ADD COLUMN gender_bidx BINARY(16) NULL",
+    "ALTER TABLE patients ADD COLUMN age_bidx BINARY(16) NULL",
+    "ALTER TABLE patients ADD INDEX idx_patients_cohort (gender_bidx, age_bidx)",
+    "ALTER TABLE patients ADD INDEX idx_patients_age_bidx (age_bidx)",
+    # Key versions each row was sealed with (config.load_keyring, key_rotation.py)
+    "ALTER TABLE patients ADD COLUMN key_version SMALLINT UNSIGNED NOT NULL DEFAULT 1",
+    "ALTER TABLE patients ADD COLUMN hmac_version SMALLINT UNSIGNED NOT NULL DEFAULT 1",
+]
+
+# MySQL error codes meaning "already applied"
+ER_DUP_FIELDNAME = 1060
+ER_DUP_KEYNAME = 1061
+ER_BAD_FIELD_ERROR = 1054   # MODIFY after migrations.py dropped the legacy columns
+
+def apply_migrations(cursor):
+    for stmt in MIGRATIONS:
+        try:
+            cursor.execute(stmt)
+        except mysql.connector.Error as e:
+            if e.errno not in (ER_DUP_FIELDNAME, ER_DUP_KEYNAME, ER_BAD_FIELD_ERROR):
+                raise
 
 def run_schema_native():
+    if DB_BACKEND == "sqlite":
+        # Opening the first connection creates the file and every table/index
+        with db_conn():
+            pass
+        print(f"SQLite schema ready in {SQLITE_PATH}.")
+        return
+
     print(f"Applying schema to {DB_HOST}...")
     try:
         # Connect to server directly
         cnx = mysql.connector.connect(
             host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASS
         )
-        cursor = cnx.cursor()
+        cursor = cnx.cursor(buffered=True)
         
         with open("schema.sql", "r") as f:
             statements = f.read().split(';')
@@ -29,6 +82,17 @@ def run_schema_native():
         for stmt in statements:
             if stmt.strip():
                 cursor.execute(stmt)
+
+        cnx.database = DB_NAME
+        apply_migrations(cursor)
+
+        # Rows from before merkle_nodes existed need their leaf positions backfilled
+        cursor.execute("SELECT COUNT(*) FROM patients WHERE leaf_idx IS NULL")
+        if cursor.fetchone()[0]:
+            if MERKLE_SHARD_SIZE:
+                rebuild_server_shards(cnx)
+            else:
+                rebuild_server_tree(cnx)
                 
         print("Schema applied successfully.")
         cnx.commit()
@@ -0,0 +1,181 @@
+# export.py
+
+'''
+export.py is the Columnar Export for analytics: verified, redacted patient data as typed NumPy arrays instead of row dicts.
+
+1) export_patients fn reads the table through stream_patients, so every row gets the same treatment as a query:
+HMAC check, AES-GCM decryption, Group R redaction, and the Merkle root folded in as rows arrive.
+
+2) Chunked Columnar Output: every chunk_rows rows are written as one part-NNNNN.npz holding one array per column
+(id int64, age int16, gender int8, weight/height float32, integrity_ok bool, names/history as fixed-width unicode).
+Only one chunk is held in memory, however large the table. Failed decryptions are stored as -1 in age/gender.
+For Group R the name columns are left out entirely rather than filled with "[REDACTED]".
+
+3) manifest.json is written LAST: row counts, column dtypes, a SHA-256 per part file and the Merkle status of the whole read.
+An export without a manifest is incomplete; "verified": false means the completeness or HMAC checks did not pass.
+
+4) load_export fn checks the part hashes against the manifest and returns {column: array}, concatenated across parts.
+
+numpy is only imported when an export is written or loaded.
+Run: python export.py OUT_DIR [--user NAME] [--chunk N] [--columns age,gender,weight] [--compress]
+'''
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from getpass import getpass
+from access_control import stream_patients, RESULT_FIELDS, STREAM_CHUNK_SIZE
+from auth import resolve_session, login_token
+from crypto_utils import INTEGRITY_FAIL
+
+# Rows per .npz part (about 10 MB uncompressed with names and history)
+EXPORT_CHUNK_ROWS = 100000
+MANIFEST_FILE = "manifest.json"
+
+# Typed layout per result field; None means fixed-width unicode sized to the longest value in the part
+COLUMN_DTYPES = {
+    "id": "int64",
+    "first": None,
+    "last": None,
+    "age": "int16",
+    "gender": "int8",
+    "weight": "float32",
+    "height": "float32",
+    "history": None,
+    "integrity_ok": "bool",
+}
+NAME_FIELDS = ("first", "last")
+GENDER_CODES = {"Female": 0, "Male": 1}
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError as e:
+        raise RuntimeError("Columnar export needs numpy: pip install numpy") from e
+    return numpy
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _column_value(result, col):
+    if col == "integrity_ok":
+        return result["integrity"] == "Pass"
+    value = result[col]
+    if col == "gender":
+        return GENDER_CODES.get(value, -1)
+    if col == "age":
+        return -1 if value == INTEGRITY_FAIL else value
+    return value
+
+def _write_part(np, out_dir, part_no, columns, buffers, compress):
+    arrays = {col: np.asarray(buffers[col], dtype=COLUMN_DTYPES[col]) if COLUMN_DTYPES[col]
+              else np.asarray(buffers[col], dtype=str) for col in columns}
+    name = f"part-{part_no:05d}.npz"
+    path = os.path.join(out_dir, name)
+    (np.savez_compressed if compress else np.savez)(path, **arrays)
+    rows = len(buffers["id"])
+    for col in columns:
+        buffers[col].clear()
+    return {"file": name, "rows": rows, "sha256": _file_sha256(path),
+            "dtypes": {col: str(arr.dtype) for col, arr in arrays.items()}}
+
+def export_patients(session, out_dir, chunk_rows=EXPORT_CHUNK_ROWS, columns=None, compress=False):
+    """
+    Streams the verified table into out_dir as columnar .npz parts plus manifest.json.
+    columns: subset of access_control.RESULT_FIELDS (default: all the user may see).
+    RETURNS the manifest dict.
+    """
+    np = _numpy()
+    session = resolve_session(session)
+    wanted = RESULT_FIELDS if columns is None else tuple(columns)
+    unknown = [c for c in wanted if c not in RESULT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown column(s) {', '.join(unknown)}; choose from {', '.join(RESULT_FIELDS)}")
+    if session['user_group'] == 'R':
+        wanted = tuple(c for c in wanted if c not in NAME_FIELDS)
+    columns = ("id",) + wanted + ("integrity_ok",)
+
+    os.makedirs(out_dir, exist_ok=True)
+    if os.path.exists(os.path.join(out_dir, MANIFEST_FILE)):
+        raise RuntimeError(f"{out_dir} already holds an export; choose an empty directory.")
+
+    buffers = {col: [] for col in columns}
+    parts, total, failed, status = [], 0, 0, None
+    started = time.time()
+    for kind, item in stream_patients(session, chunk_size=min(chunk_rows, STREAM_CHUNK_SIZE)):
+        if kind == "status":
+            status = item
+            continue
+        for col in columns:
+            buffers[col].append(_column_value(item, col))
+        total += 1
+        failed += item["integrity"] != "Pass"
+        if len(buffers["id"]) >= chunk_rows:
+            parts.append(_write_part(np, out_dir, len(parts), columns, buffers, compress))
+            print(f"   ...exported {total} rows")
+    if buffers["id"] or not parts:
+        parts.append(_write_part(np, out_dir, len(parts), columns, buffers, compress))
+
+    manifest = {
+        "rows": total,
+        "columns": list(columns),
+        "parts": parts,
+        "merkle_status": status,
+        "hmac_failures": failed,
+        "verified": status == "OK" and failed == 0,
+        "user_group": session['user_group'],
+        "created": int(time.time()),
+        "seconds": round(time.time() - started, 3),
+    }
+    with open(os.path.join(out_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f" Exported {total} rows in {len(parts)} part(s) to {out_dir} (Merkle: {status}; HMAC failures: {failed})")
+    return manifest
+
+def load_export(out_dir, check_hashes=True):
+    """Loads an export as {column: numpy array}. Raises ValueError if a part does not match the manifest."""
+    np = _numpy()
+    with open(os.path.join(out_dir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if not manifest["verified"]:
+        print(f" WARNING: export not verified (Merkle: {manifest['merkle_status']}; "
+              f"HMAC failures: {manifest['hmac_failures']})", file=sys.stderr)
+
+    pieces = {col: [] for col in manifest["columns"]}
+    for part in manifest["parts"]:
+        path = os.path.join(out_dir, part["file"])
+        if check_hashes and _file_sha256(path) != part["sha256"]:
+            raise ValueError(f"{part['file']} does not match the manifest (modified or truncated)")
+        with np.load(path) as data:
+            for col in pieces:
+                pieces[col].append(data[col])
+    return {col: np.concatenate(arrs) for col, arrs in pieces.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Export verified patient data as columnar .npz parts")
+    parser.add_argument("out_dir")
+    parser.add_argument("--chunk", type=int, default=EXPORT_CHUNK_ROWS, help="rows per part file")
+    parser.add_argument("--columns", help=f"comma-separated subset of: {', '.join(RESULT_FIELDS)}")
+    parser.add_argument("--compress", action="store_true", help="smaller files, slower to load")
+    parser.add_argument("--user", help="username (prompted if omitted)")
+    args = parser.parse_args()
+
+    token = login_token(args.user or input("Username: "), getpass("Password: "))
+    if token is None:
+        sys.exit("Login Failed")
+    try:
+        export_patients(token, args.out_dir, args.chunk,
+                        args.columns.split(",") if args.columns else None, args.compress)
+    except (RuntimeError, PermissionError, ValueError) as e:
+        sys.exit(f"ERROR: {e}")
+
+if __name__ == "__main__":
+    main()
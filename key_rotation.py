@@ -0,0 +1,294 @@
+# key_rotation.py
+
+'''
+key_rotation.py is the Online Key Rotation pipeline: it moves every patient row onto the current AES key version
+(AES_KEY_VERSION) and HMAC key version (HMAC_KEY_VERSION) while the service keeps reading and inserting.
+
+Operator order: add the new keys as AES_KEY_B64 / HMAC_KEY_B64 with bumped *_KEY_VERSION, move the old ones to
+AES_OLD_KEYS_B64 / HMAC_OLD_KEYS_B64 ("1:<base64>"), restart every process (config.load_keyring), run this, and only
+remove the old keys once it reports no rows left on them.
+
+1) Batches: rows are taken ROTATE_BATCH_ROWS at a time in id order, up to the last trusted row. Each batch is one
+transaction under lock_frontier (inserts wait for it, reads never do) and under trust_lock (no other trust update runs).
+
+2) Verify before re-sealing: the batch's leaves (sha256 of row_hmac) must sit on consecutive leaf positions and prove
+against the trusted root as one range (integrity.merkle_range_update). Each row to rotate must then pass its HMAC and
+AES-GCM checks under its old key versions. Rows that fail are reported and left as they are, never re-sealed under
+the new keys (that would launder tampering).
+
+3) Re-seal: the envelope is re-encrypted with the new AES key; the row HMAC, blind-index tokens and Merkle leaf are
+recomputed with the new HMAC key. The same range proof re-roots the tree, so the batch's nodes up to the root are
+rewritten server-side and the trusted frontier, shard roots and snapshot are patched in place. Nothing is re-downloaded.
+
+4) Crash safety: the new trust state is written to CLIENT_STATE_FILE + ".pending" before the commit and promoted after.
+On start, a pending state left by a crash is promoted if the server holds it (the commit went through), else dropped.
+The replaced root stays acceptable to readers for ROTATE_ROOT_GRACE seconds (access_control.supersede_root), so a read
+that started before a batch still verifies.
+
+5) Resumable and throttled: the last id done is checkpointed in ROTATE_CHECKPOINT_FILE after every batch; a restarted
+run resumes there. ROTATE_ROWS_PER_SEC and ROTATE_DB_BUDGET pace the batches (same rules as scrubber.py).
+
+Rows inserted after the last trust update are covered by refreshing trust once the pass reaches them.
+Rows in the legacy per-field format (MySQL, before `migrations.py envelopes`) are skipped and reported.
+Run: python key_rotation.py [--batch N] [--rate ROWS_PER_SEC] [--budget SHARE] [--reset]
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+from config import (db_conn, load_keyring, ROTATE_BATCH_ROWS, ROTATE_ROWS_PER_SEC, ROTATE_DB_BUDGET,
+                    ROTATE_CHECKPOINT_FILE)
+from crypto_utils import INTEGRITY_FAIL
+from integrity import sha256, merkle_range_update, merkle_frontier_root
+from merkle_store import lock_frontier, fetch_range_proof, write_nodes, frontier_positions, frontier_matches
+from merkle_diff import update_snapshot, drop_snapshot
+from access_control import (seal_row, decrypt_private, hmac_ok, trust_lock, update_client_trust, supersede_root,
+                            get_trusted_root, load_client_state, save_client_state, CLIENT_STATE_FILE)
+from scrubber import throttle_pause
+from metrics import stage, count
+
+PENDING_STATE_FILE = CLIENT_STATE_FILE + ".pending"
+
+ROTATE_SQL = "SELECT * FROM patients WHERE id > %s AND id <= %s ORDER BY id LIMIT %s"
+RESEAL_SQL = """UPDATE patients SET sensitive_enc = %s, gender_bidx = %s, age_bidx = %s, row_hmac = %s,
+                merkle_leaf = %s, key_version = %s, hmac_version = %s WHERE id = %s"""
+REMAINING_SQL = "SELECT COUNT(*) FROM patients WHERE key_version <> %s OR hmac_version <> %s"
+
+def new_checkpoint(aes_version, hmac_version):
+    return {"aes_version": aes_version, "hmac_version": hmac_version, "last_id": 0, "rotated": 0, "failed": []}
+
+def load_checkpoint(aes_version, hmac_version, path=ROTATE_CHECKPOINT_FILE):
+    """The saved position of a rotation to these key versions, or a fresh one (a checkpoint for other versions is stale)."""
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            checkpoint = json.load(f)
+        if (checkpoint["aes_version"], checkpoint["hmac_version"]) == (aes_version, hmac_version):
+            return checkpoint
+    return new_checkpoint(aes_version, hmac_version)
+
+def save_checkpoint(checkpoint, path=ROTATE_CHECKPOINT_FILE):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path)
+
+def _write_pending(state, last_id, root, old_root):
+    with open(PENDING_STATE_FILE, "w") as f:
+        json.dump({"state": {"count": state["count"], "frontier": [h.hex() if h else None for h in state["frontier"]],
+                             **({"shard_bits": state["shard_bits"], "shard_roots": [h.hex() for h in state["shard_roots"]]}
+                                if "shard_roots" in state else {})},
+                   "last_id": last_id, "root": root.hex(), "old_root": old_root.hex()}, f)
+
+def _promote(state, last_id, root, old_root, nodes):
+    """Makes a committed batch's state the trusted one, keeps the old root for in-flight reads, patches the snapshot."""
+    save_client_state(state, last_id, root)
+    supersede_root(old_root, state["count"])
+    if nodes is None:
+        drop_snapshot()
+    else:
+        update_snapshot(state["count"], nodes)
+    if os.path.exists(PENDING_STATE_FILE):
+        os.remove(PENDING_STATE_FILE)
+
+def recover_pending():
+    """
+    Finishes a batch interrupted between its commit and the trust update: the pending state is promoted if the server's
+    tree holds it, else (the transaction rolled back) it is dropped. Returns True if a pending state was promoted.
+    """
+    if not os.path.exists(PENDING_STATE_FILE):
+        return False
+    with open(PENDING_STATE_FILE, "r") as f:
+        pending = json.load(f)
+    saved = pending["state"]
+    state = {"count": saved["count"], "frontier": [bytes.fromhex(h) if h else None for h in saved["frontier"]]}
+    if "shard_roots" in saved:
+        state["shard_bits"] = saved["shard_bits"]
+        state["shard_roots"] = [bytes.fromhex(h) for h in saved["shard_roots"]]
+    with db_conn() as conn:
+        committed = frontier_matches(conn.cursor(buffered=True), state)
+    if not committed:
+        os.remove(PENDING_STATE_FILE)
+        return False
+    # The batch's snapshot nodes were not kept: the snapshot is dropped and a full trust refresh recreates it
+    print(" Recovered a key-rotation batch that committed before its trust update.")
+    _promote(state, pending["last_id"], bytes.fromhex(pending["root"]), bytes.fromhex(pending["old_root"]), None)
+    return True
+
+def _rekeyed_state(state, changed, root):
+    """The trusted frontier state with the nodes a batch changed swapped in. Raises if it no longer gives `root`."""
+    by_pos = {(lvl, idx): node for lvl, idx, node in changed}
+    frontier = list(state["frontier"])
+    for lvl, idx in frontier_positions(state["count"]):
+        frontier[lvl] = by_pos.get((lvl, idx), frontier[lvl])
+    new = dict(state, frontier=frontier)
+    if "shard_roots" in state:
+        bits = state["shard_bits"]
+        new["shard_roots"] = [by_pos.get((bits, i), node) for i, node in enumerate(state["shard_roots"])]
+    if merkle_frontier_root(new) != root:
+        raise RuntimeError("Re-keyed trust state does not match the new root; nothing was committed.")
+    return new
+
+def _reseal(r, aes, hmac_ring):
+    """New row values under the current keys, or None if the row fails its checks under its old versions."""
+    if r.get('sensitive_enc') is None:
+        return None
+    if not hmac_ok(r, hmac_ring):
+        return None
+    gender, age = decrypt_private(aes, r)
+    if INTEGRITY_FAIL in (gender, age):
+        return None
+    sealed = seal_row(aes.key, hmac_ring.key, r['first_name'], r['last_name'], gender, age, r['weight'], r['height'],
+                      r['health_history'])
+    return sealed[2:5] + sealed[8:]   # envelope, gender_bidx, age_bidx, row_hmac, merkle_leaf
+
+def rotate_batch(aes, hmac_ring, after_id, limit=ROTATE_BATCH_ROWS):
+    """
+    Re-seals the next `limit` trusted rows after `after_id`. Returns (rows seen, last id, rotated, failed ids,
+    seconds in the transaction); rows seen is 0 once the trusted rows are exhausted. Returns None if rows were added
+    since trust was saved (refresh trust, then retry).
+    """
+    with trust_lock():
+        loaded = load_client_state()
+        if loaded is None:
+            raise RuntimeError("No trusted root saved: refresh trust before rotating keys.")
+        state, trusted_last_id = loaded
+        root = get_trusted_root()
+        started = time.perf_counter()
+        with db_conn() as conn:
+            cur = conn.cursor(buffered=True)
+            rows_cur = conn.cursor(dictionary=True, buffered=True)
+            try:
+                # 1. Block inserts; the stored tree must be exactly the trusted one so the re-rooted nodes are right
+                with stage("rotate.fetch"):
+                    tree = lock_frontier(cur)
+                    if tree["count"] > state["count"]:
+                        conn.rollback()
+                        return None
+                    if tree["count"] < state["count"]:
+                        raise RuntimeError("Server tree is shorter than the trusted one: run `python cli.py locate`.")
+                    rows_cur.execute(ROTATE_SQL, (after_id, trusted_last_id, limit))
+                    rows = rows_cur.fetchall()
+                if not rows:
+                    conn.rollback()
+                    return 0, after_id, 0, [], time.perf_counter() - started
+
+                # 2. The batch must be a contiguous, proven range of the trusted tree
+                with stage("rotate.verify"):
+                    lo = rows[0]['leaf_idx']
+                    if lo is None or any(r['leaf_idx'] != lo + n for n, r in enumerate(rows)):
+                        raise RuntimeError(f"Rows after id {after_id} are not on consecutive leaf positions: "
+                                           "run `python cli.py locate` before rotating.")
+                    old_leaves = [sha256(bytes(r['row_hmac'])) for r in rows]
+                    proof = fetch_range_proof(cur, lo, lo + len(rows) - 1, state["count"])
+                    proven = proof is not None and merkle_range_update(old_leaves, lo, state["count"], proof)
+                    if not proven or proven[0] != root:
+                        raise RuntimeError(f"Rows after id {after_id} do not prove against the trusted root: "
+                                           "run `python cli.py locate` before rotating.")
+
+                # 3. Re-seal the rows still on old key versions
+                with stage("rotate.reseal"):
+                    updates, failed, new_leaves = [], [], []
+                    for r, leaf in zip(rows, old_leaves):
+                        if (r['key_version'], r['hmac_version']) == (aes.current, hmac_ring.current):
+                            new_leaves.append(leaf)
+                            continue
+                        sealed = _reseal(r, aes, hmac_ring)
+                        if sealed is None:
+                            failed.append(r['id'])
+                            new_leaves.append(leaf)
+                            continue
+                        updates.append(sealed + (aes.current, hmac_ring.current, r['id']))
+                        new_leaves.append(sealed[-1])
+                last_id = rows[-1]['id']
+                if not updates:
+                    conn.rollback()
+                    return len(rows), last_id, 0, failed, time.perf_counter() - started
+
+                # 4. Re-root with the same proof, write rows and nodes, and stage the new trust before committing
+                with stage("rotate.write"):
+                    new_root, changed = merkle_range_update(new_leaves, lo, state["count"], proof)
+                    new_state = _rekeyed_state(state, changed, new_root)
+                    rows_cur.executemany(RESEAL_SQL, updates)
+                    write_nodes(cur, changed)
+                    _write_pending(new_state, trusted_last_id, new_root, root)
+                    conn.commit()
+            except Exception:
+                conn.rollback()
+                if os.path.exists(PENDING_STATE_FILE):
+                    os.remove(PENDING_STATE_FILE)
+                raise
+        db_secs = time.perf_counter() - started
+        _promote(new_state, trusted_last_id, new_root, root, changed)
+    count("rotate.rows", len(updates))
+    return len(rows), last_id, len(updates), failed, db_secs
+
+def rotate_keys(batch_rows=ROTATE_BATCH_ROWS, rate=ROTATE_ROWS_PER_SEC, budget=ROTATE_DB_BUDGET, reset=False):
+    """
+    Moves every row onto the current key versions, resuming from the checkpoint. RETURNS (rows rotated, failed ids,
+    rows still on old versions afterwards).
+    """
+    aes, hmac_ring = load_keyring()
+    recover_pending()
+    checkpoint = (new_checkpoint if reset else load_checkpoint)(aes.current, hmac_ring.current)
+    print(f" Rotating to AES key v{aes.current} / HMAC key v{hmac_ring.current} from id {checkpoint['last_id']} "
+          f"({rate or 'unlimited'} rows/s, DB budget {budget or 'none'}).")
+
+    while True:
+        # 1. Next batch; None = rows were added since trust was saved, so trust is refreshed first
+        started = time.perf_counter()
+        result = rotate_batch(aes, hmac_ring, checkpoint["last_id"], batch_rows)
+        if result is None:
+            update_client_trust()
+            continue
+        rows, last_id, rotated, failed, db_secs = result
+        if not rows:
+            # 2. Trusted rows done: rows inserted since then are sealed with the current keys already,
+            # unless they came from a process still on the old configuration; trust them and go on
+            with db_conn() as conn:
+                cur = conn.cursor(buffered=True)
+                cur.execute("SELECT 1 FROM patients WHERE id > %s AND (key_version <> %s OR hmac_version <> %s) LIMIT 1",
+                            (checkpoint["last_id"], aes.current, hmac_ring.current))
+                stragglers = cur.fetchone() is not None
+            if not stragglers:
+                break
+            update_client_trust()
+            continue
+
+        checkpoint.update(last_id=last_id, rotated=checkpoint["rotated"] + rotated,
+                          failed=checkpoint["failed"] + failed)
+        save_checkpoint(checkpoint)
+        if rotated or failed:
+            print(f"   ...rotated {checkpoint['rotated']} rows (up to id {last_id})")
+
+        # 3. Throttle before the next batch
+        time.sleep(throttle_pause(rows, time.perf_counter() - started, db_secs, rate, budget))
+
+    with db_conn() as conn:
+        cur = conn.cursor(buffered=True)
+        cur.execute(REMAINING_SQL, (aes.current, hmac_ring.current))
+        remaining = cur.fetchone()[0]
+    if checkpoint["failed"]:
+        print(f" {len(checkpoint['failed'])} rows were NOT rotated (failed verification under their old keys, or still "
+              f"in the legacy format: run `python migrations.py envelopes`): {checkpoint['failed'][:20]}")
+    print(f" Key rotation complete: {checkpoint['rotated']} rows rotated, {remaining} rows still on old key versions"
+          + (" (keep the old keys until they are resolved)." if remaining else " (old keys can be retired)."))
+    return checkpoint["rotated"], checkpoint["failed"], remaining
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-encrypt and re-MAC patient rows under the current key versions")
+    parser.add_argument("--batch", type=int, default=ROTATE_BATCH_ROWS, help="rows per transaction")
+    parser.add_argument("--rate", type=float, default=ROTATE_ROWS_PER_SEC, help="rows per second (0 = unthrottled)")
+    parser.add_argument("--budget", type=float, default=ROTATE_DB_BUDGET, help="max share of time in transactions (0 = no cap)")
+    parser.add_argument("--reset", action="store_true", help="ignore the checkpoint and start from the first row")
+    args = parser.parse_args()
+    try:
+        _, failed, remaining = rotate_keys(args.batch, args.rate, args.budget, args.reset)
+    except KeyboardInterrupt:
+        print(" Key rotation stopped; progress is saved in the checkpoint.")
+        return 0
+    return 2 if failed or remaining else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,286 @@
+# merkle_diff.py
+
+'''
+merkle_diff.py is the Tamper Localizer. When the server no longer matches client_root.bin, it reports WHICH leaf ranges
+were deleted, inserted or modified, instead of only "FAIL (Data Deleted or Tampered!)".
+
+1) Trusted Snapshot: the client keeps every complete subtree hash of the trusted tree from TRUST_SNAPSHOT_LEVEL up.
+They sit in client_merkle_snapshot/, one append-only file per level. A complete subtree never changes, so refreshing
+trust only appends to these files (key rotation is the exception: update_snapshot rewrites re-keyed nodes in place).
+Level 0 is the leaves themselves, about 64 bytes per row on disk. A higher base level
+only keeps 2^level-leaf blocks: ranges are then exact down to that block size, and the snapshot is 2^level times smaller.
+
+2) diff_tree fn (Top-Down Search): compares the snapshot with the server's merkle_nodes, starting at the root.
+Equal subtrees are skipped whole and only differing ones are opened, so k damaged ranges cost O(k log n) node
+comparisons (one batched query per level). Only subtrees that are complete in both trees are compared, because their
+hash does not depend on the leaf count. Leaves past the shorter tree are reported as deleted (server shorter) or
+inserted (server longer). This assumes the server tree is internally consistent, e.g. rebuilt after rows were changed.
+A node edited without its parents is not visible from the top, but every proof through it fails.
+
+3) scan_rows fn (Row Positions): one index-only pass over patients.leaf_idx finds leaf positions that have no row
+(rows deleted behind the tree's back) and rows that have no position.
+deep=True also compares each row's merkle_leaf with the snapshot's leaves, which catches replayed or swapped rows.
+It needs a level-0 snapshot.
+
+Reports use leaf positions (= row order); ranges are inclusive (lo, hi) pairs, listed with the ids of the rows around them.
+'''
+
+import os
+import json
+import time
+import shutil
+from config import TRUST_SNAPSHOT_LEVEL
+from integrity import sha256
+from merkle_store import fetch_nodes, fetch_count, PROOF_FETCH_CHUNK
+
+SNAPSHOT_DIR = "client_merkle_snapshot"
+SNAPSHOT_META = "snapshot.json"
+NODE_LEN = 32
+# Rows read per round trip while scanning leaf positions
+SCAN_CHUNK_SIZE = 5000
+# Row ids listed per reported range, and orphan row ids listed in total
+REPORT_MAX_IDS = 20
+REPORT_MAX_ORPHANS = 1000
+
+# ---------- Trusted snapshot ----------
+
+def _level_path(h):
+    return os.path.join(SNAPSHOT_DIR, f"level-{h:02d}.bin")
+
+def _write_meta(count):
+    with open(os.path.join(SNAPSHOT_DIR, SNAPSHOT_META), "w") as f:
+        json.dump({"count": count, "base_level": TRUST_SNAPSHOT_LEVEL}, f)
+
+def snapshot_count():
+    """Leaf count the snapshot covers, or None if there is none (or it was taken with another base level)."""
+    path = os.path.join(SNAPSHOT_DIR, SNAPSHOT_META)
+    if TRUST_SNAPSHOT_LEVEL < 0 or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        meta = json.load(f)
+    return meta["count"] if meta["base_level"] == TRUST_SNAPSHOT_LEVEL else None
+
+def drop_snapshot():
+    shutil.rmtree(SNAPSHOT_DIR, ignore_errors=True)
+
+def write_snapshot(leaves):
+    """Replaces the snapshot with the complete subtrees over `leaves` (used by full trust rebuilds)."""
+    if TRUST_SNAPSHOT_LEVEL < 0:
+        return
+    drop_snapshot()
+    os.makedirs(SNAPSHOT_DIR)
+    nodes, h = leaves, 0
+    while nodes:
+        if h >= TRUST_SNAPSHOT_LEVEL:
+            with open(_level_path(h), "wb") as f:
+                f.write(b"".join(nodes))
+        # Only pairs form complete subtrees; an odd last node waits for its sibling
+        nodes = [sha256(nodes[i] + nodes[i + 1]) for i in range(0, len(nodes) - 1, 2)]
+        h += 1
+    _write_meta(len(leaves))
+
+def extend_snapshot(old_count, formed):
+    """
+    Appends the complete nodes closed by new leaves (integrity.merkle_append_complete output, in order) to the snapshot
+    of old_count leaves. A snapshot that does not end at old_count is dropped, and the next full refresh recreates it.
+    Returns True if the snapshot is current afterwards.
+    """
+    if TRUST_SNAPSHOT_LEVEL < 0:
+        return False
+    if snapshot_count() != old_count:
+        drop_snapshot()
+        if old_count:
+            return False
+        os.makedirs(SNAPSHOT_DIR)
+    by_level, added = {}, 0
+    for h, node in formed:
+        added += h == 0
+        if h >= TRUST_SNAPSHOT_LEVEL:
+            by_level.setdefault(h, []).append(node)
+    for h, nodes in by_level.items():
+        with open(_level_path(h), "ab") as f:
+            # Drop anything a crashed earlier refresh wrote past the trusted count
+            f.truncate((old_count >> h) * NODE_LEN)
+            f.write(b"".join(nodes))
+    _write_meta(old_count + added)
+    return True
+
+def update_snapshot(count, nodes):
+    """
+    Overwrites complete nodes that changed in place (merkle_range_update output for a trusted tree of `count` leaves).
+    Nodes that are not complete yet are not in the snapshot and are skipped. Returns True if the snapshot is current.
+    """
+    if snapshot_count() != count:
+        drop_snapshot()
+        return False
+    by_level = {}
+    for h, idx, node in nodes:
+        if h >= TRUST_SNAPSHOT_LEVEL and idx < count >> h:
+            by_level.setdefault(h, []).append((idx, node))
+    for h, level in by_level.items():
+        with open(_level_path(h), "r+b") as f:
+            for idx, node in level:
+                f.seek(idx * NODE_LEN)
+                f.write(node)
+    return True
+
+def _read_nodes(h, indexes):
+    with open(_level_path(h), "rb") as f:
+        nodes = {}
+        for i in indexes:
+            f.seek(i * NODE_LEN)
+            nodes[i] = f.read(NODE_LEN)
+        return nodes
+
+# ---------- Localization ----------
+
+def _merge(ranges):
+    """Sorted inclusive (lo, hi) ranges with touching/overlapping ones joined."""
+    merged = []
+    for lo, hi in sorted(ranges):
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(hi, merged[-1][1]))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+def _server_nodes(cur, h, indexes):
+    found = {}
+    for i in range(0, len(indexes), PROOF_FETCH_CHUNK):
+        positions = [(h, j) for j in indexes[i:i + PROOF_FETCH_CHUNK]]
+        found.update({idx: node for _, idx, node in fetch_nodes(cur, positions)})
+    return found
+
+def diff_tree(cur, trusted_count):
+    """
+    Top-down comparison of the trusted snapshot with the server's stored tree.
+    RETURNS {"server_count", "modified": [(lo, hi)], "deleted": [...], "inserted": [...], "unchecked": [...], "comparisons"}.
+    "unchecked" is the short right-edge block below a base level > 0, which no stored snapshot node covers.
+    """
+    server_count = fetch_count(cur)
+    shared = min(trusted_count, server_count)
+    base = TRUST_SNAPSHOT_LEVEL
+    modified, unchecked, comparisons = [], [], 0
+
+    h = max((shared - 1).bit_length(), base) if shared else base
+    candidates = [0] if shared else []
+    while candidates:
+        # Subtrees complete in both trees are comparable; the right-edge one is opened without comparing
+        full = [i for i in candidates if (i + 1) << h <= shared]
+        edge = [i for i in candidates if (i + 1) << h > shared]
+        differ = []
+        if full:
+            trusted = _read_nodes(h, full)
+            server = _server_nodes(cur, h, full)
+            comparisons += len(full)
+            differ = [i for i in full if server.get(i) != trusted[i]]
+        if h <= base:
+            modified = [(i << h, ((i + 1) << h) - 1) for i in differ]
+            unchecked = [(i << h, shared - 1) for i in edge]
+            break
+        h -= 1
+        candidates = sorted(c for i in differ + edge for c in (2 * i, 2 * i + 1) if c << h < shared)
+
+    return {
+        "server_count": server_count,
+        "modified": _merge(modified),
+        "deleted": [(server_count, trusted_count - 1)] if server_count < trusted_count else [],
+        "inserted": [(trusted_count, server_count - 1)] if server_count > trusted_count else [],
+        "unchecked": unchecked,
+        "comparisons": comparisons,
+    }
+
+def scan_rows(conn, tree_count, trusted_count, deep=False):
+    """
+    One ordered pass over patients.leaf_idx (index only; with deep=True also merkle_leaf).
+    RETURNS {"missing": [{"range", "after_id", "before_id"}], "orphans": [ids], "orphan_count", "replaced": [(lo, hi)]}.
+    """
+    missing, orphans, replaced = [], [], []
+    orphan_count, expected, prev_id = 0, 0, None
+    leaves = open(_level_path(0), "rb") if deep else None
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SELECT leaf_idx, id{', merkle_leaf' if deep else ''} FROM patients ORDER BY leaf_idx")
+        while True:
+            rows = cur.fetchmany(SCAN_CHUNK_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                idx, row_id = row[0], row[1]
+                if idx is None or idx >= tree_count:
+                    # A row the tree does not list (NULL positions sort first)
+                    orphan_count += 1
+                    if len(orphans) < REPORT_MAX_ORPHANS:
+                        orphans.append(row_id)
+                    continue
+                if idx > expected:
+                    missing.append({"range": (expected, idx - 1), "after_id": prev_id, "before_id": row_id})
+                expected, prev_id = idx + 1, row_id
+                if deep and idx < trusted_count:
+                    leaves.seek(idx * NODE_LEN)
+                    if bytes(row[2]) != leaves.read(NODE_LEN):
+                        replaced.append((idx, idx))
+    finally:
+        cur.close()
+        if leaves:
+            leaves.close()
+    if expected < tree_count:
+        missing.append({"range": (expected, tree_count - 1), "after_id": prev_id, "before_id": None})
+    return {"missing": missing, "orphans": orphans, "orphan_count": orphan_count, "replaced": _merge(replaced)}
+
+def _ids_at(cur, lo, hi):
+    cur.execute("SELECT id FROM patients WHERE leaf_idx BETWEEN %s AND %s ORDER BY leaf_idx LIMIT %s",
+                (lo, hi, REPORT_MAX_IDS))
+    return [r[0] for r in cur.fetchall()]
+
+def locate(conn, trusted_count, deep=False):
+    """
+    Full localization report for a trusted tree of trusted_count leaves (see diff_tree / scan_rows).
+    Raises RuntimeError if the snapshot does not match the trusted root's leaf count.
+    """
+    if snapshot_count() != trusted_count:
+        raise RuntimeError("No trusted Merkle snapshot for the current root: refresh trust with full=True "
+                           "(cli.py refresh-trust --full) while the data is known good.")
+    if deep and TRUST_SNAPSHOT_LEVEL != 0:
+        raise ValueError("A deep scan compares leaves and needs TRUST_SNAPSHOT_LEVEL=0.")
+    started = time.time()
+    cur = conn.cursor(buffered=True)
+    report = diff_tree(cur, trusted_count)
+    report["trusted_count"] = trusted_count
+    report["modified"] = [{"range": r, "ids": _ids_at(cur, *r)} for r in report["modified"]]
+    report["inserted"] = [{"range": r, "ids": _ids_at(cur, *r)} for r in report["inserted"]]
+    report["deleted"] = [{"range": r} for r in report["deleted"]]
+    cur.close()
+    report.update(scan_rows(conn, report["server_count"], trusted_count, deep))
+    report["clean"] = not any(report[k] for k in ("modified", "deleted", "inserted", "missing", "orphans", "replaced"))
+    report["deep"] = deep
+    report["seconds"] = round(time.time() - started, 3)
+    return report
+
+def _span(r):
+    lo, hi = r
+    return f"leaf {lo}" if lo == hi else f"leaves {lo}-{hi}"
+
+def format_report(report):
+    """Human-readable lines for a locate() report."""
+    lines = [f" Trusted leaves: {report['trusted_count']}, server tree: {report['server_count']} "
+             f"({report['comparisons']} node comparisons, {report['seconds']}s)"]
+    for e in report["modified"]:
+        lines.append(f" MODIFIED  {_span(e['range'])} (tree nodes differ; row ids {e['ids']})")
+    for e in report["deleted"]:
+        lines.append(f" DELETED   {_span(e['range'])} (server tree is shorter than the trusted one)")
+    for e in report["inserted"]:
+        lines.append(f" INSERTED  {_span(e['range'])} (added since trust was last refreshed; row ids {e['ids']})")
+    for e in report["missing"]:
+        lines.append(f" MISSING   {_span(e['range'])} (no row; between id {e['after_id']} and id {e['before_id']})")
+    if report["orphans"]:
+        lines.append(f" ORPHANS   {report['orphan_count']} row(s) without a tree position "
+                     f"(ids {report['orphans'][:REPORT_MAX_IDS]})")
+    for r in report["replaced"]:
+        lines.append(f" REPLACED  {_span(r)} (row leaf differs from the trusted leaf)")
+    for r in report["unchecked"]:
+        lines.append(f" UNCHECKED {_span(r)} (below the snapshot level)")
+    if report["clean"]:
+        lines.append(" No differences found in the tree or row positions"
+                     + ("." if report.get("deep") else " (deep=True also compares every row's leaf)."))
+    return lines
@@ -0,0 +1,158 @@
+# merkle_forest.py
+
+'''
+merkle_forest.py is the optional Sharded Merkle Forest: the leaves are cut into fixed-size shards of MERKLE_SHARD_SIZE
+(a power of two, 2^k) leaves, each shard is hashed into its own subtree root, and the shard roots are combined into the
+top-level root. Because S is a power of two the shard roots are exactly the level-k nodes of the existing tree, so the
+root, proofs and the server's merkle_nodes table are unchanged (integrity.py point 7).
+
+1) compute_shard_roots fn hashes the shards on a process pool (MERKLE_WORKERS, default all cores), so a multi-million-row
+table is not hashed on one core. build_trust_state turns the shard roots into the incremental frontier update_client_trust
+keeps, plus the list of completed shard roots.
+
+2) Client side: the completed shard roots are saved in client_merkle_state.json next to the frontier, and append_leaf
+records each shard's root the moment its last leaf closes it.
+
+3) changed_shards fn compares those trusted shard roots with the level-k nodes the server stores (one indexed range read),
+so a mismatch points at the shards to look at instead of the whole table.
+
+4) rebuild_server_shards fn is the sharded form of merkle_store.rebuild_server_tree: shard roots are recomputed in parallel
+and compared level by level with the stored nodes; only the nodes that differ (in any shard, or above level k) are
+rewritten, so a corrupted leaf or interior node is repaired even when its shard's root still matches.
+
+Off by default (MERKLE_SHARD_SIZE=0): trust is then built leaf by leaf exactly as before.
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from config import MERKLE_SHARD_SIZE, MERKLE_WORKERS
+from integrity import (merkle_append_complete, new_merkle_frontier, merkle_shard_root, merkle_subtree_levels,
+                       merkle_frontier_from_shards, build_merkle_tree)
+from merkle_store import write_nodes, NODE_CHUNK_SIZE
+from metrics import stage
+
+LEAF_LEN = 32
+
+def shard_bits(shard_size=MERKLE_SHARD_SIZE):
+    """log2 of the shard size. Raises ValueError unless it is a power of two."""
+    if shard_size < 1 or shard_size & (shard_size - 1):
+        raise ValueError(f"MERKLE_SHARD_SIZE must be a power of two, got {shard_size}")
+    return shard_size.bit_length() - 1
+
+def _shard_root(blob):
+    """Worker: root of one shard sent as its concatenated leaves (one bytes object pickles far faster than a list)."""
+    return merkle_shard_root([blob[i:i + LEAF_LEN] for i in range(0, len(blob), LEAF_LEN)])
+
+def _shard_levels(job):
+    """Worker: every stored level of one shard, from its concatenated leaves and the level its top is lifted to."""
+    blob, height = job
+    return merkle_subtree_levels([blob[i:i + LEAF_LEN] for i in range(0, len(blob), LEAF_LEN)], height)
+
+def _pool_map(fn, jobs, workers):
+    """fn over jobs on a process pool (in this process when one worker or one job is enough)."""
+    workers = min(workers or os.cpu_count(), len(jobs))
+    if workers <= 1:
+        return [fn(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(fn, jobs))
+
+def compute_shard_roots(leaves, shard_size=MERKLE_SHARD_SIZE, workers=MERKLE_WORKERS):
+    """Root of every shard_size-leaf shard (the last one may be short), hashed in parallel. Returns a list of hashes."""
+    shard_bits(shard_size)
+    return _pool_map(_shard_root, [b"".join(leaves[i:i + shard_size]) for i in range(0, len(leaves), shard_size)], workers)
+
+def new_trust_state():
+    """Empty frontier, carrying the shard-root list when sharding is on."""
+    state = new_merkle_frontier()
+    if MERKLE_SHARD_SIZE:
+        state["shard_bits"] = shard_bits()
+        state["shard_roots"] = []
+    return state
+
+def build_trust_state(leaves, shard_size=MERKLE_SHARD_SIZE, workers=MERKLE_WORKERS):
+    """Frontier + completed shard roots for a full list of leaves, built shard-parallel."""
+    bits = shard_bits(shard_size)
+    with stage("merkle.shards"):
+        roots = compute_shard_roots(leaves, shard_size, workers)
+    full = len(leaves) >> bits
+    state = merkle_frontier_from_shards(roots[:full], leaves[full << bits:], bits)
+    state["shard_bits"] = bits
+    state["shard_roots"] = roots[:full]
+    return state
+
+def append_leaf(state, leaf, formed=None):
+    """
+    Appends one leaf to the trust state, recording a shard's root when the leaf completes it.
+    formed: optional list that receives the complete (level, hash) nodes the leaf closes (for merkle_diff snapshots).
+    """
+    nodes = merkle_append_complete(state, leaf)
+    bits = state.get("shard_bits")
+    if bits is not None and len(nodes) > bits:
+        # The leaf closed a subtree of 2^bits leaves: that node is the shard's root
+        state["shard_roots"].append(nodes[bits][1])
+    if formed is not None:
+        formed.extend(nodes)
+
+def changed_shards(cur, state):
+    """
+    Indexes of completed shards whose root on the server differs from the trusted one (missing counts as changed).
+    cur: a buffered cursor. The short last shard is not compared: its server node changes with every insert.
+    """
+    roots = state.get("shard_roots")
+    if not roots:
+        return []
+    cur.execute("SELECT idx, hash FROM merkle_nodes WHERE lvl = %s AND idx < %s", (state["shard_bits"], len(roots)))
+    stored = {idx: bytes(node) for idx, node in cur.fetchall()}
+    return [i for i, root in enumerate(roots) if stored.get(i) != root]
+
+def rebuild_server_shards(conn, shard_size=MERKLE_SHARD_SIZE, workers=MERKLE_WORKERS):
+    """
+    Recomputes leaf_idx and the stored tree from patients.merkle_leaf (ordered by id), rewriting only the nodes that
+    differ from the stored ones. Returns the indexes of the shards that had at least one node repaired.
+    """
+    bits = shard_bits(shard_size)
+    cur = conn.cursor(buffered=True)
+    cur.execute("SELECT id, merkle_leaf, leaf_idx FROM patients ORDER BY id")
+    rows = cur.fetchall()
+    leaves = [bytes(r[1]) for r in rows]
+    count = len(leaves)
+
+    # 1. Leaf positions: clear the wrong ones first so the unique index never sees a duplicate
+    moved = [(i, r[0]) for i, r in enumerate(rows) if r[2] != i]
+    for i in range(0, len(moved), NODE_CHUNK_SIZE):
+        cur.executemany("UPDATE patients SET leaf_idx = NULL WHERE id = %s",
+                        [(pid,) for _, pid in moved[i:i + NODE_CHUNK_SIZE]])
+    for i in range(0, len(moved), NODE_CHUNK_SIZE):
+        cur.executemany("UPDATE patients SET leaf_idx = %s WHERE id = %s", moved[i:i + NODE_CHUNK_SIZE])
+
+    # 2. Every level of every shard is recomputed and compared with the stored nodes, so a corrupted leaf or interior
+    # node is repaired even when its shard's root still matches; only the differing nodes are written
+    jobs = [(b"".join(leaves[i:i + shard_size]), bits) for i in range(0, count, shard_size)]
+    if len(jobs) == 1:
+        jobs = [(jobs[0][0], (count - 1).bit_length())]
+    cur.execute("SELECT lvl, idx, hash FROM merkle_nodes")
+    stored = {(lvl, idx): bytes(node) for lvl, idx, node in cur.fetchall()}
+    padded, changed, repair = [], [], []
+    for i, levels in enumerate(_pool_map(_shard_levels, jobs, workers)):
+        # A short last shard is stored lifted to level k (its lone top node hashed with itself)
+        padded.append(levels[-1][0])
+        nodes = [(h, (i << (bits - h)) + j, node) for h, level in enumerate(levels) for j, node in enumerate(level)]
+        wrong = [n for n in nodes if stored.get(n[:2]) != n[2]]
+        if wrong:
+            changed.append(i)
+            repair.extend(wrong)
+
+    # 3. Levels above the shards, then drop nodes past the current size (the table may have shrunk)
+    height = (count - 1).bit_length() if count else 0
+    if len(padded) > 1:
+        _, upper = build_merkle_tree(padded)
+        repair.extend(n for n in ((bits + h, j, node) for h, level in enumerate(upper[1:], 1) for j, node in enumerate(level))
+                      if stored.get(n[:2]) != n[2])
+    write_nodes(cur, repair)
+    for h in range(height + 1):
+        cur.execute("DELETE FROM merkle_nodes WHERE lvl = %s AND idx >= %s", (h, ((count - 1) >> h) + 1 if count else 0))
+    cur.execute("DELETE FROM merkle_nodes WHERE lvl > %s", (height,))
+    conn.commit()
+    print(f" Server Merkle index checked in {len(jobs)} shard(s) of {shard_size}; {len(changed)} repaired "
+          f"({len(repair)} nodes rewritten).")
+    return changed
@@ -0,0 +1,169 @@
+# merkle_store.py
+
+'''
+merkle_store.py keeps a server-side copy of the Merkle tree so single records can be proven without downloading every leaf.
+
+1) merkle_nodes table: every node of the tree is stored as (lvl, idx, hash); level 0 holds the leaves in row order,
+and patients.leaf_idx links each row to its leaf position.
+
+2) lock_frontier / append_leaves (Write Path): inside the insert transaction, the right edge of the stored tree is read
+(one node per set bit of the leaf count) and each new leaf is appended in O(log n), upserting only the nodes on its path.
+
+3) fetch_proof / fetch_proofs (Read Path): load the O(log n) sibling hashes needed to prove a leaf (or a page of leaves,
+sharing common siblings) against the client's trusted root.
+fetch_range_proof loads the boundary nodes of a contiguous leaf range (integrity.merkle_range_positions), so a page of
+rows is proven with O(log n) extra hashes.
+The server is untrusted here: a wrong sibling simply makes the proof fail.
+Proofs against a trusted tree smaller than the stored one pass `known` (integrity.merkle_edge_nodes of the trusted
+frontier): the stored right-edge nodes were overwritten as leaves were appended, so only complete subtrees are fetched.
+frontier_matches checks that a stored tree still starts with the trusted tree (used to vet read replicas before a read).
+
+Functions take a buffered cursor (conn.cursor(buffered=True)) since they run several statements back to back.
+
+4) rebuild_server_tree (Backfill): recomputes leaf_idx and all nodes from the patients table, for rows inserted before this table existed.
+'''
+
+from integrity import merkle_append_path, merkle_proof_positions, merkle_range_positions, build_merkle_tree
+
+UPSERT_NODE_SQL = """INSERT INTO merkle_nodes (lvl, idx, hash) VALUES (%s, %s, %s)
+                     ON DUPLICATE KEY UPDATE hash = VALUES(hash)"""
+
+# Rows per executemany() when writing nodes
+NODE_CHUNK_SIZE = 1000
+# (lvl, idx) pairs per SELECT when loading proof nodes
+PROOF_FETCH_CHUNK = 500
+
+def lock_frontier(cur):
+    """
+    Reads (and row-locks) the current leaf count and right-edge frontier of the stored tree.
+    Must run inside the insert transaction so concurrent writers append one after another.
+    Returns a state dict usable with integrity.merkle_append_path.
+    """
+    cur.execute("SELECT idx FROM merkle_nodes WHERE lvl = 0 ORDER BY idx DESC LIMIT 1 FOR UPDATE")
+    row = cur.fetchone()
+    count = row[0] + 1 if row else 0
+
+    frontier = [None] * count.bit_length()
+    for lvl, idx, node in fetch_nodes(cur, frontier_positions(count)):
+        frontier[lvl] = node
+    return {"count": count, "frontier": frontier}
+
+def frontier_positions(count):
+    """Complete left subtrees waiting for a sibling in a tree of `count` leaves: one (lvl, idx) per set bit of count."""
+    return [(h, (count >> h) - 1) for h in range(count.bit_length()) if (count >> h) & 1]
+
+def fetch_nodes(cur, positions):
+    """Fetches stored nodes for a list of (lvl, idx) positions. Returns [(lvl, idx, hash), ...]."""
+    if not positions:
+        return []
+    cond = " OR ".join(["(lvl = %s AND idx = %s)"] * len(positions))
+    params = [v for pos in positions for v in pos]
+    cur.execute(f"SELECT lvl, idx, hash FROM merkle_nodes WHERE {cond}", params)
+    return [(lvl, idx, bytes(node)) for lvl, idx, node in cur.fetchall()]
+
+def append_leaves(cur, state, leaves):
+    """
+    Appends leaves to the stored tree. Returns the leaf index assigned to each one.
+    Nodes touched by several leaves in the batch are written once with their final value.
+    """
+    changed = {}
+    indexes = []
+    for leaf in leaves:
+        indexes.append(state["count"])
+        for lvl, idx, node in merkle_append_path(state, leaf):
+            changed[(lvl, idx)] = node
+    write_nodes(cur, [(lvl, idx, node) for (lvl, idx), node in changed.items()])
+    return indexes
+
+def write_nodes(cur, nodes):
+    for i in range(0, len(nodes), NODE_CHUNK_SIZE):
+        cur.executemany(UPSERT_NODE_SQL, nodes[i:i + NODE_CHUNK_SIZE])
+
+def fetch_count(cur):
+    """Number of leaves in the stored tree (O(log n) via the primary key)."""
+    cur.execute("SELECT idx FROM merkle_nodes WHERE lvl = 0 ORDER BY idx DESC LIMIT 1")
+    row = cur.fetchone()
+    return row[0] + 1 if row else 0
+
+def fetch_root(cur):
+    """The root node as currently stored on the server (top level, index 0). Cheap change detector, not a trust anchor."""
+    cur.execute("SELECT hash FROM merkle_nodes WHERE idx = 0 ORDER BY lvl DESC LIMIT 1")
+    row = cur.fetchone()
+    return bytes(row[0]) if row else None
+
+def frontier_matches(cur, state):
+    """
+    Whether the stored tree still holds the trusted tree (a frontier state of state["count"] leaves) as its prefix.
+    The trusted frontier's complete subtrees cover exactly the first count leaves and never change once complete, so
+    fetching those O(log n) nodes is enough. A server that lags behind trust or diverged from it fails.
+    """
+    wanted = frontier_positions(state["count"])
+    stored = {(lvl, idx): node for lvl, idx, node in fetch_nodes(cur, wanted)}
+    return all(stored.get(pos) == state["frontier"][pos[0]] for pos in wanted)
+
+def fetch_proof(cur, index, count, known=None):
+    """
+    Loads the proof path for leaf `index` in a tree of `count` leaves.
+    Returns [(sibling_hash, side), ...] for integrity.verify_merkle_proof, or None if a sibling is missing.
+    known: {(lvl, idx): hash} of nodes not to fetch (the trusted tree's incomplete right edge).
+    """
+    return fetch_proofs(cur, [index], count, known)[index]
+
+def fetch_proofs(cur, indexes, count, known=None):
+    """
+    Proof paths for several leaves at once. Siblings shared between the paths are fetched only once.
+    Returns {index: proof or None}.
+    """
+    known = known or {}
+    positions = {i: merkle_proof_positions(i, count) for i in indexes}
+    wanted = sorted({(lvl, sib) for path in positions.values() for lvl, sib, _ in path
+                     if sib is not None and (lvl, sib) not in known})
+    found = dict(known)
+    for i in range(0, len(wanted), PROOF_FETCH_CHUNK):
+        found.update({(lvl, idx): node for lvl, idx, node in fetch_nodes(cur, wanted[i:i + PROOF_FETCH_CHUNK])})
+
+    proofs = {}
+    for index, path in positions.items():
+        proof = []
+        for lvl, sib, side in path:
+            if sib is None:
+                proof.append((None, side))
+            elif (lvl, sib) in found:
+                proof.append((found[(lvl, sib)], side))
+            else:
+                proof = None
+                break
+        proofs[index] = proof
+    return proofs
+
+def fetch_range_proof(cur, lo, hi, count, known=None):
+    """
+    Boundary hashes proving leaves lo..hi of a tree of `count` leaves, in the order integrity.verify_merkle_range expects.
+    Returns None if a node is missing. known: as for fetch_proofs.
+    """
+    known = known or {}
+    positions = merkle_range_positions(lo, hi, count)
+    found = {(lvl, idx): node for lvl, idx, node in fetch_nodes(cur, [p for p in positions if p not in known])}
+    found.update((p, known[p]) for p in positions if p in known)
+    if len(found) != len(positions):
+        return None
+    return [found[pos] for pos in positions]
+
+def rebuild_server_tree(conn):
+    """
+    Recomputes leaf_idx and every stored node from patients.merkle_leaf (ordered by id).
+    Used once to backfill rows that were inserted before merkle_nodes existed.
+    """
+    cur = conn.cursor(buffered=True)
+    cur.execute("SELECT id, merkle_leaf FROM patients ORDER BY id")
+    rows = cur.fetchall()
+    _, levels = build_merkle_tree([bytes(r[1]) for r in rows])
+
+    cur.execute("DELETE FROM merkle_nodes")
+    cur.execute("UPDATE patients SET leaf_idx = NULL")
+    for i in range(0, len(rows), NODE_CHUNK_SIZE):
+        cur.executemany("UPDATE patients SET leaf_idx = %s WHERE id = %s",
+                        [(i + j, r[0]) for j, r in enumerate(rows[i:i + NODE_CHUNK_SIZE])])
+    write_nodes(cur, [(lvl, idx, node) for lvl, level in enumerate(levels) for idx, node in enumerate(level)])
+    conn.commit()
+    print(f" Server Merkle index rebuilt for {len(rows)} rows.")
@@ -0,0 +1,168 @@
+# metrics.py
+
+'''
+metrics.py measures where the time goes inside a query, insert or login, stage by stage.
+
+1) stage(name) context manager / timed(name) decorator: wrap a block or function and record its wall time under `name`
+(e.g. "query.fetch", "query.verify", "crypto.decrypt", "auth.pbkdf2"). count(name, n) adds to a plain counter (e.g. rows read).
+
+2) Aggregation: every stage keeps a call count, total seconds and a fixed-bucket latency histogram (Prometheus style),
+so memory stays constant no matter how many calls are made.
+With tracing on, the most recent individual calls are also kept as (stage, start, seconds, thread) for drill-down.
+
+3) Export: to_prometheus() renders the text exposition format (usable with node_exporter's textfile collector),
+to_json() a plain dict; write_metrics(path) picks the format from the file extension.
+
+Instrumented stages: query.* / find.* / lookup.* / cohort.* / insert.* / trust.* (access_control), auth.* (auth),
+crypto.* (crypto_utils: PBKDF2, AES-GCM, HMAC, blind index), scrub.* (scrubber), rotate.* (key_rotation) and merkle.* (integrity: tree builds and proof checks).
+
+Disabled by default (METRICS_ENABLED=1 in .env to turn on, or enable() at runtime). When disabled, stage() hands back
+one shared no-op object and timed() adds a single flag check per call, so the hooks can stay in the hot paths.
+Rows verified on a worker *process* (parallel_verify.py) are timed in that process and do not show up here.
+'''
+
+import json
+import time
+import atexit
+import bisect
+import threading
+import functools
+from collections import deque
+from config import METRICS_ENABLED, METRICS_TRACE, METRICS_TRACE_MAX, METRICS_FILE
+
+# Histogram upper bounds in seconds (+Inf is implicit)
+BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+PROM_PREFIX = "secure_db"
+
+_enabled = METRICS_ENABLED
+_tracing = METRICS_TRACE
+_stages = {}        # name -> {"count", "sum", "buckets": [per-bucket counts, last one is +Inf]}
+_counters = {}      # name -> int
+_trace = deque(maxlen=METRICS_TRACE_MAX)
+_lock = threading.Lock()
+
+def enabled():
+    return _enabled
+
+def enable(trace=False):
+    global _enabled, _tracing
+    _enabled, _tracing = True, trace
+
+def disable():
+    global _enabled, _tracing
+    _enabled, _tracing = False, False
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+        _trace.clear()
+
+def observe(name, seconds, start=None):
+    """Records one timed call of stage `name`."""
+    with _lock:
+        entry = _stages.get(name)
+        if entry is None:
+            entry = _stages[name] = {"count": 0, "sum": 0.0, "buckets": [0] * (len(BUCKETS) + 1)}
+        entry["count"] += 1
+        entry["sum"] += seconds
+        entry["buckets"][bisect.bisect_left(BUCKETS, seconds)] += 1
+        if _tracing:
+            _trace.append((name, start, seconds, threading.current_thread().name))
+
+def count(name, n=1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+class _Stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start, self.start)
+        return False
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_STAGE = _NoStage()
+
+def stage(name):
+    """`with stage("query.fetch"): ...` times the block (no-op while metrics are disabled)."""
+    return _Stage(name) if _enabled else _NO_STAGE
+
+def timed(name):
+    """Decorator form of stage(): @timed("crypto.hmac")."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start, start)
+        return inner
+    return wrap
+
+def trace():
+    """Most recent individual calls as dicts (empty unless tracing is on)."""
+    with _lock:
+        return [{"stage": n, "start": s, "seconds": d, "thread": t} for n, s, d, t in _trace]
+
+def to_json():
+    """Snapshot: {"stages": {name: {count, sum, avg, buckets: {le: cumulative}}}, "counters": {...}}."""
+    with _lock:
+        stages = {}
+        for name, e in sorted(_stages.items()):
+            cumulative, running = {}, 0
+            for le, n in zip([str(b) for b in BUCKETS] + ["+Inf"], e["buckets"]):
+                running += n
+                cumulative[le] = running
+            stages[name] = {"count": e["count"], "sum": e["sum"],
+                            "avg": e["sum"] / e["count"] if e["count"] else 0.0, "buckets": cumulative}
+        return {"enabled": _enabled, "stages": stages, "counters": dict(sorted(_counters.items()))}
+
+def to_prometheus():
+    """Prometheus text exposition format."""
+    snap = to_json()
+    lines = [f"# HELP {PROM_PREFIX}_stage_seconds Wall time per instrumented stage.",
+             f"# TYPE {PROM_PREFIX}_stage_seconds histogram"]
+    for name, e in snap["stages"].items():
+        for le, n in e["buckets"].items():
+            lines.append(f'{PROM_PREFIX}_stage_seconds_bucket{{stage="{name}",le="{le}"}} {n}')
+        lines.append(f'{PROM_PREFIX}_stage_seconds_sum{{stage="{name}"}} {e["sum"]:.9f}')
+        lines.append(f'{PROM_PREFIX}_stage_seconds_count{{stage="{name}"}} {e["count"]}')
+    lines += [f"# HELP {PROM_PREFIX}_events_total Instrumented event counters.",
+              f"# TYPE {PROM_PREFIX}_events_total counter"]
+    for name, n in snap["counters"].items():
+        lines.append(f'{PROM_PREFIX}_events_total{{event="{name}"}} {n}')
+    return "\n".join(lines) + "\n"
+
+def write_metrics(path=METRICS_FILE):
+    """Writes the current metrics to `path` (JSON if it ends in .json, else Prometheus text)."""
+    if not path:
+        return
+    with open(path, "w") as f:
+        if path.endswith(".json"):
+            json.dump(dict(to_json(), trace=trace()), f, indent=2)
+        else:
+            f.write(to_prometheus())
+
+if METRICS_FILE:
+    atexit.register(write_metrics)
@@ -0,0 +1,154 @@
+# migrations.py
+
+'''
+migrations.py holds the data migrations that rewrite existing patient rows in place (schema changes themselves live in db_setup.MIGRATIONS).
+
+1) migrate_envelopes fn moves rows from the legacy per-field format (gender_enc/nonce/tag + age_enc/nonce/tag: two AES-GCM
+ciphertexts, six columns) into the single sensitive_enc envelope. It works in keyset-ordered batches with one commit per batch,
+so it can be stopped and re-run at any time: rows that already have an envelope are simply skipped.
+Rows whose legacy tags fail to verify are left untouched and reported, never re-encrypted.
+The row HMAC and Merkle leaf do not cover these columns, so the trusted root is unaffected.
+
+2) drop_legacy_columns fn removes the six legacy columns once no unmigrated row is left.
+
+The SQLite backend (storage.py) never had the legacy columns, so 1) and 2) have nothing to do there.
+
+3) backfill_blind_indexes fn fills gender_bidx/age_bidx for rows written before blind indexes existed (same batching and resume rules).
+With rebuild=True it recomputes every row, which is needed after changing AGE_BUCKET_WIDTH.
+
+Both keep each row's key versions: rows are decrypted, and re-sealed or indexed, with the keys of that row's key_version /
+hmac_version from the keyring. Moving rows to the current keys is key_rotation.py's job.
+
+Run: python migrations.py envelopes [--batch N] [--drop-legacy]
+     python migrations.py blind-index [--batch N] [--rebuild]
+'''
+
+import argparse
+from config import db_conn, load_keyring, DB_BACKEND
+from crypto_utils import decrypt_val, encrypt_envelope, INTEGRITY_FAIL
+from access_control import blind_tokens, decrypt_private, key_for
+
+ENVELOPE_BATCH_SIZE = 1000
+BLIND_INDEX_BATCH_SIZE = 1000
+LEGACY_COLUMNS = ("gender_enc", "gender_nonce", "gender_tag", "age_enc", "age_nonce", "age_tag")
+
+def migrate_envelopes(batch_size=ENVELOPE_BATCH_SIZE):
+    """Re-encrypts legacy rows into envelopes. Returns (migrated, failed_ids)."""
+    if DB_BACKEND == "sqlite":
+        print(" Nothing to migrate: the SQLite schema has no legacy columns.")
+        return 0, []
+    aes_ring, _ = load_keyring()
+    migrated, failed = 0, []
+    last_id = 0
+
+    with db_conn() as conn:
+        cur = conn.cursor(dictionary=True, buffered=True)
+        while True:
+            cur.execute(
+                f"SELECT id, key_version, {', '.join(LEGACY_COLUMNS)} FROM patients "
+                "WHERE sensitive_enc IS NULL AND id > %s ORDER BY id LIMIT %s",
+                (last_id, batch_size)
+            )
+            rows = cur.fetchall()
+            if not rows:
+                break
+
+            updates = []
+            for r in rows:
+                aes_k = key_for(aes_ring, r['key_version'])
+                if aes_k is None:
+                    failed.append(r['id'])
+                    continue
+                gender = decrypt_val(aes_k, r['gender_enc'], r['gender_nonce'], r['gender_tag'], int)
+                age = decrypt_val(aes_k, r['age_enc'], r['age_nonce'], r['age_tag'], int)
+                if INTEGRITY_FAIL in (gender, age):
+                    failed.append(r['id'])
+                    continue
+                updates.append((encrypt_envelope(aes_k, {"gender": gender, "age": age}), r['id']))
+
+            cur.executemany(
+                "UPDATE patients SET sensitive_enc = %s, "
+                + ", ".join(f"{c} = NULL" for c in LEGACY_COLUMNS) + " WHERE id = %s",
+                updates
+            )
+            conn.commit()   # checkpoint: everything up to this batch survives an interruption
+            migrated += len(updates)
+            last_id = rows[-1]['id']
+            print(f"   ...migrated {migrated} rows (up to id {last_id})")
+
+    if failed:
+        print(f" {len(failed)} rows failed legacy tag verification and were left as-is: {failed[:20]}")
+    print(f" Envelope migration complete: {migrated} rows migrated.")
+    return migrated, failed
+
+def drop_legacy_columns():
+    """Drops the per-field columns once every row carries an envelope. Returns True if dropped."""
+    if DB_BACKEND == "sqlite":
+        return False
+    with db_conn() as conn:
+        cur = conn.cursor(buffered=True)
+        cur.execute("SELECT COUNT(*) FROM patients WHERE sensitive_enc IS NULL")
+        remaining = cur.fetchone()[0]
+        if remaining:
+            print(f" Not dropping legacy columns: {remaining} rows still unmigrated.")
+            return False
+        cur.execute("ALTER TABLE patients " + ", ".join(f"DROP COLUMN {c}" for c in LEGACY_COLUMNS))
+        conn.commit()
+    print(" Legacy gender/age columns dropped.")
+    return True
+
+def backfill_blind_indexes(batch_size=BLIND_INDEX_BATCH_SIZE, rebuild=False):
+    """Writes blind-index tokens for rows missing them (or all rows if rebuild). Returns (updated, failed_ids)."""
+    aes_k, hmac_ring = load_keyring()
+    updated, failed = 0, []
+    last_id = 0
+    pending = "" if rebuild else "(gender_bidx IS NULL OR age_bidx IS NULL) AND "
+
+    with db_conn() as conn:
+        cur = conn.cursor(dictionary=True, buffered=True)
+        while True:
+            cur.execute(f"SELECT * FROM patients WHERE {pending}id > %s ORDER BY id LIMIT %s", (last_id, batch_size))
+            rows = cur.fetchall()
+            if not rows:
+                break
+
+            updates = []
+            for r in rows:
+                gender, age = decrypt_private(aes_k, r)
+                hmac_k = key_for(hmac_ring, r.get('hmac_version'))
+                if INTEGRITY_FAIL in (gender, age) or hmac_k is None:
+                    failed.append(r['id'])
+                    continue
+                updates.append(blind_tokens(hmac_k, gender, age) + (r['id'],))
+
+            cur.executemany("UPDATE patients SET gender_bidx = %s, age_bidx = %s WHERE id = %s", updates)
+            conn.commit()   # checkpoint
+            updated += len(updates)
+            last_id = rows[-1]['id']
+            print(f"   ...indexed {updated} rows (up to id {last_id})")
+
+    if failed:
+        print(f" {len(failed)} rows failed decryption and were not indexed: {failed[:20]}")
+    print(f" Blind-index backfill complete: {updated} rows indexed.")
+    return updated, failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Secure DB data migrations")
+    sub = parser.add_subparsers(dest="command", required=True)
+    env = sub.add_parser("envelopes", help="move legacy gender/age ciphertexts into sensitive_enc")
+    env.add_argument("--batch", type=int, default=ENVELOPE_BATCH_SIZE)
+    env.add_argument("--drop-legacy", action="store_true", help="drop the old columns when done")
+    bidx = sub.add_parser("blind-index", help="fill gender/age blind-index tokens for cohort queries")
+    bidx.add_argument("--batch", type=int, default=BLIND_INDEX_BATCH_SIZE)
+    bidx.add_argument("--rebuild", action="store_true", help="recompute every row (after changing AGE_BUCKET_WIDTH)")
+    args = parser.parse_args()
+
+    if args.command == "envelopes":
+        migrate_envelopes(args.batch)
+        if args.drop_legacy:
+            drop_legacy_columns()
+    elif args.command == "blind-index":
+        backfill_blind_indexes(args.batch, args.rebuild)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# parallel_verify.py
+
+'''
+parallel_verify.py is the optional Parallel Verification Engine for full-table reads.
+
+1) get_verify_pool fn starts (once, then reuses) a process or thread pool. Each worker receives the row-check function and the
+AES/HMAC keys a single time through the pool initializer, so keys are not re-sent with every batch of rows.
+
+2) verify_rows fn splits a list of fetched rows into chunks, runs them on the pool and returns the results in the original row order.
+The per-row work is the same function the serial path uses, so the "integrity" / "[INTEGRITY FAIL]" results are identical.
+
+Enabled by VERIFY_WORKERS in .env (0 = serial verification in the caller).
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Rows handed to a worker per task (amortizes pickling/IPC overhead)
+VERIFY_CHUNK_SIZE = 250
+
+# Per-worker state, set once by _init_worker
+_row_fn = None
+_keys = None
+
+_pool = None
+_pool_config = None
+
+def _init_worker(row_fn, aes_k, hmac_k):
+    global _row_fn, _keys
+    _row_fn = row_fn
+    _keys = (aes_k, hmac_k)
+
+def _verify_chunk(rows):
+    aes_k, hmac_k = _keys
+    return [_row_fn(r, aes_k, hmac_k) for r in rows]
+
+def get_verify_pool(row_fn, aes_k, hmac_k, workers=None, use_processes=True):
+    """Returns the shared worker pool, (re)starting it if the function, keys or size changed."""
+    global _pool, _pool_config
+    workers = workers or os.cpu_count()
+    config = (row_fn, aes_k, hmac_k, workers, use_processes)
+    if _pool is not None and _pool_config == config:
+        return _pool
+
+    shutdown_verify_pool()
+    executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    _pool = executor(max_workers=workers, initializer=_init_worker, initargs=(row_fn, aes_k, hmac_k))
+    _pool_config = config
+    return _pool
+
+def shutdown_verify_pool():
+    global _pool, _pool_config
+    if _pool is not None:
+        _pool.shutdown()
+    _pool, _pool_config = None, None
+
+def submit_rows(pool, rows, chunk_size=VERIFY_CHUNK_SIZE):
+    """Starts verifying rows in the background. Returns futures to pass to collect_rows."""
+    return [pool.submit(_verify_chunk, rows[i:i + chunk_size]) for i in range(0, len(rows), chunk_size)]
+
+def collect_rows(futures):
+    """Waits for submit_rows' futures and returns the verified rows in their original order."""
+    results = []
+    for fut in futures:
+        results.extend(fut.result())
+    return results
+
+def verify_rows(pool, rows, chunk_size=VERIFY_CHUNK_SIZE):
+    """Verifies rows on the pool and returns the results in the original order."""
+    return collect_rows(submit_rows(pool, rows, chunk_size))
@@ -5,14 +5,17 @@ populate.py serves as the Data Generator for simulation.
 
 1)get_realistic_history fn is resposible for medical data follows real-world health contexts
 
-2) seed_data leverages the Faker library for 100 synthetic identities, simulating an authorized session to drive insert_patient for bulk encrypted insertion before refreshing the Merkle Root.
+2) seed_data leverages the Faker library for synthetic identities, simulating an authorized session to drive insert_patients for bulk encrypted insertion
+(chunked executemany inside one transaction) before refreshing the Merkle Root once.
+
+3) For large datasets use bulk_seed.py, which generates and seals rows on a process pool from a fixed seed and bulk-loads them.
 '''
 
 
 
 from faker import Faker
 import random
-from access_control import insert_patient, update_client_trust
+from access_control import insert_patients, BULK_CHUNK_SIZE
 from auth import create_user
 
 # Realistic medical health history
@@ -56,9 +59,23 @@ def get_realistic_history():
     else:
         return random.choice(HISTORY_SERIOUS)
 
-def seed_data(count=100):
+def generate_patients(count, fake=None):
+    """Yields (first, last, gender, age, weight, height, history) tuples for synthetic patients."""
+    fake = fake or Faker()
+    for _ in range(count):
+        first = fake.first_name()
+        last = fake.last_name()
+        gender = random.choice([0, 1])
+        age = random.randint(18, 90)
+        weight = round(random.uniform(50.0, 120.0), 2)
+        height = round(random.uniform(150.0, 200.0), 2)
+        
+        history = get_realistic_history()
+        
+        yield (first, last, gender, age, weight, height, history)
+
+def seed_data(count=100, chunk_size=BULK_CHUNK_SIZE):
     print(f"Seeding {count} fake patients with realistic history...")
-    fake = Faker()
     
     #create the doctor user here to ensure they exist, so that way we can use their permissions to insert data.
     try: 
@@ -69,21 +86,6 @@ def seed_data(count=100):
     # Simulate the Doctor (Group H)
     session = {"user_group": "H"}
     
-    for i in range(count):
-        first = fake.first_name()
-        last = fake.last_name()
-        gender = random.choice([0, 1])
-        age = random.randint(18, 90)
-        weight = round(random.uniform(50.0, 120.0), 2)
-        height = round(random.uniform(150.0, 200.0), 2)
-        
-        history = get_realistic_history()
-        
-        insert_patient(session, first, last, gender, age, weight, height, history)
-        
-        if (i+1) % 20 == 0:
-            print(f"   ...inserted {i+1} records")
-        
-    # Update merkle root after seeding
-    update_client_trust()
-    print("Seeding complete.")
\ No newline at end of file
+    # Rows are generated lazily and written in chunks; merkle root is updated once at the end
+    insert_patients(session, generate_patients(count), chunk_size=chunk_size)
+    print("Seeding complete.")
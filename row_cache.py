@@ -0,0 +1,92 @@
+# row_cache.py
+
+'''
+row_cache.py is an in-process cache of rows that already passed verification, so repeated reads of an unchanged table skip decryption.
+
+1) Entries are keyed by (id, row_hmac, envelope) and hold the decrypted, UNREDACTED result; access_control still applies group redaction on every read.
+put stores a copy and get returns a copy, so a caller editing its result can never change what later readers are served.
+A row whose HMAC or ciphertext changes gets a new key, and access_control re-checks the HMAC on every hit,
+so a stale or tampered row can never be served from here.
+
+2) LRU Eviction: an OrderedDict bounded by ROW_CACHE_MAX_ENTRIES and an approximate byte budget ROW_CACHE_MAX_BYTES.
+
+3) sync_root fn ties the cache to the server's Merkle root, per source: the primary and each replica (which may lag) keep
+their own root and their own entries, and when a source's root moves (insert, delete, tamper) that source's entries are
+dropped. Reads alternating between sources at different roots therefore do not flush each other.
+
+Thread-safe, since the HTTP service verifies rows from several worker threads. Set ROW_CACHE_MAX_ENTRIES=0 to disable.
+'''
+
+import threading
+from collections import OrderedDict
+from config import ROW_CACHE_MAX_ENTRIES, ROW_CACHE_MAX_BYTES
+
+# Rough per-entry overhead (dict, key tuple, ints/floats) on top of the string payload
+ENTRY_OVERHEAD = 400
+
+_entries = OrderedDict()   # (source, key) -> value
+_roots = {}                # source -> root its entries were filled under
+_bytes = 0
+_hits = 0
+_misses = 0
+_lock = threading.Lock()
+
+def _entry_size(value):
+    return ENTRY_OVERHEAD + sum(len(v) for v in value.values() if isinstance(v, str))
+
+def enabled():
+    return ROW_CACHE_MAX_ENTRIES > 0 and ROW_CACHE_MAX_BYTES > 0
+
+def sync_root(root, source=None):
+    """Drops source's entries if its Merkle root differs from the one they were filled under."""
+    global _bytes
+    with _lock:
+        if source in _roots and root == _roots[source]:
+            return
+        _roots[source] = root
+        for k in [k for k in _entries if k[0] == source]:
+            _bytes -= _entry_size(_entries.pop(k))
+
+def get(key, source=None):
+    global _hits, _misses
+    key = (source, key)
+    with _lock:
+        value = _entries.get(key)
+        if value is None:
+            _misses += 1
+            return None
+        _entries.move_to_end(key)
+        _hits += 1
+        return dict(value)
+
+def put(key, value, source=None):
+    global _bytes
+    if not enabled():
+        return
+    key = (source, key)
+    value = dict(value)
+    size = _entry_size(value)
+    with _lock:
+        old = _entries.pop(key, None)
+        if old is not None:
+            _bytes -= _entry_size(old)
+        _entries[key] = value
+        _bytes += size
+        # Evict least recently used until both bounds hold
+        while _entries and (len(_entries) > ROW_CACHE_MAX_ENTRIES or _bytes > ROW_CACHE_MAX_BYTES):
+            _, evicted = _entries.popitem(last=False)
+            _bytes -= _entry_size(evicted)
+
+def _clear_locked():
+    global _bytes
+    _entries.clear()
+    _bytes = 0
+
+def clear():
+    with _lock:
+        _clear_locked()
+        _roots.clear()
+
+def stats():
+    with _lock:
+        return {"entries": len(_entries), "bytes": _bytes, "hits": _hits, "misses": _misses}
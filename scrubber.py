@@ -0,0 +1,174 @@
+# scrubber.py
+
+'''
+scrubber.py is the Background Integrity Scrubber. Queries only verify the rows they return, so tampering with rows nobody
+reads would go unnoticed. The scrubber walks the whole patients table continuously, a small chunk at a time.
+
+1) Keyset chunks: rows are read SCRUB_CHUNK_ROWS at a time (`WHERE id > last_id ORDER BY id LIMIT n`, primary key range).
+The connection goes back to the pool before the rows are checked, so a pass never holds a connection or a long transaction.
+
+2) Per-row checks: the row HMAC is recomputed ("hmac"), the stored Merkle leaf must be the hash of that HMAC ("leaf"), and
+the AES-GCM tag of the envelope (or of the legacy per-field ciphertexts) must verify ("gcm"). Decrypted values are discarded.
+Each row is checked with the keys of its own key versions, so a pass can run during a key rotation.
+
+3) Checkpoint: after every chunk the last id reached and the pass totals are written to SCRUB_CHECKPOINT_FILE (atomically,
+via a temp file). A restarted scrubber resumes where it stopped; at most one chunk is checked twice.
+
+4) Throttling: SCRUB_ROWS_PER_SEC caps throughput, and SCRUB_DB_BUDGET caps the share of wall time spent waiting on the
+database (0.2 = after a read that took 10 ms, rest 40 ms). The longer of the two pauses wins. Interactive queries therefore
+never compete with one long blocking pass.
+
+5) Alerts: each chunk with failing rows raises one alert (row ids + failed checks, never row contents). The alert is printed,
+appended as one JSON line to SCRUB_ALERT_FILE, and piped to SCRUB_ALERT_CMD (e.g. a mail or pager script) when one is set.
+
+Missing or re-ordered rows are not a per-row property: use locate_tampering (merkle_diff.py) for those.
+Run: python scrubber.py [--once] [--max-rows N] [--rate ROWS_PER_SEC] [--budget SHARE] [--chunk N] [--reset]
+'''
+
+import os
+import sys
+import json
+import time
+import hmac
+import argparse
+import subprocess
+from config import (db_conn, load_keyring, SCRUB_CHUNK_ROWS, SCRUB_ROWS_PER_SEC, SCRUB_DB_BUDGET, SCRUB_PASS_INTERVAL,
+                    SCRUB_CHECKPOINT_FILE, SCRUB_ALERT_FILE, SCRUB_ALERT_CMD)
+from crypto_utils import INTEGRITY_FAIL
+from integrity import sha256
+from access_control import decrypt_private, hmac_ok
+from metrics import stage, count
+
+SCRUB_SQL = "SELECT * FROM patients WHERE id > %s ORDER BY id LIMIT %s"
+
+def new_checkpoint():
+    return {"last_id": 0, "pass": 1, "pass_started": time.time(), "pass_rows": 0, "pass_failures": 0, "last_pass": None}
+
+def load_checkpoint(path=SCRUB_CHECKPOINT_FILE):
+    """The saved scrub position, or a fresh one starting at the first row."""
+    if not os.path.exists(path):
+        return new_checkpoint()
+    with open(path, "r") as f:
+        return json.load(f)
+
+def save_checkpoint(checkpoint, path=SCRUB_CHECKPOINT_FILE):
+    # Write-then-rename: a crash mid-write leaves the previous checkpoint intact
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path)
+
+def check_row(r, aes_k, hmac_k):
+    """Names of the checks one fetched row fails ([] = clean)."""
+    failed = []
+    if not hmac_ok(r, hmac_k):
+        failed.append("hmac")
+    if not hmac.compare_digest(sha256(bytes(r['row_hmac'])), bytes(r['merkle_leaf'])):
+        failed.append("leaf")
+    if INTEGRITY_FAIL in decrypt_private(aes_k, r):
+        failed.append("gcm")
+    return failed
+
+def raise_alert(alert):
+    """Reports one alert on every configured channel. A broken channel is reported, never fatal."""
+    line = json.dumps(alert)
+    print(f" ALERT: {line}", file=sys.stderr)
+    if SCRUB_ALERT_FILE:
+        with open(SCRUB_ALERT_FILE, "a") as f:
+            f.write(line + "\n")
+    if SCRUB_ALERT_CMD:
+        try:
+            subprocess.run(SCRUB_ALERT_CMD, shell=True, input=line, text=True, timeout=30, check=True)
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f" Alert command failed: {e}", file=sys.stderr)
+
+def throttle_pause(rows, secs, db_secs, rate=SCRUB_ROWS_PER_SEC, budget=SCRUB_DB_BUDGET):
+    """Seconds to rest after a chunk of `rows` that took `secs` in total, `db_secs` of it in the database."""
+    rate_pause = rows / rate - secs if rate else 0.0
+    load_pause = db_secs * (1 - budget) / budget - (secs - db_secs) if budget else 0.0
+    return max(rate_pause, load_pause, 0.0)
+
+def scrub_chunk(aes_k, hmac_k, after_id, limit=SCRUB_CHUNK_ROWS):
+    """Checks the next `limit` rows after `after_id`. Returns (rows checked, last id, failures, seconds in the DB)."""
+    started = time.perf_counter()
+    with stage("scrub.fetch"), db_conn() as conn:
+        cur = conn.cursor(dictionary=True, buffered=True)
+        cur.execute(SCRUB_SQL, (after_id, limit))
+        rows = cur.fetchall()
+    db_secs = time.perf_counter() - started
+
+    with stage("scrub.verify"):
+        failures = []
+        for r in rows:
+            failed = check_row(r, aes_k, hmac_k)
+            if failed:
+                failures.append({"id": r['id'], "checks": failed})
+    count("scrub.rows", len(rows))
+    count("scrub.failures", len(failures))
+    return len(rows), rows[-1]['id'] if rows else after_id, failures, db_secs
+
+def scrub(once=False, max_rows=None, chunk_rows=SCRUB_CHUNK_ROWS, rate=SCRUB_ROWS_PER_SEC, budget=SCRUB_DB_BUDGET,
+          interval=SCRUB_PASS_INTERVAL, reset=False):
+    """
+    Scrubs the table from the saved checkpoint, forever unless once (stop after the current pass ends) or
+    max_rows (stop after that many rows, e.g. a cron slice) is given. RETURNS the number of failing rows found.
+    """
+    aes_k, hmac_k = load_keyring()
+    checkpoint = new_checkpoint() if reset else load_checkpoint()
+    checked = failing = 0
+    print(f" Scrubbing from id {checkpoint['last_id']} (pass {checkpoint['pass']}, "
+          f"{rate or 'unlimited'} rows/s, DB budget {budget or 'none'}).")
+
+    while max_rows is None or checked < max_rows:
+        # 1. Verify the next chunk
+        started = time.perf_counter()
+        limit = chunk_rows if max_rows is None else min(chunk_rows, max_rows - checked)
+        rows, last_id, failures, db_secs = scrub_chunk(aes_k, hmac_k, checkpoint["last_id"], limit)
+        checked += rows
+        failing += len(failures)
+        checkpoint.update(last_id=last_id, pass_rows=checkpoint["pass_rows"] + rows,
+                          pass_failures=checkpoint["pass_failures"] + len(failures))
+        if failures:
+            raise_alert({"time": time.time(), "kind": "row_integrity", "pass": checkpoint["pass"], "failures": failures})
+
+        # 2. End of the table: close the pass and start the next one from the first row
+        if rows < limit:
+            done = time.time()
+            checkpoint["last_pass"] = {"pass": checkpoint["pass"], "finished": done, "rows": checkpoint["pass_rows"],
+                                       "failures": checkpoint["pass_failures"],
+                                       "secs": round(done - checkpoint["pass_started"], 1)}
+            print(f" Pass {checkpoint['pass']} complete: {checkpoint['pass_rows']} rows, "
+                  f"{checkpoint['pass_failures']} failing.")
+            checkpoint.update(new_checkpoint(), **{"pass": checkpoint["pass"] + 1, "last_pass": checkpoint["last_pass"]})
+        save_checkpoint(checkpoint)
+
+        if rows < limit:
+            if once:
+                break
+            time.sleep(interval)
+            checkpoint["pass_started"] = time.time()
+            continue
+
+        # 3. Throttle before the next chunk
+        time.sleep(throttle_pause(rows, time.perf_counter() - started, db_secs, rate, budget))
+    return failing
+
+def main():
+    parser = argparse.ArgumentParser(description="Background integrity scrubber for the patients table")
+    parser.add_argument("--once", action="store_true", help="stop when the current pass reaches the end of the table")
+    parser.add_argument("--max-rows", type=int, default=None, help="stop after checking this many rows")
+    parser.add_argument("--chunk", type=int, default=SCRUB_CHUNK_ROWS)
+    parser.add_argument("--rate", type=float, default=SCRUB_ROWS_PER_SEC, help="rows per second (0 = unthrottled)")
+    parser.add_argument("--budget", type=float, default=SCRUB_DB_BUDGET, help="max share of time in DB reads (0 = no cap)")
+    parser.add_argument("--interval", type=float, default=SCRUB_PASS_INTERVAL, help="seconds between passes")
+    parser.add_argument("--reset", action="store_true", help="ignore the checkpoint and start a new pass")
+    args = parser.parse_args()
+    try:
+        failing = scrub(args.once, args.max_rows, args.chunk, args.rate, args.budget, args.interval, args.reset)
+    except KeyboardInterrupt:
+        print(" Scrubber stopped; progress is saved in the checkpoint.")
+        return 0
+    return 2 if failing else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
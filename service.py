@@ -0,0 +1,308 @@
+# service.py
+
+'''
+service.py is the network front-end: an asyncio HTTP/JSON server so many clinic terminals can share one process.
+
+1) The event loop only parses HTTP and routes requests; every blocking call (PBKDF2 login, MySQL, AES-GCM/HMAC) runs on a
+bounded thread pool via run_in_executor, so one slow query never stalls the other clients.
+
+2) Backpressure: at most SERVICE_MAX_IN_FLIGHT requests are admitted at once. Others wait up to SERVICE_QUEUE_TIMEOUT seconds
+for a slot and then get "503 Busy" with Retry-After, instead of piling up unbounded work.
+
+3) Authentication uses the signed session tokens from auth.login_token (header "Authorization: Bearer <token>"),
+so PBKDF2 is paid once per session rather than per request.
+
+4) Single inserts go through the group-commit queue (write_queue.py): the row is sealed on the thread pool, then the request
+awaits its batch's commit without holding a thread, so concurrent inserts share one transaction and one trusted-root update.
+
+Endpoints (JSON in / JSON out):
+    POST /login              {"username", "password"}            -> {"token"}
+    POST /logout
+    POST /patients           {first, last, gender, age, weight, height, history}   -> {"id", "leaf_idx"}
+    POST /patients/bulk      {"rows": [{...}, ...]}              -> {"inserted"}
+    GET  /patients?after_id=0&limit=50[&id_min=&id_max=][&columns=first,last]
+                                                                 -> {"rows", "status", "next_after_id"}
+    GET  /patients/<id>                                          -> {"row", "status"}
+    POST /trust/refresh                                          (Group H only)
+    GET  /health
+    GET  /metrics                                                -> per-stage latency snapshot (Group H only, see metrics.py)
+
+Run: python service.py [--host HOST] [--port PORT]
+'''
+
+import asyncio
+import json
+import argparse
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (SERVICE_HOST, SERVICE_PORT, SERVICE_WORKERS,
+                    SERVICE_MAX_IN_FLIGHT, SERVICE_QUEUE_TIMEOUT)
+from auth import login_token, validate_token, revoke_token
+import metrics
+from access_control import insert_patients, find_patients, get_patient, update_client_trust, MAX_AGE
+from write_queue import submit_insert
+
+MAX_BODY = 16 * 1024 * 1024      # bytes accepted per request body
+MAX_PAGE = 1000                  # rows per GET /patients page
+PATIENT_FIELDS = ("first", "last", "gender", "age", "weight", "height", "history")
+# Same types app.py's insert form produces: the row HMAC covers the values' text, so 70 and 70.0 must not both get in
+PATIENT_TYPES = (str, str, int, int, float, float, str)
+TYPE_NAMES = {str: "a string", int: "an integer", float: "a number"}
+
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden",
+           404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+# ---------- Request helpers ----------
+
+def _patient_tuple(body):
+    """Validates one JSON patient and coerces it to the types the rest of the app inserts."""
+    try:
+        values = [body[f] for f in PATIENT_FIELDS]
+    except (KeyError, TypeError):
+        raise HTTPError(400, f"Patient needs fields: {', '.join(PATIENT_FIELDS)}")
+    row = []
+    for field, cast, value in zip(PATIENT_FIELDS, PATIENT_TYPES, values):
+        if value is None or isinstance(value, (dict, list, bool)) or (cast is int and isinstance(value, float)
+                                                                      and not value.is_integer()):
+            raise HTTPError(400, f"{field} must be {TYPE_NAMES[cast]}")
+        try:
+            row.append(cast(value))
+        except ValueError:
+            raise HTTPError(400, f"{field} must be {TYPE_NAMES[cast]}")
+    first, last, gender, age, weight, height, history = row
+    if gender not in (0, 1):
+        raise HTTPError(400, "gender must be 0 (Female) or 1 (Male)")
+    if not 0 <= age <= MAX_AGE:
+        raise HTTPError(400, f"age must be between 0 and {MAX_AGE}")
+    return tuple(row)
+
+def _int_param(query, name, default=None):
+    value = query.get(name, [None])[0]
+    if value is None or value == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise HTTPError(400, f"{name} must be an integer")
+
+# ---------- Handlers ----------
+
+def _require_token(req):
+    auth = req["headers"].get("authorization", "")
+    token = auth[7:].strip() if auth.lower().startswith("bearer ") else None
+    if not token or validate_token(token) is None:
+        raise HTTPError(401, "Missing, expired or revoked session token")
+    return token
+
+def _require_group_h(req):
+    """Like _require_token, for endpoints that change shared state: Group H sessions only."""
+    token = _require_token(req)
+    session = validate_token(token)
+    if session is None or session['user_group'] != 'H':
+        raise HTTPError(403, "Access Denied: Group H only.")
+    return token
+
+async def _run(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+async def h_login(req):
+    body = req["json"] if isinstance(req["json"], dict) else {}
+    token = await _run(login_token, body.get("username", ""), body.get("password", ""))
+    if token is None:
+        raise HTTPError(401, "Login Failed")
+    return 200, {"token": token}
+
+async def h_logout(req):
+    revoke_token(_require_token(req))
+    return 200, {"status": "logged out"}
+
+async def h_insert(req):
+    token = _require_token(req)
+    row = _patient_tuple(req["json"])
+    fut = await _run(submit_insert, token, *row)
+    result = await asyncio.wrap_future(fut)
+    return 201, dict(result, status="inserted")
+
+async def h_bulk_insert(req):
+    token = _require_token(req)
+    body = req["json"] if isinstance(req["json"], dict) else {}
+    rows = [_patient_tuple(r) for r in body.get("rows", [])]
+    inserted = await _run(insert_patients, token, rows)
+    return 201, {"inserted": inserted}
+
+async def h_query(req):
+    token = _require_token(req)
+    q = req["query"]
+    limit = max(min(_int_param(q, "limit", 50), MAX_PAGE), 1)
+    columns = q["columns"][0].split(",") if q.get("columns") else None
+    rows, status, next_after_id = await _run(
+        find_patients, token, _int_param(q, "id_min"), _int_param(q, "id_max"),
+        _int_param(q, "after_id"), limit, columns)
+    return 200, {"rows": rows, "status": status, "next_after_id": next_after_id}
+
+async def h_get(req, patient_id):
+    token = _require_token(req)
+    try:
+        patient_id = int(patient_id)
+    except ValueError:
+        raise HTTPError(400, "Invalid ID format")
+    row, status = await _run(get_patient, token, patient_id)
+    if row is None:
+        raise HTTPError(404, f"Patient ID {patient_id} not found")
+    return 200, {"row": row, "status": status}
+
+async def h_refresh_trust(req):
+    # Re-pinning the trusted root accepts whatever the server holds now, so readers may not do it
+    _require_group_h(req)
+    await _run(update_client_trust)
+    return 200, {"status": "trusted root updated"}
+
+async def h_health(req):
+    return 200, {"status": "ok"}
+
+async def h_metrics(req):
+    _require_group_h(req)
+    return 200, metrics.to_json()
+
+ROUTES = {
+    ("POST", "/login"): h_login,
+    ("POST", "/logout"): h_logout,
+    ("POST", "/patients"): h_insert,
+    ("POST", "/patients/bulk"): h_bulk_insert,
+    ("GET", "/patients"): h_query,
+    ("POST", "/trust/refresh"): h_refresh_trust,
+    ("GET", "/health"): h_health,
+    ("GET", "/metrics"): h_metrics,
+}
+
+async def dispatch(req):
+    handler = ROUTES.get((req["method"], req["path"]))
+    if handler:
+        return await handler(req)
+    # /patients/<id>
+    parts = req["path"].strip("/").split("/")
+    if len(parts) == 2 and parts[0] == "patients":
+        if req["method"] != "GET":
+            raise HTTPError(405, "Use GET")
+        return await h_get(req, parts[1])
+    raise HTTPError(404, "No such endpoint")
+
+# ---------- HTTP plumbing ----------
+
+async def read_request(reader):
+    """Parses one HTTP/1.1 request. Returns None when the client closed the connection."""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+
+    headers = {}
+    while True:
+        h = await reader.readline()
+        if h in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = h.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length", 0) or 0)
+    except ValueError:
+        raise HTTPError(400, "Invalid Content-Length")
+    if length > MAX_BODY:
+        raise HTTPError(413, "Request body too large")
+    body = await reader.readexactly(length) if length else b""
+
+    url = urlsplit(target)
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        raise HTTPError(400, "Body must be JSON")
+    return {
+        "method": method.upper(), "path": url.path.rstrip("/") or "/", "query": parse_qs(url.query),
+        "headers": headers, "json": data,
+        "keep_alive": headers.get("connection", "").lower() != "close" and version == "HTTP/1.1",
+    }
+
+def write_response(writer, status, payload, keep_alive, extra_headers=()):
+    body = json.dumps(payload, default=str).encode()
+    head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+            "Content-Type: application/json",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    head.extend(extra_headers)
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+
+async def handle_client(reader, writer):
+    try:
+        while True:
+            try:
+                req = await read_request(reader)
+            except HTTPError as e:
+                write_response(writer, e.status, {"error": e.message}, False)
+                break
+            if req is None:
+                break
+
+            extra = ()
+            # Backpressure: admit a bounded number of requests; shed load once the wait gets too long
+            try:
+                await asyncio.wait_for(_slots.acquire(), SERVICE_QUEUE_TIMEOUT)
+            except asyncio.TimeoutError:
+                status, payload, extra = 503, {"error": "Busy, retry later"}, ("Retry-After: 1",)
+            else:
+                try:
+                    status, payload = await dispatch(req)
+                except HTTPError as e:
+                    status, payload = e.status, {"error": e.message}
+                except PermissionError as e:
+                    status, payload = 403, {"error": str(e)}
+                except (RuntimeError, ValueError) as e:
+                    status, payload = 400, {"error": str(e)}
+                except Exception as e:
+                    status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+                finally:
+                    _slots.release()
+
+            write_response(writer, status, payload, req["keep_alive"], extra)
+            await writer.drain()
+            if not req["keep_alive"]:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+_executor = ThreadPoolExecutor(max_workers=SERVICE_WORKERS, thread_name_prefix="service")
+_slots = None
+
+async def serve(host=SERVICE_HOST, port=SERVICE_PORT):
+    global _slots
+    _slots = asyncio.Semaphore(SERVICE_MAX_IN_FLIGHT)
+    server = await asyncio.start_server(handle_client, host, port)
+    print(f"Secure DB service listening on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Secure DB HTTP/JSON service")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("Exiting.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# storage.py
+
+'''
+storage.py is the Storage Backend layer. The application keeps writing one SQL dialect (MySQL: %s placeholders,
+dictionary cursors, FOR UPDATE, ON DUPLICATE KEY UPDATE) and config.get_db_conn hands out a connection from the backend
+chosen by DB_BACKEND in .env.
+
+1) MySQL backend ("mysql", default): the pooled mysql.connector connections configured in config.py.
+
+2) SQLite backend ("sqlite"): an embedded database file (SQLITE_PATH) for single-node clinics and load tests, with no
+server and no network round-trips. SQLiteConnection implements the part of the mysql.connector API the app uses
+(cursor(dictionary=, buffered=), commit, rollback, close) and translates the dialect:
+    %s -> ?, ON DUPLICATE KEY UPDATE -> INSERT OR REPLACE (every upsert rewrites all non-key columns),
+    SELECT ... FOR UPDATE -> BEGIN IMMEDIATE + SELECT (takes the write lock, so concurrent inserts queue up).
+MySQL-only maintenance (db_setup.MIGRATIONS, the legacy-column migrations) is not needed: the SQLite schema starts current,
+and files created by an older version get the newer columns (SQLITE_UPGRADES) when first opened.
+
+3) Schema: the full SQLite schema (SQLITE_SCHEMA) is created on first use: WAL journal (readers never block the writer),
+synchronous=NORMAL, the same unique/cohort indexes as the MySQL migrations, and merkle_nodes as a WITHOUT ROWID table
+clustered on (lvl, idx) like InnoDB's primary key.
+
+4) Pooling: closed SQLite connections are rolled back and kept for reuse (up to pool_size), mirroring MySQL pool semantics.
+'''
+
+import sys
+import sqlite3
+import threading
+from functools import lru_cache
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL UNIQUE,
+    password_salt BLOB NOT NULL,
+    password_hash BLOB NOT NULL,
+    user_group TEXT NOT NULL CHECK (user_group IN ('H', 'R'))
+);
+CREATE TABLE IF NOT EXISTS patients (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    first_name TEXT,
+    last_name TEXT,
+    sensitive_enc BLOB,
+    gender_bidx BLOB,
+    age_bidx BLOB,
+    weight REAL,
+    height REAL,
+    health_history TEXT,
+    row_hmac BLOB NOT NULL,
+    merkle_leaf BLOB NOT NULL,
+    leaf_idx INTEGER,
+    key_version INTEGER NOT NULL DEFAULT 1,
+    hmac_version INTEGER NOT NULL DEFAULT 1
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_patients_leaf ON patients (leaf_idx);
+CREATE INDEX IF NOT EXISTS idx_patients_cohort ON patients (gender_bidx, age_bidx);
+CREATE INDEX IF NOT EXISTS idx_patients_age_bidx ON patients (age_bidx);
+CREATE TABLE IF NOT EXISTS merkle_nodes (
+    lvl INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    hash BLOB NOT NULL,
+    PRIMARY KEY (lvl, idx)
+) WITHOUT ROWID;
+"""
+
+# Columns added after SQLITE_SCHEMA first shipped: added to older database files on open (already there = skipped)
+SQLITE_UPGRADES = [
+    "ALTER TABLE patients ADD COLUMN key_version INTEGER NOT NULL DEFAULT 1",
+    "ALTER TABLE patients ADD COLUMN hmac_version INTEGER NOT NULL DEFAULT 1",
+]
+
+@lru_cache(maxsize=256)
+def translate(sql):
+    """MySQL statement -> SQLite statement."""
+    sql = sql.replace("%s", "?").replace(" FOR UPDATE", "")
+    if "ON DUPLICATE KEY UPDATE" in sql:
+        sql = sql[:sql.index("ON DUPLICATE KEY UPDATE")].replace("INSERT INTO", "INSERT OR REPLACE INTO", 1)
+    return sql
+
+class SQLiteCursor:
+    def __init__(self, conn, dictionary):
+        self._conn = conn
+        self._cur = conn.cursor()
+        self._dictionary = dictionary
+
+    def execute(self, sql, params=()):
+        if " FOR UPDATE" in sql and not self._conn.in_transaction:
+            # Row locks don't exist in SQLite: take the database write lock up front instead
+            self._conn.execute("BEGIN IMMEDIATE")
+        self._cur.execute(translate(sql), tuple(params))
+
+    def executemany(self, sql, seq):
+        self._cur.executemany(translate(sql), seq)
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return {d[0]: v for d, v in zip(self._cur.description, row)}
+
+    def fetchone(self):
+        return self._row(self._cur.fetchone())
+
+    def fetchmany(self, size=1):
+        return [self._row(r) for r in self._cur.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(r) for r in self._cur.fetchall()]
+
+    def __iter__(self):
+        return (self._row(r) for r in self._cur)
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cur.lastrowid
+
+    def close(self):
+        self._cur.close()
+
+class SQLiteConnection:
+    """A pooled SQLite connection with the mysql.connector surface used by the app. close() returns it to the pool."""
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    def cursor(self, dictionary=False, buffered=False):
+        return SQLiteCursor(self._raw, dictionary)
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def close(self):
+        if self._raw is not None:
+            self._pool.release(self._raw)
+            self._raw = None
+
+class SQLitePool:
+    def __init__(self, path, pool_size, timeout):
+        self.path = path
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        raw = self._open()
+        raw.executescript(SQLITE_SCHEMA)
+        for stmt in SQLITE_UPGRADES:
+            try:
+                raw.execute(stmt)
+            except sqlite3.OperationalError as e:
+                if "duplicate column" not in str(e):
+                    raise
+        raw.commit()
+        raw.close()
+
+    def _open(self):
+        raw = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+        raw.execute("PRAGMA journal_mode=WAL")
+        raw.execute("PRAGMA synchronous=NORMAL")
+        return raw
+
+    def get_connection(self):
+        with self._lock:
+            raw = self._idle.pop() if self._idle else None
+        return SQLiteConnection(self, raw or self._open())
+
+    def release(self, raw):
+        # Like pool_reset_session: never hand on an open transaction
+        raw.rollback()
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(raw)
+                return
+        raw.close()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def sqlite_pool(path, pool_size=5, timeout=10):
+    """Shared pool for one database file (schema created on first use)."""
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = SQLitePool(path, pool_size, timeout)
+        return pool
+
+def integrity_errors():
+    """Duplicate-key exception classes of the loaded drivers (mysql.connector is only checked if something imported it)."""
+    errors = (sqlite3.IntegrityError,)
+    mysql = sys.modules.get("mysql.connector")
+    return errors + (mysql.IntegrityError,) if mysql else errors
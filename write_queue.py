@@ -0,0 +1,191 @@
+# write_queue.py
+
+'''
+write_queue.py is the Group-Commit Insert Queue for many sessions inserting at once (service.py).
+A plain insert_patient pays one transaction, one fsync and one trusted-root refresh per row; here concurrent inserts share them.
+
+1) submit_insert fn checks the session (Group H only) and seals the row (AES-GCM, blind indexes, HMAC, Merkle leaf) in the
+CALLER's thread, so the crypto runs in parallel, then hands it to the writer thread and returns a Future straight away.
+
+2) The writer thread takes the first waiting row, then keeps collecting for up to WRITE_QUEUE_WINDOW_MS or until
+WRITE_QUEUE_MAX_BATCH rows. Rows that arrive while a batch is being written simply make the next batch bigger, so batches
+grow with load and a lone insert waits at most one window.
+
+3) One transaction per batch: lock_frontier, explicit ids after MAX(id), append_leaves, one executemany, one commit.
+Each Future then resolves to {"id", "leaf_idx"} of its own row. If the batch's transaction fails (nothing from it is
+kept), every row is retried in its own transaction, so one bad row fails only its own caller with its own exception.
+
+4) The trusted root is advanced once per batch, straight from the batch's leaves (as bulk_seed.py does). The table is not
+re-read unless the saved trust did not end where the batch started; then update_client_trust runs.
+'''
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from config import db_conn, WRITE_QUEUE_WINDOW_MS, WRITE_QUEUE_MAX_BATCH, AES_KEY_VERSION, HMAC_KEY_VERSION
+from access_control import (seal_row, update_client_trust, load_trusted_frontier, save_trusted_frontier,
+                            trust_lock, load_keys_or_fail)
+from merkle_store import lock_frontier, append_leaves
+from merkle_forest import append_leaf
+from merkle_diff import extend_snapshot
+from auth import resolve_session
+from metrics import stage, count
+
+QUEUE_INSERT_SQL = f"""INSERT INTO patients
+             (id, first_name, last_name, sensitive_enc, gender_bidx, age_bidx, weight, height, health_history,
+              row_hmac, merkle_leaf, leaf_idx, key_version, hmac_version)
+             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, {AES_KEY_VERSION:d}, {HMAC_KEY_VERSION:d})"""
+
+_queue = None
+_writer = None
+_writer_lock = threading.Lock()
+
+def _ensure_writer(window_ms=WRITE_QUEUE_WINDOW_MS, max_batch=WRITE_QUEUE_MAX_BATCH):
+    """Starts the writer thread on first use."""
+    global _queue, _writer
+    with _writer_lock:
+        if _writer is None:
+            _queue = queue.Queue()
+            _writer = threading.Thread(target=_writer_loop, args=(_queue, window_ms / 1000, max_batch),
+                                       name="write-queue", daemon=True)
+            _writer.start()
+        return _queue
+
+def submit_insert(session, first, last, gender, age, weight, height, history):
+    """
+    Queues one patient for the next group commit. Only Group H allowed.
+    RETURNS a concurrent.futures.Future resolving to {"id", "leaf_idx"}. Bad input or a denied session raises here, at once.
+    """
+    session = resolve_session(session)
+    if session['user_group'] != 'H':
+        raise PermissionError("Access Denied: Group H only.")
+    aes_k, hmac_k = load_keys_or_fail()
+    with stage("insert.seal"):
+        params = seal_row(aes_k, hmac_k, first, last, gender, age, weight, height, history)
+    fut = Future()
+    _ensure_writer().put((params, fut))
+    return fut
+
+def insert_patient_grouped(session, first, last, gender, age, weight, height, history):
+    """Blocking form of submit_insert. RETURNS {"id", "leaf_idx"} once the row's batch is committed."""
+    return submit_insert(session, first, last, gender, age, weight, height, history).result()
+
+def _collect(q, window, max_batch):
+    """Blocks for the first entry, then gathers more until the window closes or the batch is full. None = shutdown."""
+    first = q.get()
+    if first is None:
+        return None
+    batch = [first]
+    deadline = time.monotonic() + window
+    while len(batch) < max_batch:
+        remaining = deadline - time.monotonic()
+        try:
+            entry = q.get(timeout=remaining) if remaining > 0 else q.get_nowait()
+        except queue.Empty:
+            break
+        if entry is None:
+            # Finish this batch, then stop
+            q.put(None)
+            break
+        batch.append(entry)
+    return batch
+
+def _writer_loop(q, window, max_batch):
+    while True:
+        batch = _collect(q, window, max_batch)
+        if batch is None:
+            return
+        # Futures that were cancelled before the write are dropped from the batch
+        batch = [(params, fut) for params, fut in batch if fut.set_running_or_notify_cancel()]
+        if not batch:
+            continue
+        for group, (first_id, first_leaf, indexes) in _commit_groups(batch):
+            try:
+                _extend_trust(first_leaf, first_id, [params[-1] for params, _ in group])
+            except Exception as e:
+                for _, fut in group:
+                    fut.set_exception(e)
+                continue
+            for n, ((_, fut), i) in enumerate(zip(group, indexes)):
+                fut.set_result({"id": first_id + n, "leaf_idx": i})
+
+def _commit_groups(batch):
+    """
+    Commits the batch in one transaction; if that fails, commits each row in its own transaction instead.
+    Rows that fail alone get their exception set here. RETURNS [(entries, (first_id, first_leaf, indexes))] committed.
+    """
+    try:
+        return [(batch, _commit_batch([params for params, _ in batch]))]
+    except Exception as e:
+        if len(batch) == 1:
+            batch[0][1].set_exception(e)
+            return []
+    count("insert.batch_retries")
+    committed = []
+    for params, fut in batch:
+        try:
+            committed.append(([(params, fut)], _commit_batch([params])))
+        except Exception as e:
+            fut.set_exception(e)
+    return committed
+
+def write_batch(sealed):
+    """
+    Writes sealed rows (seal_row tuples) in ONE transaction and advances the trusted root once.
+    RETURNS [{"id", "leaf_idx"}] in input order.
+    """
+    first_id, first_leaf, indexes = _commit_batch(sealed)
+    _extend_trust(first_leaf, first_id, [params[-1] for params in sealed])
+    return [{"id": first_id + n, "leaf_idx": i} for n, i in enumerate(indexes)]
+
+def _commit_batch(sealed):
+    """The batch's one transaction. RETURNS (first_id, first_leaf, leaf indexes); on failure nothing is kept."""
+    with db_conn() as conn:
+        cur = conn.cursor(buffered=True)
+        try:
+            # 1. Lock the tree's right edge: ids and leaf positions after it are ours until commit
+            with stage("insert.merkle"):
+                tree = lock_frontier(cur)
+                first_leaf = tree["count"]
+                cur.execute("SELECT MAX(id) FROM patients")
+                first_id = (cur.fetchone()[0] or 0) + 1
+                leaves = [params[-1] for params in sealed]
+                indexes = append_leaves(cur, tree, leaves)
+            # 2. One statement, one commit for the whole batch
+            with stage("insert.db"):
+                cur.executemany(QUEUE_INSERT_SQL, [(first_id + n,) + params + (i,)
+                                                   for n, (params, i) in enumerate(zip(sealed, indexes))])
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    count("insert.rows", len(sealed))
+    count("insert.batches")
+    return first_id, first_leaf, indexes
+
+def _extend_trust(first_leaf, first_id, leaves):
+    """
+    Advances the trusted root from the leaves just committed (point 4).
+    The table is re-read only when the saved trust did not end where they begin.
+    """
+    with trust_lock():
+        with stage("trust.merkle"):
+            trust = load_trusted_frontier(first_leaf)
+            if trust is not None:
+                old_count, formed = trust["count"], []
+                for leaf in leaves:
+                    append_leaf(trust, leaf, formed)
+                extend_snapshot(old_count, formed)
+                save_trusted_frontier(trust, first_id + len(leaves) - 1)
+        if trust is None:
+            update_client_trust()
+
+def shutdown_write_queue():
+    """Writes whatever is still queued, then stops the writer thread."""
+    global _queue, _writer
+    with _writer_lock:
+        if _writer is not None:
+            _queue.put(None)
+            _writer.join()
+        _queue, _writer = None, None